@@ -151,7 +151,7 @@ export default async function resumeRoutes(server: FastifyInstance) {
                     source_type: 'resume',
                     document_name: fileName,
                     content: text,
-                })
+                }, { async: true })
             } catch (e) {
                 console.error('Failed to add to documents API:', e)
             }
@@ -327,7 +327,7 @@ export default async function resumeRoutes(server: FastifyInstance) {
                         source_type: 'resume',
                         document_name: resume.fileName,
                         content: resume.text,
-                    })
+                    }, { async: true })
                 } catch (e) {
                     console.error('Failed to update documents API:', e)
                 }
@@ -2,9 +2,24 @@ import fetch from 'node-fetch'
 
 const BASE_URL = process.env.RAG_API_URL || 'http://resumeparsing-dev:8000'
 
+type DocumentPayload = { source_id: string; source_type: 'resume' | 'dialogue' | 'vacancy'; document_name: string; content: string }
+
+type AddDocumentOptions = {
+    // async: документ ставится в очередь RAG-сервиса, ответ 202 с job_id без ожидания эмбеддингов
+    async?: boolean
+    // сколько миллисекунд подождать готовности в async-режиме (read-your-writes)
+    waitMs?: number
+}
+
 export const documentsApi = {
-    async addDocument(payload: { source_id: string; source_type: 'resume' | 'dialogue' | 'vacancy'; document_name: string; content: string }) {
-        const res = await fetch(`${BASE_URL}/api/documents`, {
+    async addDocument(payload: DocumentPayload, options: AddDocumentOptions = {}) {
+        const params = new URLSearchParams()
+        if (options.async) {
+            params.set('mode', 'async')
+            if (options.waitMs) params.set('wait_ms', String(options.waitMs))
+        }
+        const query = params.toString()
+        const res = await fetch(`${BASE_URL}/api/documents${query ? `?${query}` : ''}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -15,9 +30,17 @@ export const documentsApi = {
             throw new Error(`documentsApi.addDocument failed: ${res.status} ${msg}`)
         }
         return res.json()
+    },
+
+    async getJob(jobId: string) {
+        const res = await fetch(`${BASE_URL}/api/documents/jobs/${encodeURIComponent(jobId)}`)
+        if (!res.ok) {
+            let msg = ''
+            try { msg = await res.text() } catch { }
+            throw new Error(`documentsApi.getJob failed: ${res.status} ${msg}`)
+        }
+        return res.json()
     }
 }
 
 export default documentsApi
-
-
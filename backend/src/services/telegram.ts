@@ -5,6 +5,12 @@ interface NotificationData {
     userId: string
 }
 
+export interface BulkNotificationResult {
+    batchId: string
+    queued: number
+    skipped: string[]
+}
+
 export class TelegramService {
     private botApiUrl: string
 
@@ -68,6 +74,69 @@ export class TelegramService {
         }
     }
 
+    /**
+     * Массовая рассылка одним запросом: бот ставит сообщения в очередь и отправляет
+     * с учётом лимитов Telegram, статус доставки — getBulkStatus(batchId)
+     * @param text - текст уведомления
+     * @param userIds - ID пользователей в системе
+     * @returns Promise<BulkNotificationResult | null> - ID пакета и пользователи без Telegram
+     */
+    async notifyManyTg(text: string, userIds: string[]): Promise<BulkNotificationResult | null> {
+        try {
+            if (!this.botApiUrl) {
+                console.error('BOT_API_URL не настроен')
+                return null
+            }
+
+            const users = await prisma.user.findMany({
+                where: { id: { in: userIds }, telegram_id: { not: null } },
+                select: { id: true, telegram_id: true }
+            })
+            const connected = new Set(users.map((user) => user.id))
+            const skipped = userIds.filter((id) => !connected.has(id))
+            if (users.length === 0) {
+                return { batchId: '', queued: 0, skipped }
+            }
+
+            const response = await fetch(`${this.botApiUrl}/notifications`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ text, userIds: users.map((user) => user.telegram_id) })
+            })
+
+            if (!response.ok) {
+                console.error(`Ошибка массовой отправки в Telegram: ${response.status} ${response.statusText}`)
+                return null
+            }
+
+            const { batchId, total } = await response.json() as { batchId: string, total: number }
+            console.log(`Рассылка ${batchId}: в очереди ${total}, без Telegram ${skipped.length}`)
+            return { batchId, queued: total, skipped }
+        } catch (error) {
+            console.error('Ошибка при массовой отправке в Telegram:', error)
+            return null
+        }
+    }
+
+    /**
+     * Статус доставки массовой рассылки
+     * @param batchId - ID пакета из notifyManyTg
+     */
+    async getBulkStatus(batchId: string): Promise<unknown | null> {
+        try {
+            const response = await fetch(`${this.botApiUrl}/notifications/${batchId}`)
+            if (!response.ok) {
+                return null
+            }
+            return await response.json()
+        } catch (error) {
+            console.error('Ошибка при получении статуса рассылки:', error)
+            return null
+        }
+    }
+
     /**
      * Проверяет, подключен ли пользователь к Telegram
      * @param userId - ID пользователя в системе
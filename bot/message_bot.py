@@ -1,20 +1,31 @@
 import asyncio
 import logging
 import os
-import threading
-from typing import Dict, Optional, Set
+import time
+from typing import List, Optional, Set
 import aiohttp
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
+from notifier import NOTIFY_MAX_RECIPIENTS, Delivery, Notifier, NotifierBusy
+from state_store import UserStateStore
+
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BACKEND_API_URL = os.getenv("BACKEND_API_URL")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+# Общий пул соединений к бэкенду на весь процесс
+BACKEND_HTTP_POOL = int(os.getenv("BACKEND_HTTP_POOL", "100"))
+# Сколько апдейтов Telegram обрабатывать параллельно (по умолчанию PTB обрабатывает по одному)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "256"))
+# Сколько POST /notification ждёт отправки; дольше — 202 и ссылка на статус
+NOTIFY_SEND_TIMEOUT_S = float(os.getenv("NOTIFY_SEND_TIMEOUT_S", "10"))
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN environment variable is required")
@@ -27,36 +38,55 @@ class NotificationRequest(BaseModel):
     userId: str
 
 
+class BulkNotificationRequest(BaseModel):
+    # Один текст всем userIds и/или персональные сообщения
+    text: Optional[str] = None
+    userIds: List[str] = []
+    messages: List[NotificationRequest] = []
+
+
 class TelegramBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, user_states: Optional[UserStateStore] = None):
         self.token = token
         self.application: Optional[Application] = None
-        self.user_states: Dict[int, str] = {}
+        self.user_states = user_states or UserStateStore()
+        self.session: Optional[aiohttp.ClientSession] = None
         self.running = False
+        self.notifier = Notifier(self._send_message)
 
     async def initialize(self):
-        self.application = Application.builder().token(self.token).build()
+        """Запуск в текущем цикле событий (том же, где работает API); возвращается, когда бот готов."""
+        timeout = aiohttp.ClientTimeout(total=10)
+        self.session = aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=BACKEND_HTTP_POOL))
+
+        self.application = Application.builder().token(self.token).concurrent_updates(BOT_CONCURRENT_UPDATES).build()
         self.application.add_handler(CommandHandler("start", self._start))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_text))
 
         await self.application.initialize()
         await self.application.start()
-        self.running = True
+        self.notifier.start()
         await self.application.updater.start_polling()
+        self.running = True
+
+        pruned = await self.user_states.prune()
+        if pruned:
+            logger.warning(f"Удалено устаревших состояний пользователей: {pruned}")
 
-        while self.running:
-            await asyncio.sleep(1)
+    @property
+    def ready(self) -> bool:
+        return self.running and bool(self.application and self.application.updater.running)
 
     async def _start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        self.user_states[user_id] = "waiting_code"
+        await self.user_states.set(user_id, "waiting_code")
         await update.message.reply_text("Введите код из профиля:")
 
     async def _handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         code = update.message.text.strip()
 
-        if self.user_states.get(user_id) == "waiting_code":
+        if await self.user_states.get(user_id) == "waiting_code":
             await self._process_code(update, code)
         else:
             await update.message.reply_text("Введите /start")
@@ -68,63 +98,145 @@ class TelegramBot:
             url = f"{BACKEND_API_URL}/connect-tg"
             params = {"code": code, "telegramId": str(user_id)}
 
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        self.user_states[user_id] = "connected"
-                        await update.message.reply_text("✅ Подключение успешно!")
-                    else:
-                        await update.message.reply_text("❌ Неверный код")
+            async with self.session.get(url, params=params) as response:
+                if response.status == 200:
+                    await self.user_states.set(user_id, "connected")
+                    await update.message.reply_text("✅ Подключение успешно!")
+                else:
+                    await update.message.reply_text("❌ Неверный код")
         except:
             await update.message.reply_text("❌ Ошибка подключения")
 
-    async def send_notification(self, user_id: int, text: str) -> bool:
-        try:
-            await self.application.bot.send_message(chat_id=user_id, text=text)
-            return True
-        except:
-            return False
+    async def _send_message(self, chat_id: int, text: str):
+        await self.application.bot.send_message(chat_id=chat_id, text=text)
+
+    async def send_notification(self, user_id: int, text: str, timeout: Optional[float] = None) -> Delivery:
+        # Через общую очередь (в обход массовых рассылок): лимиты Telegram соблюдаются и здесь
+        return await self.notifier.send_one(user_id, text, timeout)
 
     async def stop(self):
         self.running = False
+        await self.notifier.stop()
         if self.application:
-            await self.application.stop()
+            if self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
             await self.application.shutdown()
+        if self.session:
+            await self.session.close()
+        self.user_states.close()
 
 
 class NotificationAPI:
     def __init__(self, bot: TelegramBot):
         self.bot = bot
         self.app = FastAPI()
+        self.started_at = time.time()
         self._setup_routes()
 
+    def _require_ready(self):
+        if not self.bot.ready:
+            raise HTTPException(status_code=503, detail="Bot is not ready")
+
     def _setup_routes(self):
+        @self.app.get("/health")
+        async def health():
+            return {"status": "ok"}
+
+        @self.app.get("/ready")
+        async def ready():
+            # 503, пока бот не подключился к Telegram: оркестратор не шлёт трафик раньше времени
+            status = {
+                "ready": self.bot.ready,
+                "uptime_s": round(time.time() - self.started_at, 1),
+                "notifications": self.bot.notifier.metrics(),
+            }
+            if not self.bot.ready:
+                raise HTTPException(status_code=503, detail=status)
+            return status
+
         @self.app.post("/notification")
         async def send_notification(request: NotificationRequest):
             try:
                 user_id = int(request.userId)
-                success = await self.bot.send_notification(user_id, request.text)
-                if success:
-                    return {"success": True}
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid userId")
+            self._require_ready()
+            delivery = await self.bot.send_notification(user_id, request.text, NOTIFY_SEND_TIMEOUT_S)
+            if delivery.status == "sent":
+                return {"success": True}
+            if delivery.status == "failed":
                 raise HTTPException(status_code=500, detail="Send failed")
+            # Не успели за NOTIFY_SEND_TIMEOUT_S (флуд-контроль, повторы) — сообщение остаётся в очереди
+            return JSONResponse({
+                "success": False,
+                "status": delivery.status,
+                "batchId": delivery.batch_id,
+                "statusUrl": f"/notifications/{delivery.batch_id}",
+            }, status_code=202)
+
+        @self.app.post("/notifications", status_code=202)
+        async def send_notifications(request: BulkNotificationRequest):
+            messages = []
+            try:
+                if request.userIds:
+                    if not request.text:
+                        raise HTTPException(status_code=400, detail="text is required with userIds")
+                    messages += [(int(user_id), request.text) for user_id in request.userIds]
+                messages += [(int(m.userId), m.text) for m in request.messages]
             except ValueError:
                 raise HTTPException(status_code=400, detail="Invalid userId")
+            if not messages:
+                raise HTTPException(status_code=400, detail="No recipients")
+            if len(messages) > NOTIFY_MAX_RECIPIENTS:
+                raise HTTPException(status_code=413, detail=f"Too many recipients (max {NOTIFY_MAX_RECIPIENTS})")
+            self._require_ready()
+            try:
+                status = self.bot.notifier.submit(messages).to_dict(items=False)
+            except NotifierBusy as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+            return {**status, "statusUrl": f"/notifications/{status['batchId']}"}
+
+        @self.app.get("/notifications/metrics")
+        async def notification_metrics():
+            return self.bot.notifier.metrics()
+
+        @self.app.get("/notifications/{batch_id}")
+        async def notification_status(batch_id: str):
+            batch = self.bot.notifier.batch(batch_id)
+            if batch is None:
+                raise HTTPException(status_code=404, detail="Batch not found")
+            return batch.to_dict()
 
-    def run(self):
-        uvicorn.run(self.app, host="0.0.0.0", port=8000, log_level="error")
+    def server(self) -> uvicorn.Server:
+        return uvicorn.Server(uvicorn.Config(self.app, host="0.0.0.0", port=API_PORT, log_level="error"))
 
 
 class VTBSystem:
+    """Бот и API в одном цикле событий: uvicorn — задача этого цикла, бот запускается рядом."""
+
     def __init__(self):
         self.bot = TelegramBot(BOT_TOKEN)
         self.api = NotificationAPI(self.bot)
 
     async def start(self):
-        api_thread = threading.Thread(target=self.api.run, daemon=True)
-        api_thread.start()
-        await asyncio.sleep(2)
-        await self.bot.initialize()
+        server = self.api.server()
+        api_task = asyncio.create_task(server.serve())
+        # Ждём, пока uvicorn действительно начнёт принимать соединения
+        while not server.started:
+            if api_task.done():
+                api_task.result()
+                return
+            await asyncio.sleep(0.05)
+        try:
+            await self.bot.initialize()
+            # Работаем, пока uvicorn не получит SIGINT/SIGTERM
+            await api_task
+        finally:
+            server.should_exit = True
+            await asyncio.gather(api_task, return_exceptions=True)
+            await self.bot.stop()
 
 
 async def main():
@@ -133,4 +245,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
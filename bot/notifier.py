@@ -0,0 +1,273 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат — держимся чуть ниже
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_GLOBAL_BURST = int(os.getenv("NOTIFY_GLOBAL_BURST", "25"))
+NOTIFY_CHAT_INTERVAL_S = float(os.getenv("NOTIFY_CHAT_INTERVAL_S", "1.0"))
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "16"))
+# Попыток на сетевые ошибки; флуд-контроль (RetryAfter) их не тратит, у него свой, намного больший предел
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_MAX_FLOOD_WAITS = int(os.getenv("NOTIFY_MAX_FLOOD_WAITS", "100"))
+NOTIFY_KEEP_BATCHES = int(os.getenv("NOTIFY_KEEP_BATCHES", "200"))
+# Предел получателей в одном пакете и сообщений, ожидающих отправки, на весь бот
+NOTIFY_MAX_RECIPIENTS = int(os.getenv("NOTIFY_MAX_RECIPIENTS", "10000"))
+NOTIFY_MAX_PENDING = int(os.getenv("NOTIFY_MAX_PENDING", "100000"))
+
+# Одиночные (напоминание об интервью) идут раньше массовых рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class NotifierBusy(Exception):
+    """Очередь уведомлений переполнена — пакет не принят."""
+
+
+class TokenBucket:
+    """rate сообщений в секунду с запасом burst; pause — флуд-контроль Telegram (RetryAfter)."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class Delivery:
+    def __init__(self, batch_id: str, index: int, chat_id: int, text: str, priority: int = PRIORITY_BULK):
+        self.batch_id = batch_id
+        self.priority = priority
+        self.index = index
+        self.chat_id = chat_id
+        self.text = text
+        self.status = "queued"  # queued | retrying | sent | failed
+        self.attempts = 0
+        self.network_errors = 0
+        self.flood_waits = 0
+        self.error: Optional[str] = None
+        self.sent_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "chatId": str(self.chat_id),
+            "status": self.status,
+            "attempts": self.attempts,
+            "floodWaits": self.flood_waits,
+            "error": self.error,
+            "sentAt": self.sent_at,
+        }
+
+
+class NotificationBatch:
+    def __init__(self, deliveries: List[Delivery], batch_id: str):
+        self.id = batch_id
+        self.deliveries = deliveries
+        self.created_at = time.time()
+
+    @property
+    def done(self) -> bool:
+        return all(d.status in ("sent", "failed") for d in self.deliveries)
+
+    def to_dict(self, items: bool = True) -> dict:
+        counts: Dict[str, int] = {}
+        for d in self.deliveries:
+            counts[d.status] = counts.get(d.status, 0) + 1
+        result = {
+            "batchId": self.id,
+            "total": len(self.deliveries),
+            "done": self.done,
+            "counts": counts,
+            "createdAt": self.created_at,
+        }
+        if items:
+            result["items"] = [d.to_dict() for d in self.deliveries]
+        return result
+
+
+class Notifier:
+    """
+    Исходящая очередь уведомлений: воркеры берут сообщения из asyncio.PriorityQueue
+    (одиночные раньше массовых, внутри приоритета — по порядку постановки), общий
+    token bucket держит глобальный темп, а чат, которому писали меньше
+    NOTIFY_CHAT_INTERVAL_S назад, откладывается (не занимая воркер). RetryAfter
+    ставит на паузу всю отправку и возвращает сообщение в очередь, сетевые
+    ошибки повторяются с backoff, Forbidden/BadRequest — окончательный отказ.
+    Работает в цикле событий бота: start() вызывается из него.
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable[object]]):
+        self._send = send
+        self._bucket = TokenBucket(NOTIFY_GLOBAL_RATE, NOTIFY_GLOBAL_BURST)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._pending = 0
+        self._workers: List[asyncio.Task] = []
+        self._next_chat_slot: Dict[int, float] = {}
+        self._batches: "OrderedDict[str, NotificationBatch]" = OrderedDict()
+        self._delayed = 0
+        self._stats = {"sent": 0, "failed": 0, "retries": 0, "flood_waits": 0}
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(NOTIFY_WORKERS)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, messages: List[tuple], priority: int = PRIORITY_BULK) -> NotificationBatch:
+        """
+        messages — [(chat_id, text)]. Возвращает пакет; статус — batch.to_dict().
+        Массовый пакет сверх NOTIFY_MAX_PENDING ожидающих сообщений — NotifierBusy.
+        """
+        if priority != PRIORITY_INTERACTIVE and self._pending + len(messages) > NOTIFY_MAX_PENDING:
+            raise NotifierBusy(f"{self._pending} notifications pending")
+        batch_id = uuid.uuid4().hex
+        deliveries = [Delivery(batch_id, i, chat_id, text, priority) for i, (chat_id, text) in enumerate(messages)]
+        loop = asyncio.get_running_loop()
+        for delivery in deliveries:
+            delivery.future = loop.create_future()
+            self._put(delivery)
+        self._pending += len(deliveries)
+        if len(self._next_chat_slot) > 10000:
+            now = time.monotonic()
+            self._next_chat_slot = {chat: slot for chat, slot in self._next_chat_slot.items() if slot > now}
+        batch = NotificationBatch(deliveries, batch_id)
+        self._batches[batch_id] = batch
+        while len(self._batches) > NOTIFY_KEEP_BATCHES:
+            self._batches.popitem(last=False)
+        return batch
+
+    async def send_one(self, chat_id: int, text: str, timeout: Optional[float] = None) -> Delivery:
+        """
+        Одно сообщение вне очереди массовых рассылок (но в общих лимитах Telegram).
+        Ждёт итогового статуса не дольше timeout; по истечении возвращает доставку
+        в статусе queued/retrying — она продолжит отправляться.
+        """
+        delivery = self.submit([(chat_id, text)], PRIORITY_INTERACTIVE).deliveries[0]
+        try:
+            await asyncio.wait_for(asyncio.shield(delivery.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return delivery
+
+    def batch(self, batch_id: str) -> Optional[NotificationBatch]:
+        return self._batches.get(batch_id)
+
+    def metrics(self) -> dict:
+        return {
+            **self._stats,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "pending": self._pending,
+            "delayed": self._delayed,
+            "workers": len(self._workers),
+            "globalRate": NOTIFY_GLOBAL_RATE,
+            "chatIntervalS": NOTIFY_CHAT_INTERVAL_S,
+        }
+
+    # --- Внутреннее ---
+
+    def _put(self, delivery: Delivery):
+        self._queue.put_nowait((delivery.priority, next(self._seq), delivery))
+
+    def _requeue(self, delivery: Delivery, delay: float):
+        self._delayed += 1
+
+        def put():
+            self._delayed -= 1
+            self._put(delivery)
+
+        asyncio.get_running_loop().call_later(delay, put)
+
+    async def _worker(self):
+        while True:
+            _, _, delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                logger.exception("Notification worker error")
+                self._finish(delivery, "failed", str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, delivery: Delivery):
+        wait = self._next_chat_slot.get(delivery.chat_id, 0.0) - time.monotonic()
+        if wait > 0:
+            self._requeue(delivery, wait)
+            return
+        # Слот чата занимаем до ожидания токена: параллельный воркер со следующим сообщением
+        # в тот же чат отложит его, а после токена сдвигаем слот на фактическое время отправки
+        self._next_chat_slot[delivery.chat_id] = time.monotonic() + NOTIFY_CHAT_INTERVAL_S
+        await self._bucket.acquire()
+        self._next_chat_slot[delivery.chat_id] = time.monotonic() + NOTIFY_CHAT_INTERVAL_S
+        delivery.attempts += 1
+        try:
+            await self._send(delivery.chat_id, delivery.text)
+        except RetryAfter as e:
+            retry_after = float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+            self._stats["flood_waits"] += 1
+            self._bucket.pause(retry_after)
+            # Сообщение не виновато: Telegram просит подождать весь бот — попытку не засчитываем
+            delivery.flood_waits += 1
+            self._retry(delivery, retry_after, f"RetryAfter {retry_after:.0f}s",
+                        delivery.flood_waits >= NOTIFY_MAX_FLOOD_WAITS)
+        except (Forbidden, BadRequest) as e:
+            # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+            self._finish(delivery, "failed", str(e))
+        except NetworkError as e:
+            delivery.network_errors += 1
+            self._retry(delivery, min(30.0, 2 ** delivery.network_errors), str(e),
+                        delivery.network_errors >= NOTIFY_MAX_ATTEMPTS)
+        else:
+            delivery.sent_at = time.time()
+            self._finish(delivery, "sent")
+
+    def _retry(self, delivery: Delivery, delay: float, error: str, exhausted: bool):
+        if exhausted:
+            self._finish(delivery, "failed", error)
+            return
+        self._stats["retries"] += 1
+        delivery.status = "retrying"
+        delivery.error = error
+        self._requeue(delivery, delay)
+
+    def _finish(self, delivery: Delivery, status: str, error: Optional[str] = None):
+        if delivery.status not in ("sent", "failed"):
+            self._pending -= 1
+        delivery.status = status
+        delivery.error = error
+        self._stats[status] += 1
+        if delivery.future is not None and not delivery.future.done():
+            delivery.future.set_result(status)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Состояние диалога с пользователем: переживает перезапуск, в памяти — только последние BOT_STATE_CACHE
+BOT_STATE_DB = os.getenv("BOT_STATE_DB", "bot_state.sqlite3")
+BOT_STATE_CACHE = int(os.getenv("BOT_STATE_CACHE", "10000"))
+# Записи старше этого удаляются (брошенный ввод кода, давно неактивные пользователи)
+BOT_STATE_TTL_DAYS = float(os.getenv("BOT_STATE_TTL_DAYS", "30"))
+
+_MISSING = object()
+
+
+class UserStateStore:
+    """
+    user_id -> состояние ("waiting_code", "connected"). SQLite (WAL) на диске + LRU в памяти:
+    горячие пользователи читаются без диска, память ограничена, таблица чистится по TTL.
+    Обращения к SQLite выполняются в пуле потоков, цикл событий не блокируют.
+    """
+
+    def __init__(self, path: str = BOT_STATE_DB, cache_size: int = BOT_STATE_CACHE,
+                 ttl_days: float = BOT_STATE_TTL_DAYS):
+        self.cache_size = cache_size
+        self.ttl_s = ttl_days * 86400
+        self._cache: "OrderedDict[int, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_states ("
+            "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS user_states_updated ON user_states (updated_at)")
+
+    async def get(self, user_id: int) -> Optional[str]:
+        cached = self._cache_get(user_id)
+        if cached is not _MISSING:
+            return cached
+        state = await asyncio.to_thread(self._read, user_id)
+        self._cache_put(user_id, state)
+        return state
+
+    async def set(self, user_id: int, state: str):
+        self._cache_put(user_id, state)
+        await asyncio.to_thread(self._write, user_id, state)
+
+    async def prune(self) -> int:
+        return await asyncio.to_thread(self._prune)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM user_states").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- Внутреннее ---
+
+    def _cache_get(self, user_id):
+        with self._lock:
+            if user_id in self._cache:
+                self._cache.move_to_end(user_id)
+                return self._cache[user_id]
+        return _MISSING
+
+    def _cache_put(self, user_id, state):
+        with self._lock:
+            self._cache[user_id] = state
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _read(self, user_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM user_states WHERE user_id = ? AND updated_at > ?",
+                (user_id, time.time() - self.ttl_s),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, user_id, state):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO user_states (user_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (user_id, state, time.time()),
+            )
+
+    def _prune(self):
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM user_states WHERE updated_at <= ?", (time.time() - self.ttl_s,)
+            ).rowcount
@@ -1,17 +1,46 @@
 import os
-import re
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from werkzeug.utils import secure_filename
-from sentiment_analyzer import analyze_sentiment
+import json
+import tempfile
+import time
+from flask import Flask, Request, render_template, request, redirect, url_for, jsonify, Response, stream_with_context
+from sentiment_analyzer import (
+    SENTIMENT_WARMUP, analyze_bytes, analyze_audio, format_analysis, model_status, score_sentiments,
+    sentiment_worker, warm_up,
+)
+from audio_buffer import from_pcm
+from batch import iter_batch
+from result_cache import cache_key, is_cacheable, result_cache
+from streaming import StreamingPauseAnalyzer, stream_sessions
 
 # --- Настройка Flask ---
+# Пакетная загрузка (все ответы интервью) больше обычного лимита на один файл
+BATCH_MAX_UPLOAD_MB = int(os.environ.get('BATCH_MAX_UPLOAD_MB', '512'))
+
+
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'api_analyze_batch':
+            return BATCH_MAX_UPLOAD_MB * 1024 * 1024
+        return super().max_content_length
+
+
 app = Flask(__name__)
+app.request_class = AppRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
 
 # Создаем папку для загрузок, если ее нет
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Модель грузится в фоне, сервер начинает принимать запросы сразу; готовность — /ready.
+# Под gunicorn --preload модель уже загружена в мастере (SENTIMENT_WARMUP=eager),
+# а пробный прогон делает каждый воркер после fork (см. gunicorn.conf.py)
+PROCESS_STARTED_AT = time.time()
+# __mp_main__ — app.py, заново импортированный процессами декодирования batch.py (spawn): модель им не нужна
+if SENTIMENT_WARMUP == 'background' and __name__ != '__mp_main__':
+    warm_up()
+
 # --- Роуты ---
 
 @app.route('/')
@@ -30,15 +59,8 @@ def upload_file():
         return redirect(request.url)
 
     if file and file.filename.lower().endswith('.wav'):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        # Запускаем анализ
-        analysis_result = analyze_sentiment(filepath)
-
-        # Удаляем временный файл после анализа
-        os.remove(filepath)
+        # Анализ прямо из памяти, без сохранения в uploads/
+        analysis_result = analyze_bytes(file.read())
 
         return render_template('result.html', result=analysis_result)
     else:
@@ -58,64 +80,252 @@ def api_analyze():
     if not file.filename.lower().endswith('.wav'):
         return jsonify({"error": "please upload a .wav file"}), 400
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-
     # Получаем язык из формы, по умолчанию 'ru'
     lang = request.form.get('lang', 'ru')
 
-    try:
-        analysis_result = analyze_sentiment(filepath, lang=lang)
-    finally:
-        # Удаляем временный файл после анализа
-        try:
-            os.remove(filepath)
-        except Exception:
-            pass
+    # Тело читается в память и декодируется оттуда же — без file.save и повторного чтения с диска
+    started = time.perf_counter()
+    data = file.read()
+    read_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    # Повторы бэкенда и переанализ того же ответа отдаются из кэша без ASR и модели
+    use_cache = request.form.get('cache', '1').lower() not in ('0', 'false')
+    key = cache_key(data, lang)
+    cached = result_cache.get(key) if use_cache else None
+    if cached is not None:
+        response = jsonify(cached)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    analysis_result = analyze_bytes(data, lang=lang)
+    if isinstance(analysis_result, dict) and isinstance(analysis_result.get('timings'), dict):
+        analysis_result['timings']['read_ms'] = read_ms
 
     if isinstance(analysis_result, dict) and analysis_result.get('error'):
         return jsonify({"error": analysis_result['error']}), 400
 
-    recognized_text = analysis_result.get('recognized_text', '')
-    sentiment = analysis_result.get('sentiment_analysis', {})
-    pause = analysis_result.get('pause_analysis', {})
-
-    label = sentiment.get('label')
-    score = sentiment.get('score')
-    emotion_raw = sentiment.get('emotion')  # формат: 1 ("sad")
-
-    emotion_code = None
-    emotion_label = None
-    if isinstance(emotion_raw, str):
-        m = re.match(r"^(\\d+) \\\"?\\(\"?([^\"]+)\"?\\)\\\"?$", emotion_raw)  # защитный парсер
-        if not m:
-            m = re.match(r"^(\\d+) \\((?:\"|\')?([^\"\']+)(?:\"|\')?\\)$", emotion_raw)
-        if m:
-            try:
-                emotion_code = int(m.group(1))
-            except ValueError:
-                emotion_code = None
-            emotion_label = m.group(2)
-
-    total_ms = pause.get('total_pause_duration_ms') or 0
-    total_seconds = round((total_ms or 0) / 1000.0, 2)
-
-    response = {
-        "recognized_text": recognized_text,
-        "sentiment_model": label,
-        "sentiment_confidence": round(float(score), 2) if isinstance(score, (int, float)) else score,
-        "final_emotion": {
-            "code": emotion_code,
-            "label": emotion_label,
-            "raw": emotion_raw,
-        },
-        "pause_count": pause.get('pause_count'),
-        "total_pause_duration_seconds": total_seconds,
-        "pauses_ms": pause.get('pauses_ms', []),
-    }
-
-    return jsonify(response)
+    body = format_analysis(analysis_result)
+    if use_cache and is_cacheable(analysis_result):
+        result_cache.put(key, body,
+                         compute_ms=analysis_result['timings'].get('total_ms', 0.0),
+                         audio_ms=analysis_result.get('duration_ms', 0))
+    response = jsonify(body)
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+
+@app.route('/api/analyze/cache', methods=['GET'])
+def api_analyze_cache():
+    """Метрики кэша результатов: попадания (память/диск), промахи, сэкономленное время и аудио."""
+    return jsonify(result_cache.metrics())
+
+
+@app.route('/api/analyze/cache', methods=['DELETE'])
+def api_analyze_cache_clear():
+    removed = result_cache.clear()
+    return jsonify({"status": "cleared", **removed})
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def api_analyze_batch():
+    """
+    Несколько .wav в поле files (multipart). Ответ — NDJSON: строка на файл по мере готовности
+    (index, file, поля как у /api/analyze или error) и summary в конце.
+    """
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    if not files:
+        return jsonify({"error": "files field is required (multipart/form-data)"}), 400
+    not_wav = [f.filename for f in files if not f.filename.lower().endswith('.wav')]
+    if not_wav:
+        return jsonify({"error": f"please upload .wav files: {', '.join(not_wav)}"}), 400
+
+    lang = request.form.get('lang', 'ru')
+    use_cache = request.form.get('cache', '1').lower() not in ('0', 'false')
+    # Загрузки не читаем в память: каждая копируется по частям во временный файл,
+    # дочерние процессы декодирования получают путь, а не байты всего пакета
+    staging = tempfile.TemporaryDirectory(prefix='batch-', ignore_cleanup_errors=True)
+    items = []
+    try:
+        for index, f in enumerate(files):
+            path = os.path.join(staging.name, f"{index}.wav")
+            f.save(path)
+            items.append((f.filename, path))
+    except Exception:
+        staging.cleanup()
+        raise
+
+    def generate():
+        started = time.perf_counter()
+        failed = 0
+        for result in iter_batch(items, lang, cache=result_cache if use_cache else None):
+            failed += 'error' in result
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "type": "summary",
+            "files": len(items),
+            "failed": failed,
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Временные файлы удаляются, когда ответ дописан или клиент ушёл
+    response.call_on_close(staging.cleanup)
+    return response
+
+
+# --- Потоковый анализ (живое интервью) ---
+# Клиент шлёт сырые 16-bit mono LPCM кадры по мере записи; VAD идёт инкрементально,
+# события пауз и текущая статистика возвращаются сразу.
+
+STREAM_READ_BYTES = 32 * 1024
+
+
+def _stream_params():
+    return request.get_json(silent=True) or request.values
+
+
+@app.route('/api/stream/sessions', methods=['POST'])
+def api_stream_create():
+    """Открывает сессию: sample_rate (8000/16000/32000/48000), lang, keep_audio (для финального ASR)."""
+    params = _stream_params()
+    try:
+        sample_rate = int(params.get('sample_rate', 16000))
+        keep_audio = str(params.get('keep_audio', '1')).lower() not in ('0', 'false')
+        session = stream_sessions.create(sample_rate=sample_rate, lang=params.get('lang', 'ru'), keep_audio=keep_audio)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({
+        "session_id": session.id,
+        "sample_rate": session.analyzer.sample_rate,
+        "frame_duration_ms": session.analyzer.frame_duration_ms,
+    }), 201
+
+
+@app.route('/api/stream/sessions/<session_id>/audio', methods=['POST'])
+def api_stream_audio(session_id):
+    """Тело запроса — очередной кусок PCM (можно chunked). Ответ: новые события и статистика."""
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    events = []
+    with session.lock:
+        while True:
+            chunk = request.stream.read(STREAM_READ_BYTES)
+            if not chunk:
+                break
+            events.extend(session.analyzer.feed(chunk))
+        stats = session.analyzer.stats()
+    return jsonify({"events": events, "stats": stats})
+
+
+@app.route('/api/stream/sessions/<session_id>/finish', methods=['POST'])
+def api_stream_finish(session_id):
+    """Закрывает сессию. analyze=1 — распознать накопленное аудио и оценить тональность."""
+    session = stream_sessions.pop(session_id)
+    if session is None:
+        return jsonify({"error": "session not found"}), 404
+    with session.lock:
+        events, pause_analysis = session.analyzer.finish()
+        result = {"events": events, "stats": session.analyzer.stats(), "pause_analysis": pause_analysis}
+        if str(_stream_params().get('analyze', '0')).lower() in ('1', 'true') and session.analyzer.audio:
+            audio = from_pcm(session.analyzer.audio, session.analyzer.sample_rate)
+            result.update(format_analysis(analyze_audio(audio, session.lang, pause_analysis=pause_analysis)))
+    return jsonify(result)
+
+
+@app.route('/api/stream/analyze', methods=['POST'])
+def api_stream_analyze():
+    """
+    Один запрос на весь ответ кандидата: PCM идёт телом (chunked upload),
+    ответ — NDJSON с событиями по мере чтения и итоговой сводкой в конце.
+    """
+    try:
+        analyzer = StreamingPauseAnalyzer(sample_rate=int(request.args.get('sample_rate', 16000)), keep_audio=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stream = request.stream
+
+    def generate():
+        while True:
+            chunk = stream.read(STREAM_READ_BYTES)
+            if not chunk:
+                break
+            for event in analyzer.feed(chunk):
+                yield json.dumps(event) + "\n"
+            yield json.dumps({"type": "stats", **analyzer.stats()}) + "\n"
+        events, pause_analysis = analyzer.finish()
+        for event in events:
+            yield json.dumps(event) + "\n"
+        yield json.dumps({"type": "summary", "stats": analyzer.stats(), "pause_analysis": pause_analysis}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- Готовность ---
+
+def process_memory():
+    """RSS и PSS процесса в МБ. PSS делит общие (copy-on-write) страницы между воркерами."""
+    memory = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(('Pss:', 'Shared_Clean:', 'Shared_Dirty:')):
+                    key = line.split(':')[0].lower()
+                    memory[f'{key}_mb'] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({"status": "ok"})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """200, когда модель тональности загружена; 503 пока грузится."""
+    status = model_status()
+    status.update({
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - PROCESS_STARTED_AT, 1),
+        "memory": process_memory(),
+    })
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+# --- Тональность текста ---
+
+SENTIMENT_MAX_TEXTS = int(os.environ.get('SENTIMENT_MAX_TEXTS', '256'))
+
+
+@app.route('/api/sentiment', methods=['POST'])
+def api_sentiment():
+    """Тело: {"texts": [...]} или {"text": "..."}. Тексты считаются общими батчами модели."""
+    payload = request.get_json(silent=True) or {}
+    texts = payload.get('texts')
+    if texts is None and 'text' in payload:
+        texts = [payload['text']]
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "expected JSON body with 'texts' (list of strings) or 'text'"}), 400
+    if len(texts) > SENTIMENT_MAX_TEXTS:
+        return jsonify({"error": f"too many texts (max {SENTIMENT_MAX_TEXTS})"}), 413
+    started = time.perf_counter()
+    results = score_sentiments(texts)
+    return jsonify({
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+
+
+@app.route('/api/sentiment/metrics', methods=['GET'])
+def api_sentiment_metrics():
+    return jsonify(sentiment_worker.metrics())
 
 # --- Запуск приложения ---
 
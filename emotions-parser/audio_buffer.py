@@ -0,0 +1,74 @@
+import io
+import wave
+from dataclasses import dataclass
+
+import numpy as np
+from pydub import AudioSegment
+
+# Все стадии (VAD, ASR) работают с 16 kHz 16-bit mono
+TARGET_RATE = 16000
+
+
+@dataclass
+class AudioBuffer:
+    """Декодированное аудио: int16 mono TARGET_RATE, общее для всех стадий анализа."""
+    samples: np.ndarray
+    sample_rate: int
+    source_rate: int
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.samples) * 1000 // self.sample_rate
+
+    @property
+    def raw(self) -> memoryview:
+        """Сырые LPCM байты без копирования — срезы отдаются прямо в webrtcvad."""
+        return memoryview(self.samples).cast("B")
+
+    def slice(self, start_ms: int, end_ms: int) -> "AudioBuffer":
+        """Отрезок [start_ms, end_ms) — view на тот же массив, без копии."""
+        start = start_ms * self.sample_rate // 1000
+        end = end_ms * self.sample_rate // 1000
+        return AudioBuffer(samples=self.samples[start:end], sample_rate=self.sample_rate, source_rate=self.source_rate)
+
+    def to_wav_bytes(self) -> bytes:
+        out = io.BytesIO()
+        with wave.open(out, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.raw)
+        return out.getvalue()
+
+
+def decode_wav(source) -> AudioBuffer:
+    """
+    Декодирует WAV один раз: путь, bytes или file-like -> AudioBuffer.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    audio = AudioSegment.from_wav(source)
+    source_rate = audio.frame_rate
+    audio = audio.set_frame_rate(TARGET_RATE).set_channels(1).set_sample_width(2)
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+    return AudioBuffer(samples=samples, sample_rate=TARGET_RATE, source_rate=source_rate)
+
+
+def from_pcm(pcm: bytes, sample_rate: int) -> AudioBuffer:
+    """Сырые 16-bit mono LPCM байты -> AudioBuffer (с ресемплингом до TARGET_RATE при необходимости)."""
+    if sample_rate != TARGET_RATE:
+        segment = AudioSegment(data=bytes(pcm), sample_width=2, frame_rate=sample_rate, channels=1)
+        pcm = segment.set_frame_rate(TARGET_RATE).raw_data
+    samples = np.frombuffer(bytes(pcm), dtype=np.int16)
+    return AudioBuffer(samples=samples, sample_rate=TARGET_RATE, source_rate=sample_rate)
+
+
+def frame_rms(samples: np.ndarray, samples_per_frame: int, block_frames: int = 4096) -> np.ndarray:
+    """RMS по кадрам; считается блоками, чтобы часовая запись не раздувалась во float целиком."""
+    n_frames = len(samples) // samples_per_frame
+    frames = samples[:n_frames * samples_per_frame].reshape(n_frames, samples_per_frame)
+    rms = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, block_frames):
+        block = frames[start:start + block_frames].astype(np.float32)
+        rms[start:start + block_frames] = np.sqrt(np.mean(block * block, axis=1))
+    return rms
@@ -0,0 +1,188 @@
+"""
+Пакетный анализ записей (переоценка всего интервью одним вызовом).
+
+    python batch.py answers/ --lang ru --out results.ndjson
+
+Декодирование и VAD идут в пуле процессов (CPU), распознавание — в пуле потоков (сеть),
+тональность всех файлов собирается батчером модели в общие батчи.
+Результаты отдаются по мере готовности, по строке NDJSON на файл.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from audio_buffer import decode_wav
+from vad import VAD_RATES, vad_speech_mask, pause_summary
+
+# Модуль импортируется дочерними процессами пула (spawn), поэтому модель и Flask здесь не грузим
+BATCH_DECODE_PROCESSES = int(os.environ.get('BATCH_DECODE_PROCESSES', '0')) or os.cpu_count() or 1
+BATCH_ANALYZE_THREADS = int(os.environ.get('BATCH_ANALYZE_THREADS', '8'))
+
+_decode_pool = None
+_decode_pool_pid = None
+_decode_pool_lock = threading.Lock()
+
+
+def _pool(broken=None):
+    """
+    Общий на процесс пул декодирования. broken — пул, в котором упал дочерний процесс:
+    он пересоздаётся, только если ещё текущий (другой пакет мог уже заменить его).
+    Сломанный пул сам отклоняет свои задачи, задачи других пакетов в новом пуле не трогаем.
+    """
+    # spawn: форк из многопоточного воркера gunicorn небезопасен
+    global _decode_pool, _decode_pool_pid
+    with _decode_pool_lock:
+        if broken is not None and broken is _decode_pool:
+            _decode_pool.shutdown(wait=False)
+            _decode_pool = None
+        if _decode_pool is None or _decode_pool_pid != os.getpid():
+            _decode_pool = ProcessPoolExecutor(max_workers=BATCH_DECODE_PROCESSES,
+                                               mp_context=multiprocessing.get_context('spawn'))
+            _decode_pool_pid = os.getpid()
+        return _decode_pool
+
+
+def _isolated_pool():
+    # Повтор после падения — в отдельном процессе: если файл и есть причина, он уронит только себя
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+
+def decode_and_detect_pauses(source):
+    """
+    Выполняется в дочернем процессе: WAV (путь или bytes) -> (AudioBuffer, анализ пауз, VAD-маска).
+    Маска (байт на кадр 30 мс) возвращается, чтобы длинная запись не считала VAD второй раз.
+    """
+    audio = decode_wav(source)
+    if audio.source_rate not in VAD_RATES:
+        return audio, {"error": f"Неподдерживаемая частота дискретизации: {audio.source_rate}"}, None
+    speech = vad_speech_mask(audio)
+    return audio, pause_summary(speech), speech
+
+
+def iter_batch(items, lang='ru', cache=None):
+    """
+    items — список (имя, путь или bytes). Генерирует по словарю на файл в порядке готовности:
+    {"index", "file", ...ответ format_analysis} или {"index", "file", "error"}.
+    cache — ResultCache (ключ по содержимому, как у /api/analyze).
+    """
+    from result_cache import cache_key, cache_key_file, is_cacheable
+    from sentiment_analyzer import analyze_audio, format_analysis
+
+    results = queue.Queue()
+    closed = threading.Event()
+    analyze_pool = ThreadPoolExecutor(max_workers=BATCH_ANALYZE_THREADS, thread_name_prefix='batch')
+
+    def analyze(index, name, key, decode_started, audio, pause_analysis, speech):
+        try:
+            timings = {"decode_vad_ms": round((time.perf_counter() - decode_started) * 1000, 1)}
+            started = time.perf_counter()
+            result = analyze_audio(audio, lang, pause_analysis=pause_analysis, timings=timings, speech=speech)
+            timings['total_ms'] = round((time.perf_counter() - decode_started) * 1000, 1)
+            body = format_analysis(result)
+            if key and cache is not None and is_cacheable(result):
+                cache.put(key, body, compute_ms=(time.perf_counter() - started) * 1000, audio_ms=audio.duration_ms)
+            results.put({"index": index, "file": name, **body})
+        except Exception as e:
+            results.put({"index": index, "file": name, "error": str(e)})
+
+    def submit(index, name, key, source, decode_started, retry=False):
+        if retry:
+            pool = _isolated_pool()
+            future = pool.submit(decode_and_detect_pauses, source)
+            future.add_done_callback(lambda f: pool.shutdown(wait=False))
+        else:
+            pool = _pool()
+            try:
+                future = pool.submit(decode_and_detect_pauses, source)
+            except BrokenProcessPool:
+                pool = _pool(broken=pool)
+                future = pool.submit(decode_and_detect_pauses, source)
+        future.add_done_callback(lambda f: decoded(index, name, key, source, decode_started, retry, pool, f))
+
+    def decoded(index, name, key, source, decode_started, retry, pool, future):
+        if closed.is_set():
+            return
+        try:
+            audio, pause_analysis, speech = future.result()
+        except BrokenProcessPool as e:
+            # Упал дочерний процесс (например, по памяти) — не обязательно на этом файле,
+            # это может быть и файл другого пакета: общий пул пересоздаётся, файл повторяется
+            if not retry:
+                _pool(broken=pool)
+                try:
+                    submit(index, name, key, source, decode_started, retry=True)
+                    return
+                except Exception as retry_error:
+                    e = retry_error
+            results.put({"index": index, "file": name, "error": f"Не удалось прочитать WAV файл: {e}"})
+            return
+        except Exception as e:
+            results.put({"index": index, "file": name, "error": f"Не удалось прочитать WAV файл: {e}"})
+            return
+        try:
+            analyze_pool.submit(analyze, index, name, key, decode_started, audio, pause_analysis, speech)
+        except RuntimeError:
+            # Клиент ушёл, генератор закрыт и пул остановлен
+            pass
+
+    try:
+        for index, (name, source) in enumerate(items):
+            try:
+                key = None
+                if cache is not None:
+                    key = cache_key(source, lang) if isinstance(source, bytes) else cache_key_file(source, lang)
+                cached = cache.get(key) if key else None
+                if cached is not None:
+                    results.put({"index": index, "file": name, "cached": True, **cached})
+                    continue
+                submit(index, name, key, source, time.perf_counter())
+            except Exception as e:
+                # Файл не прочитался или пул не принял задачу — ошибка этого файла, остальные идут дальше
+                results.put({"index": index, "file": name, "error": f"Не удалось обработать файл: {e}"})
+        for _ in range(len(items)):
+            yield results.get()
+    finally:
+        closed.set()
+        analyze_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="каталог с .wav файлами")
+    parser.add_argument("--lang", default="ru")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--out", help="файл NDJSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    paths = []
+    for root, _, files in os.walk(args.directory):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.wav'))
+        if not args.recursive:
+            break
+    if not paths:
+        raise SystemExit(f"в {args.directory} нет .wav файлов")
+
+    out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    started = time.perf_counter()
+    failed = 0
+    try:
+        items = [(os.path.relpath(path, args.directory), path) for path in paths]
+        for result in iter_batch(items, args.lang):
+            failed += 'error' in result
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if args.out:
+            out.close()
+    print(f"{len(paths)} файлов, ошибок: {failed}, {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Бенчмарки emotions-parser (запуск из папки сервиса):
+
+    python bench.py vad --minutes 60
+    python bench.py sentiment --runs 50
+    python bench.py startup --workers 2
+    python bench.py analyze --requests 40 --concurrency 8
+"""
+import argparse
+import os
+import subprocess
+import sys
+import statistics
+import time
+
+import numpy as np
+
+
+def synthetic_speech(minutes: float, sample_rate: int = 16000, seed: int = 0) -> np.ndarray:
+    """Чередование "речи" (шумовые всплески 0.5–3 с) и тишины (0.2–2 с), int16 mono."""
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * sample_rate)
+    out = np.zeros(total, dtype=np.int16)
+    pos = 0
+    while pos < total:
+        speech_len = int(rng.uniform(0.5, 3.0) * sample_rate)
+        end = min(total, pos + speech_len)
+        t = np.arange(end - pos) / sample_rate
+        tone = np.sin(2 * np.pi * rng.uniform(120, 300) * t) * 6000 + rng.normal(0, 1500, end - pos)
+        out[pos:end] = np.clip(tone, -32768, 32767).astype(np.int16)
+        pos = end + int(rng.uniform(0.2, 2.0) * sample_rate)
+    return out
+
+
+def bench_vad(args):
+    import webrtcvad
+    from audio_buffer import AudioBuffer
+    from vad import vad_speech_mask, pause_runs
+
+    samples = synthetic_speech(args.minutes)
+    audio = AudioBuffer(samples=samples, sample_rate=16000, source_rate=16000)
+    print(f"audio: {args.minutes} min, {samples.nbytes / 1e6:.1f} MB")
+
+    # Прежняя реализация: bytes-срезы (копии) и питоновский цикл по булевым кадрам
+    started = time.perf_counter()
+    raw = samples.tobytes()
+    vad = webrtcvad.Vad(1)
+    bytes_per_frame = 480 * 2
+    flags = []
+    for i in range(0, len(raw) - bytes_per_frame + 1, bytes_per_frame):
+        flags.append(vad.is_speech(raw[i:i + bytes_per_frame], 16000))
+    pauses, start = [], None
+    for i, is_speech in enumerate(flags):
+        if not is_speech:
+            if start is None:
+                start = i * 30
+        elif start is not None:
+            if i * 30 - start >= 300:
+                pauses.append(i * 30 - start)
+            start = None
+    if start is not None and len(flags) * 30 - start >= 300:
+        pauses.append(len(flags) * 30 - start)
+    legacy = time.perf_counter() - started
+    print(f"legacy loop:            {legacy:7.2f} s  pauses={len(pauses)}")
+
+    # Без фильтра результат обязан совпасть с прежним циклом; с фильтром паузы могут отличаться
+    for silence_rms in (0, args.silence_rms) if args.silence_rms > 0 else (0,):
+        started = time.perf_counter()
+        mask = vad_speech_mask(audio, 1, 30, silence_rms=silence_rms)
+        runs = pause_runs(mask, 30, 300)
+        took = time.perf_counter() - started
+        match = "match" if [end - start for start, end in runs] == pauses else "differs"
+        print(f"vectorized rms>={silence_rms:<6}  {took:7.2f} s  pauses={len(runs)} ({match})  speedup x{legacy / took:.1f}")
+
+
+# Ответы кандидатов разной окраски для проверки паритета бэкендов
+SENTIMENT_TEXTS = [
+    "Мне очень понравился проект, команда отличная и задачи интересные.",
+    "Честно говоря, это был худший опыт в моей карьере.",
+    "Работа как работа, ничего особенного.",
+    "Я немного разочарован тем, как всё закончилось.",
+    "Отличная компания, с удовольствием вернулся бы туда.",
+    "Менеджмент постоянно срывал сроки, это очень раздражало.",
+    "Я занимался поддержкой сервисов на Java и PostgreSQL.",
+    "Было сложно, но в итоге мы справились и запустили продукт.",
+    "Не хочу об этом говорить, было ужасно.",
+    "В целом нормально, хотя зарплата могла бы быть выше.",
+    "I really enjoyed working with this team, it was great.",
+    "The project was a complete disaster from start to finish.",
+    "It was fine, nothing special to mention.",
+    "I am quite disappointed with the lack of growth opportunities.",
+    "Best job I have ever had, highly recommend.",
+    "Сначала всё было хорошо, потом начались проблемы с руководством.",
+]
+
+
+def _latency(classify, texts, runs):
+    single = []
+    for i in range(runs):
+        started = time.perf_counter()
+        classify(texts[i % len(texts)])
+        single.append((time.perf_counter() - started) * 1000)
+    single.sort()
+    started = time.perf_counter()
+    classify(texts)
+    batch_ms = (time.perf_counter() - started) * 1000
+    return single[len(single) // 2], single[int(len(single) * 0.95)], len(texts) / (batch_ms / 1000)
+
+
+def bench_sentiment(args):
+    from sentiment_backends import emotion_code, load_torch_pipeline, load_onnx_pipeline
+
+    texts = SENTIMENT_TEXTS
+    if args.texts_file:
+        with open(args.texts_file, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    results = {}
+    for name, load in (("torch", load_torch_pipeline), ("onnx", load_onnx_pipeline)):
+        started = time.perf_counter()
+        pipe = load()
+        load_s = time.perf_counter() - started
+        pipe(texts[0])  # прогрев
+        labels = [r['label'] for r in pipe(texts, batch_size=len(texts), truncation=True)]
+        p50, p95, tput = _latency(lambda t: pipe(t, truncation=True, batch_size=16), texts, args.runs)
+        results[name] = labels
+        print(f"{name:5}  load {load_s:6.1f} s  single p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  batch {tput:7.1f} texts/s")
+
+    # Паритет: совпадение звёзд, кодов EMOTIONS и средний сдвиг в звёздах
+    torch_labels, onnx_labels = results["torch"], results["onnx"]
+    same_label = sum(a == b for a, b in zip(torch_labels, onnx_labels))
+    same_emotion = sum(emotion_code(a) == emotion_code(b) for a, b in zip(torch_labels, onnx_labels))
+    star_shift = statistics.mean(abs(int(a[0]) - int(b[0])) for a, b in zip(torch_labels, onnx_labels))
+    n = len(texts)
+    print(f"parity: labels {same_label}/{n}  emotions {same_emotion}/{n}  mean star shift {star_shift:.2f}")
+    for text, a, b in zip(texts, torch_labels, onnx_labels):
+        if a != b:
+            print(f"  diff: {a!r} vs {b!r}: {text[:60]}")
+    if args.min_parity and same_emotion / n < args.min_parity:
+        raise SystemExit(f"паритет эмоций ниже {args.min_parity:.0%}")
+
+
+def _smaps(pid):
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Rss:", "Pss:", "Shared_Clean:")):
+                memory[line.split(":")[0].lower()] = int(line.split()[1]) / 1024
+    return memory
+
+
+def _children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def bench_startup(args):
+    """Холодный старт сервера: время до ответа, время до готовности модели, память на воркер."""
+    import urllib.error
+    import urllib.request
+
+    env = dict(os.environ, PORT=str(args.port), GUNICORN_WORKERS=str(args.workers))
+    command = args.command or [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    started = time.perf_counter()
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = None
+    try:
+        while time.perf_counter() - started < args.timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{args.port}/ready", timeout=2) as resp:
+                    if resp.status == 200:
+                        break
+            except urllib.error.HTTPError:
+                # 503 — сервер уже отвечает, модель ещё грузится
+                first_response = first_response or time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.2)
+        else:
+            raise SystemExit("сервер не стал готов за отведённое время")
+        ready = time.perf_counter() - started
+        print(f"first response: {first_response or ready:6.1f} s   ready: {ready:6.1f} s")
+
+        time.sleep(args.settle)
+        for pid in [server.pid] + _children(server.pid):
+            memory = _smaps(pid)
+            role = "master" if pid == server.pid else "worker"
+            print(f"{role:6} {pid:7}  rss {memory['rss']:7.1f} MB  pss {memory['pss']:7.1f} MB  shared {memory['shared_clean']:7.1f} MB")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def bench_analyze(args):
+    """Последовательные стадии vs граф (VAD || ASR -> тональность) под нагрузкой, ASR — локальная заглушка."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.environ.setdefault("ASR_BACKEND", "stub")
+    from audio_buffer import AudioBuffer
+    from recognizers import StubRecognizer
+    import sentiment_analyzer as sa
+
+    samples = synthetic_speech(args.seconds / 60)
+    audio = AudioBuffer(samples=samples, sample_rate=16000, source_rate=16000)
+    recognizer = StubRecognizer(latency_ms=args.asr_latency_ms)
+    sa.score_sentiment("прогрев")
+
+    def sequential():
+        started = time.perf_counter()
+        sa.analyze_pauses(audio)
+        text = sa.recognize_speech(audio, "ru", recognizer)
+        sa.score_sentiment(text)
+        return (time.perf_counter() - started) * 1000
+
+    def graph():
+        started = time.perf_counter()
+        sa.analyze_audio(audio, "ru", recognizer=recognizer)
+        return (time.perf_counter() - started) * 1000
+
+    print(f"audio {args.seconds:.0f} s, stub ASR {args.asr_latency_ms:.0f} ms + {recognizer.realtime_factor}x, "
+          f"{args.requests} requests x {args.concurrency} concurrent")
+    for name, fn in (("sequential", sequential), ("graph", graph)):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            latencies = sorted(pool.map(lambda _: fn(), range(args.requests)))
+        wall = time.perf_counter() - started
+        print(f"{name:10}  p50 {latencies[len(latencies) // 2]:7.1f} ms  p95 {latencies[int(len(latencies) * 0.95)]:7.1f} ms  "
+              f"throughput {args.requests / wall:5.1f} req/s")
+    print("timings of one request:", sa.analyze_audio(audio, "ru", recognizer=recognizer)["timings"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    vad = sub.add_parser("vad", help="VAD и подсчёт пауз на длинной синтетической записи")
+    vad.add_argument("--minutes", type=float, default=60)
+    vad.add_argument("--silence-rms", type=float, default=0, help="дополнительно замерить с RMS-фильтром (например 200)")
+    vad.set_defaults(func=bench_vad)
+    sentiment = sub.add_parser("sentiment", help="torch fp32 vs ONNX int8: паритет меток и латентность")
+    sentiment.add_argument("--runs", type=int, default=50)
+    sentiment.add_argument("--texts-file", help="файл с текстами, по одному в строке")
+    sentiment.add_argument("--min-parity", type=float, default=0.0, help="минимальная доля совпадения эмоций (код выхода)")
+    sentiment.set_defaults(func=bench_sentiment)
+    startup = sub.add_parser("startup", help="холодный старт и память воркеров (Linux, /proc)")
+    startup.add_argument("--workers", type=int, default=2)
+    startup.add_argument("--port", type=int, default=5055)
+    startup.add_argument("--timeout", type=float, default=600)
+    startup.add_argument("--settle", type=float, default=5, help="пауза перед замером памяти (прогрев в воркерах)")
+    startup.add_argument("command", nargs="*", help="команда запуска вместо gunicorn (например: python app.py)")
+    startup.set_defaults(func=bench_startup)
+    analyze = sub.add_parser("analyze", help="задержка analyze_audio: последовательно vs параллельные стадии")
+    analyze.add_argument("--seconds", type=float, default=60, help="длина синтетического ответа")
+    analyze.add_argument("--asr-latency-ms", type=float, default=300)
+    analyze.add_argument("--requests", type=int, default=40)
+    analyze.add_argument("--concurrency", type=int, default=8)
+    analyze.set_defaults(func=bench_analyze)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
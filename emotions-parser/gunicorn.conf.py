@@ -0,0 +1,29 @@
+import gc
+import os
+
+# Модель грузится в мастере до fork: воркеры делят её веса через copy-on-write
+os.environ.setdefault('SENTIMENT_WARMUP', 'eager')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Один воркер по умолчанию: стрим-сессии, память кэша результатов и метрики живут в процессе,
+# и запрос, попавший в другой воркер, получил бы 404 или неполную картину
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+# Потоки внутри воркера: параллельные запросы попадают в общий батч модели
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# Распознавание длинной записи может занимать минуты
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+preload_app = True
+accesslog = '-'
+
+
+def pre_fork(server, worker):
+    # Объекты, созданные при загрузке модели, больше не трогает GC —
+    # иначе обход поколений пишет в их заголовки и размножает общие страницы
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Пробный прогон модели уже в воркере: пулы потоков torch нельзя поднимать до fork
+    from sentiment_analyzer import warm_up
+    warm_up()
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+from pydub import AudioSegment
+
+# Какой распознаватель использовать: speechkit (Yandex) или stub (локальная заглушка для бенчмарков)
+ASR_BACKEND = os.environ.get('ASR_BACKEND', 'speechkit')
+# auto — аудио в распознаватель из памяти; file — через временный WAV (как раньше)
+ASR_INPUT = os.environ.get('ASR_INPUT', 'auto')
+# Заглушка: фиксированная задержка + доля от длительности аудио (имитация сетевого ASR)
+STUB_ASR_LATENCY_MS = float(os.environ.get('STUB_ASR_LATENCY_MS', '300'))
+STUB_ASR_RTF = float(os.environ.get('STUB_ASR_RTF', '0.02'))
+STUB_ASR_TEXT = os.environ.get('STUB_ASR_TEXT', 'Мне понравился проект, команда была отличная.')
+
+_credentials_lock = threading.Lock()
+_credentials_configured = False
+
+
+class Recognizer:
+    """Интерфейс распознавателя: AudioBuffer (16 kHz mono) -> текст. Ошибки — исключениями."""
+    name = 'base'
+
+    def recognize(self, audio, lang='ru'):
+        raise NotImplementedError
+
+
+class SpeechKitRecognizer(Recognizer):
+    """Yandex SpeechKit."""
+    name = 'speechkit'
+
+    def recognize(self, audio, lang='ru'):
+        configure_yandex_credentials()
+        from speechkit import model_repository
+
+        asr = model_repository.recognition_model()
+
+        # Задаём настройки распознавания
+        asr.model = 'general'
+        # Преобразуем код языка в формат Яндекса
+        if lang == 'en':
+            asr.language = 'en-US'
+        elif lang == 'ru':
+            asr.language = 'ru-RU'
+        else:
+            asr.language = 'ru-RU'  # по умолчанию русский
+
+        # Попробуем разные варианты импорта и установки AudioProcessingType
+        try:
+            from speechkit import AudioProcessingType
+            asr.audio_processing_type = AudioProcessingType.Full
+        except ImportError:
+            try:
+                from speechkit.stt import AudioProcessingType
+                asr.audio_processing_type = AudioProcessingType.Full
+            except ImportError:
+                try:
+                    # Попробуем установить как строку
+                    asr.audio_processing_type = 'Full'
+                except Exception:
+                    # Если ничего не работает, пропускаем этот параметр
+                    print("Warning: AudioProcessingType not available, skipping audio_processing_type setting")
+
+        return _result_text(_transcribe(asr, audio))
+
+
+class StubRecognizer(Recognizer):
+    """Локальная заглушка: спит как сетевой ASR и возвращает заданный текст."""
+    name = 'stub'
+
+    def __init__(self, latency_ms=STUB_ASR_LATENCY_MS, realtime_factor=STUB_ASR_RTF, text=STUB_ASR_TEXT):
+        self.latency_ms = latency_ms
+        self.realtime_factor = realtime_factor
+        self.text = text
+
+    def recognize(self, audio, lang='ru'):
+        time.sleep((self.latency_ms + audio.duration_ms * self.realtime_factor) / 1000)
+        return self.text
+
+
+RECOGNIZERS = {
+    SpeechKitRecognizer.name: SpeechKitRecognizer,
+    StubRecognizer.name: StubRecognizer,
+}
+_recognizers = {}
+
+
+def get_recognizer(name=None):
+    name = name or ASR_BACKEND
+    if name not in _recognizers:
+        if name not in RECOGNIZERS:
+            raise ValueError(f"Неизвестный ASR_BACKEND: {name}")
+        _recognizers[name] = RECOGNIZERS[name]()
+    return _recognizers[name]
+
+
+def configure_yandex_credentials():
+    """Креды SpeechKit настраиваются один раз на процесс, а не на каждый запрос."""
+    global _credentials_configured
+    if _credentials_configured:
+        return
+    from speechkit import configure_credentials, creds
+    with _credentials_lock:
+        if _credentials_configured:
+            return
+        api_key = os.environ.get('YANDEX_API_KEY')
+        if api_key:
+            # Используем API key
+            configure_credentials(yandex_credentials=creds.YandexCredentials(api_key=api_key))
+        else:
+            # Fallback to IAM token for backward compatibility
+            iam_token = os.environ.get('YANDEX_IAM_TOKEN') or os.environ.get('IAM_TOKEN')
+            if not iam_token:
+                raise RuntimeError('YANDEX_API_KEY or YANDEX_IAM_TOKEN is not set')
+            configure_credentials(yandex_credentials=creds.YandexCredentials(iam_token=iam_token))
+        _credentials_configured = True
+
+
+def _transcribe(asr, audio):
+    """
+    Подаёт аудио в распознаватель из памяти: сырые 16 kHz LPCM байты,
+    если SDK это поддерживает, иначе pydub-сегмент. Временный файл — запасной путь,
+    если SDK не принял аудио из памяти (или принудительно через ASR_INPUT=file).
+    """
+    if ASR_INPUT != 'file':
+        raw_bytes = bytes(audio.raw)
+        if hasattr(asr, 'recognize'):
+            try:
+                return asr.recognize(raw_audio=raw_bytes, format='lpcm', sampleRateHertz=audio.sample_rate)
+            except TypeError:
+                pass
+        if hasattr(asr, 'transcribe'):
+            segment = AudioSegment(data=raw_bytes, sample_width=2, frame_rate=audio.sample_rate, channels=1)
+            try:
+                return asr.transcribe(segment)
+            except Exception as e:
+                # Версии SDK по-разному экспортируют сегмент (нужен ffmpeg, другой формат) — пробуем через файл
+                print(f"Распознавание из памяти не удалось ({type(e).__name__}: {e}), повтор через временный файл")
+
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=True) as tmp:
+        tmp.write(audio.to_wav_bytes())
+        tmp.flush()
+        return asr.transcribe_file(tmp.name)
+
+
+def _result_text(result):
+    # Попробуем извлечь текст в распространённых полях результата
+    if isinstance(result, dict):
+        return result.get('result', '') or result.get('text', '') or ''
+    if isinstance(result, (list, tuple)):
+        parts = []
+        for item in result:
+            value = getattr(item, 'normalized_text', None) or getattr(item, 'raw_text', None)
+            parts.append(value if value is not None else _result_text(item))
+        return ' '.join(p for p in parts if p)
+    return str(result)
+
+
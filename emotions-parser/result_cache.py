@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Кэш готовых ответов /api/analyze по содержимому аудио
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))  # записей в памяти; 0 — кэш выключен
+RESULT_CACHE_TTL_S = int(os.environ.get('RESULT_CACHE_TTL_S', '86400'))
+# Необязательный дисковый уровень (общий для воркеров gunicorn); пусто — только память
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DISK_MB = int(os.environ.get('RESULT_CACHE_DISK_MB', '512'))
+
+# Меняется при изменении формата ответа, чтобы не отдавать старые записи
+_KEY_VERSION = b"v1"
+
+
+def cache_key(data, lang):
+    digest = _digest(lang)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def cache_key_file(path, lang):
+    """Тот же ключ, что cache_key от содержимого файла, но без чтения файла в память целиком."""
+    digest = _digest(lang)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _digest(lang):
+    digest = hashlib.sha256(_KEY_VERSION)
+    digest.update(lang.encode() + b"\0")
+    return digest
+
+
+def is_cacheable(analysis_result):
+    """Ошибки распознавания не кэшируем — повтор должен попробовать ASR снова."""
+    return not analysis_result.get('recognition_failed')
+
+
+class ResultCache:
+    """
+    LRU в памяти (до max_entries) + необязательный дисковый уровень, TTL на запись.
+    Диск ограничен disk_mb: вытесняются давно не использованные файлы (по mtime,
+    он обновляется при попадании).
+    Хранит полный JSON ответа и сколько стоило его посчитать — по этим данным
+    метрики показывают сэкономленное время и секунды распознанного аудио.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl_s=RESULT_CACHE_TTL_S, directory=RESULT_CACHE_DIR,
+                 disk_mb=RESULT_CACHE_DISK_MB):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.directory = directory
+        self.disk_limit = disk_mb * 1024 * 1024
+        self._entries = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0, "evictions": 0,
+                       "evictions_disk": 0, "saved_ms": 0.0, "saved_audio_s": 0.0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hit(entry, "hits_memory")
+                return entry["value"]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._remember(key, entry)
+            self._hit(entry, "hits_disk")
+        return entry["value"]
+
+    def put(self, key, value, compute_ms=0.0, audio_ms=0, ttl_s=None):
+        if not self.enabled:
+            return
+        entry = {
+            "value": value,
+            "expires_at": time.time() + (ttl_s if ttl_s is not None else self.ttl_s),
+            "compute_ms": compute_ms,
+            "audio_ms": audio_ms,
+        }
+        with self._lock:
+            self._remember(key, entry)
+            self._stats["stores"] += 1
+        self._write_disk(key, entry)
+
+    def clear(self):
+        """Сбрасывает память и дисковый уровень. Возвращает, сколько записей и файлов удалено."""
+        with self._lock:
+            entries = len(self._entries)
+            self._entries.clear()
+        files = 0
+        if self.directory:
+            for path, _, _ in list(self._disk_files()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                files += 1
+            with self._lock:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+        return {"entries": entries, "disk_files": files}
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits_memory"] + stats["hits_disk"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits_memory"] + stats["hits_disk"]) / lookups, 3) if lookups else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        stats["saved_audio_s"] = round(stats["saved_audio_s"], 1)
+        stats.update({"max_entries": self.max_entries, "ttl_s": self.ttl_s, "disk": bool(self.directory)})
+        if self.directory:
+            stats.update({"disk_mb": round(self._disk_bytes / 1024 / 1024, 2),
+                          "disk_limit_mb": round(self.disk_limit / 1024 / 1024)})
+        return stats
+
+    # --- Внутреннее ---
+
+    def _hit(self, entry, kind):
+        self._stats[kind] += 1
+        self._stats["saved_ms"] += entry["compute_ms"]
+        self._stats["saved_audio_s"] += entry["audio_ms"] / 1000
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= now:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return None
+            with self._lock:
+                self._disk_bytes -= size
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.directory:
+            return
+        path = self._path(key)
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            # Пишем во временный файл и переименовываем — параллельные воркеры не увидят половину записи
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Не удалось записать кэш на диск: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            over = self._disk_bytes > self.disk_limit
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Пересчитываем по каталогу (его делят воркеры gunicorn) и удаляем самые давно
+        # использованные файлы, пока не уложимся в 90% лимита
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        target = self.disk_limit * 0.9
+        evicted = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._stats["evictions_disk"] += evicted
+
+
+result_cache = ResultCache()
@@ -0,0 +1,44 @@
+import os
+
+from vad import pause_runs
+
+# Длинные записи режутся по паузам на отрезки не длиннее SEGMENT_MAX_MS
+# (синхронное распознавание SpeechKit принимает до 30 с аудио)
+SEGMENT_MAX_MS = int(os.environ.get('SEGMENT_MAX_MS', '25000'))
+# Слишком короткие отрезки не выделяем: разрез ищется не раньше SEGMENT_MIN_MS от начала отрезка
+SEGMENT_MIN_MS = int(os.environ.get('SEGMENT_MIN_MS', '5000'))
+# Пауза, на которой можно резать
+SEGMENT_CUT_PAUSE_MS = int(os.environ.get('SEGMENT_CUT_PAUSE_MS', '200'))
+
+
+def plan_segments(speech, duration_ms, frame_duration_ms=30, max_ms=None, min_ms=None, cut_pause_ms=None):
+    """
+    Границы отрезков [(start_ms, end_ms)] для записи длиной duration_ms.
+    Режем в середине самой поздней паузы, укладывающейся в окно (min_ms, max_ms] от начала отрезка;
+    если пауз в окне нет — жёсткий разрез по max_ms. Отрезки из одной тишины отбрасываются.
+    """
+    max_ms = max_ms or SEGMENT_MAX_MS
+    min_ms = min(min_ms if min_ms is not None else SEGMENT_MIN_MS, max_ms)
+    cut_pause_ms = cut_pause_ms if cut_pause_ms is not None else SEGMENT_CUT_PAUSE_MS
+    cuts = [(start + end) // 2 for start, end in pause_runs(speech, frame_duration_ms, cut_pause_ms)]
+
+    segments = []
+    start = 0
+    i = 0
+    while duration_ms - start > max_ms:
+        cut = None
+        while i < len(cuts) and cuts[i] <= start + max_ms:
+            if cuts[i] > start + min_ms:
+                cut = cuts[i]
+            i += 1
+        cut = cut or start + max_ms
+        segments.append((start, cut))
+        start = cut
+    if duration_ms > start:
+        segments.append((start, duration_ms))
+    return [seg for seg in segments if _has_speech(speech, seg, frame_duration_ms)]
+
+
+def _has_speech(speech, segment, frame_duration_ms):
+    start, end = segment
+    return bool(speech[start // frame_duration_ms:max(start // frame_duration_ms + 1, end // frame_duration_ms)].any())
@@ -0,0 +1,109 @@
+import os
+import platform
+import time
+
+# Модель тональности: 1–5 звёзд
+SENTIMENT_MODEL = os.environ.get('SENTIMENT_MODEL', 'nlptown/bert-base-multilingual-uncased-sentiment')
+# torch — исходный fp32 pipeline; onnx — int8 ONNX Runtime (экспортируется при первом запуске и кэшируется)
+SENTIMENT_BACKEND = os.environ.get('SENTIMENT_BACKEND', 'torch')
+# Профиль динамической квантизации optimum: auto (по CPU) / avx512_vnni / avx2 / arm64
+ONNX_QUANTIZATION = os.environ.get('ONNX_QUANTIZATION', 'auto')
+
+
+def detect_quantization():
+    """Профиль квантизации под текущий CPU: avx512_vnni только при наличии флага, иначе avx2."""
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        return 'arm64'
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = next((line.split(':', 1)[1].split() for line in f if line.startswith('flags')), [])
+    except OSError:
+        flags = []
+    # Модель, квантованная под VNNI, на CPU без него заметно медленнее и может расходиться по точности
+    if 'avx512_vnni' in flags:
+        return 'avx512_vnni'
+    return 'avx2'
+
+
+def resolve_quantization(quantization=None):
+    quantization = quantization or ONNX_QUANTIZATION
+    if quantization == 'auto':
+        return detect_quantization()
+    return quantization
+
+
+def emotion_code(label):
+    """Метка nlptown ("1 star".."5 stars") -> код EMOTIONS: 4–5 звёзд positive, 1 angry, 2 sad, 3 neutral."""
+    label = label.lower()
+    if '5 stars' in label or '4 stars' in label:
+        return 3
+    if '1 star' in label:
+        return 0
+    if '2 stars' in label:
+        return 1
+    return 2
+
+
+def onnx_cache_dir(model_id=SENTIMENT_MODEL, quantization=None):
+    # HF_HOME выставляется в sentiment_analyzer до импорта transformers, поэтому читаем при вызове
+    quantization = resolve_quantization(quantization)
+    base = os.environ.get('ONNX_CACHE_DIR') or os.path.join(os.environ.get('HF_HOME', '.'), 'onnx')
+    return os.path.join(base, model_id.replace('/', '--'), quantization)
+
+
+def load_torch_pipeline(model_id=SENTIMENT_MODEL):
+    from transformers import pipeline
+    return pipeline("text-classification", model=model_id)
+
+
+def export_onnx(model_id=SENTIMENT_MODEL, quantization=None, out_dir=None):
+    """
+    Экспорт модели в ONNX и динамическая int8-квантизация весов.
+    Результат (model_quantized.onnx + токенизатор и конфиг) складывается в out_dir.
+    """
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    quantization = resolve_quantization(quantization)
+    out_dir = out_dir or onnx_cache_dir(model_id, quantization)
+    export_dir = os.path.join(out_dir, 'fp32')
+    started = time.perf_counter()
+    model = ORTModelForSequenceClassification.from_pretrained(model_id, export=True)
+    model.save_pretrained(export_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    tokenizer.save_pretrained(out_dir)
+
+    qconfig = getattr(AutoQuantizationConfig, quantization)(is_static=False, per_channel=False)
+    quantizer = ORTQuantizer.from_pretrained(export_dir)
+    quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+    print(f"ONNX int8 модель сохранена в {out_dir} за {time.perf_counter() - started:.1f} с")
+    return out_dir
+
+
+def load_onnx_pipeline(model_id=SENTIMENT_MODEL, quantization=None):
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise RuntimeError("SENTIMENT_BACKEND=onnx требует пакет optimum[onnxruntime]") from e
+    from transformers import AutoTokenizer, pipeline
+
+    requested = quantization or ONNX_QUANTIZATION
+    quantization = resolve_quantization(quantization)
+    print(f"ONNX квантизация: {quantization}" + (" (определено по CPU)" if requested == 'auto' else ""))
+    out_dir = onnx_cache_dir(model_id, quantization)
+    if not os.path.exists(os.path.join(out_dir, 'model_quantized.onnx')):
+        export_onnx(model_id, quantization, out_dir)
+    model = ORTModelForSequenceClassification.from_pretrained(out_dir, file_name='model_quantized.onnx')
+    tokenizer = AutoTokenizer.from_pretrained(out_dir)
+    # Тот же text-classification pipeline: метки "1 star".."5 stars" и интерфейс для батчера не меняются
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
+
+
+def load_pipeline(backend=None):
+    backend = backend or SENTIMENT_BACKEND
+    if backend == 'onnx':
+        return load_onnx_pipeline()
+    if backend == 'torch':
+        return load_torch_pipeline()
+    raise ValueError(f"Неизвестный SENTIMENT_BACKEND: {backend}")
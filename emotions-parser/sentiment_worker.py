@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Динамический батчинг: ждём до SENTIMENT_MAX_WAIT_MS, пока не наберётся SENTIMENT_MAX_BATCH чанков
+SENTIMENT_MAX_BATCH = int(os.environ.get('SENTIMENT_MAX_BATCH', '16'))
+SENTIMENT_MAX_WAIT_MS = float(os.environ.get('SENTIMENT_MAX_WAIT_MS', '10'))
+# 0 — оставить значение torch по умолчанию
+SENTIMENT_TORCH_THREADS = int(os.environ.get('SENTIMENT_TORCH_THREADS', '0'))
+# Длина чанка в токенах для длинных текстов; 0 — лимит модели минус служебные токены
+SENTIMENT_MAX_TOKENS = int(os.environ.get('SENTIMENT_MAX_TOKENS', '0'))
+SENTIMENT_QUEUE_SIZE = int(os.environ.get('SENTIMENT_QUEUE_SIZE', '1024'))
+
+_LATENCY_WINDOW = 1000
+
+
+class _Request:
+    def __init__(self, chunks, weights):
+        self.chunks = chunks
+        self.weights = weights
+        self.scores = [None] * len(chunks)
+        self.pending = len(chunks)
+        self.future = Future()
+        self.created = time.perf_counter()
+
+
+class SentimentWorker:
+    """
+    Один поток инференса на процесс. Запросы из всех потоков Flask складываются в очередь,
+    поток собирает из них батч (до max_batch чанков или max_wait_ms) и гоняет его одним вызовом
+    pipeline. Длинный текст режется на чанки по токенам, распределения по звёздам
+    усредняются с весом по длине чанка — вместо молчаливой обрезки до 512 токенов.
+    """
+
+    def __init__(self, load_pipeline, max_batch=SENTIMENT_MAX_BATCH, max_wait_ms=SENTIMENT_MAX_WAIT_MS,
+                 torch_threads=SENTIMENT_TORCH_THREADS, max_tokens=SENTIMENT_MAX_TOKENS):
+        self._load_pipeline = load_pipeline
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.torch_threads = torch_threads
+        self.max_tokens = max_tokens
+        self._reset()
+        # Состояние принадлежит процессу: после fork (gunicorn --preload) поток, очередь и замки
+        # родителя недействительны. Сброс в after_in_child идёт, пока в ребёнке ещё один поток
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._start_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=SENTIMENT_QUEUE_SIZE)
+        self._thread = None
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._started_at = None
+        self._texts = 0
+        self._chunks = 0
+        self._batches = 0
+        self._busy_s = 0.0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.torch_threads > 0:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="sentiment-worker", daemon=True)
+            self._thread.start()
+
+    # --- Публичный API ---
+
+    def submit(self, text):
+        """Ставит текст в очередь, возвращает Future с {"label", "score", "scores"}."""
+        self.start()
+        chunks, weights = self._split(text)
+        request = _Request(chunks, weights)
+        if not chunks:
+            request.future.set_result({"label": "unknown", "score": 0.0, "scores": {}})
+            return request.future
+        self._queue.put(request)
+        return request.future
+
+    def classify(self, text, timeout=None):
+        return self.submit(text).result(timeout)
+
+    def classify_many(self, texts, timeout=None):
+        # Все тексты попадают в очередь сразу и собираются в общие батчи
+        futures = [self.submit(text) for text in texts]
+        return [f.result(timeout) for f in futures]
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            uptime = time.time() - self._started_at if self._started_at else 0.0
+            return {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "queue_depth": self._queue.qsize(),
+                "texts": self._texts,
+                "chunks": self._chunks,
+                "batches": self._batches,
+                "avg_batch_size": round(self._chunks / self._batches, 2) if self._batches else 0.0,
+                "texts_per_s": round(self._texts / uptime, 2) if uptime else 0.0,
+                "busy_ratio": round(self._busy_s / uptime, 3) if uptime else 0.0,
+                "latency_ms": {
+                    "p50": _percentile(latencies, 0.50),
+                    "p95": _percentile(latencies, 0.95),
+                    "p99": _percentile(latencies, 0.99),
+                },
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    # --- Внутреннее ---
+
+    def _pipeline(self):
+        return self._load_pipeline()
+
+    def _token_limit(self, tokenizer):
+        if self.max_tokens > 0:
+            return self.max_tokens
+        # У некоторых токенизаторов model_max_length — "бесконечность"
+        return min(getattr(tokenizer, 'model_max_length', 512) or 512, 512) - 2
+
+    def _split(self, text):
+        """Текст -> (чанки, веса). Короткий текст — один чанк без повторной токенизации в батче."""
+        text = (text or "").strip()
+        if not text:
+            return [], []
+        tokenizer = self._pipeline().tokenizer
+        limit = self._token_limit(tokenizer)
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoded["offset_mapping"]
+        if len(offsets) <= limit:
+            return [text], [max(1, len(offsets))]
+        chunks, weights = [], []
+        for start in range(0, len(offsets), limit):
+            window = offsets[start:start + limit]
+            chunks.append(text[window[0][0]:window[-1][1]])
+            weights.append(len(window))
+        return chunks, weights
+
+    def _collect(self):
+        """Первый запрос ждём без таймаута, дальше добираем до max_batch чанков или до дедлайна."""
+        batch = [self._queue.get()]
+        size = len(batch[0].chunks)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.chunks)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Любая ошибка батча (инференс, разбор выхода, агрегация) — в Future, а не в смерть потока
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _process(self, batch):
+        items = [(request, i) for request in batch for i in range(len(request.chunks))]
+        started = time.perf_counter()
+        outputs = self._pipeline()(
+            [request.chunks[i] for request, i in items],
+            batch_size=len(items), truncation=True, top_k=None,
+        )
+        finished = time.perf_counter()
+        for (request, i), output in zip(items, outputs):
+            request.scores[i] = {item['label']: item['score'] for item in output}
+            request.pending -= 1
+            if request.pending == 0:
+                request.future.set_result(aggregate_scores(request.scores, request.weights))
+        with self._metrics_lock:
+            self._batches += 1
+            self._chunks += len(items)
+            self._texts += len(batch)
+            self._busy_s += finished - started
+            self._latencies.extend((finished - request.created) * 1000 for request in batch)
+
+
+def aggregate_scores(scores, weights):
+    """Взвешенное среднее распределений по чанкам; метка — argmax."""
+    total = float(sum(weights))
+    combined = {}
+    for chunk_scores, weight in zip(scores, weights):
+        for label, score in chunk_scores.items():
+            combined[label] = combined.get(label, 0.0) + score * weight / total
+    label = max(combined, key=combined.get)
+    return {"label": label, "score": combined[label], "scores": combined}
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
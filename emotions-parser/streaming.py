@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import uuid
+
+import webrtcvad
+
+from vad import VAD_RATES
+
+# Сессии потокового анализа живут в памяти процесса
+STREAM_SESSION_TTL_S = int(os.environ.get('STREAM_SESSION_TTL_S', '600'))
+STREAM_MAX_SESSIONS = int(os.environ.get('STREAM_MAX_SESSIONS', '200'))
+# Сколько аудио держим для финального распознавания (по умолчанию 10 минут)
+STREAM_MAX_AUDIO_S = int(os.environ.get('STREAM_MAX_AUDIO_S', '600'))
+
+
+class StreamingPauseAnalyzer:
+    """
+    Инкрементальный VAD: принимает 16-bit mono LPCM кусками произвольной длины,
+    хранит хвост неполного кадра и состояние текущей паузы между вызовами.
+    feed() возвращает события, как только они становятся известны:
+      {"type": "pause_start", "start_ms"}                  — началась тишина
+      {"type": "pause", "start_ms", "end_ms", "duration_ms"} — закрыта пауза >= min_pause_duration_ms
+    """
+
+    def __init__(self, sample_rate=16000, aggressiveness=1, frame_duration_ms=30, min_pause_duration_ms=300, keep_audio=True):
+        if sample_rate not in VAD_RATES:
+            raise ValueError(f"Неподдерживаемая частота дискретизации: {sample_rate}")
+        self.sample_rate = sample_rate
+        self.frame_duration_ms = frame_duration_ms
+        self.min_pause_duration_ms = min_pause_duration_ms
+        self.bytes_per_frame = int(sample_rate * frame_duration_ms / 1000) * 2
+        self._is_speech = webrtcvad.Vad(aggressiveness).is_speech
+        self._pending = bytearray()
+        self._pause_start = None  # номер кадра начала текущей тишины
+        self._pause_start_reported = False
+        self.frames = 0
+        self.speech_frames = 0
+        self.pauses = []
+        self.keep_audio = keep_audio
+        self.audio = bytearray()
+        self._max_audio_bytes = STREAM_MAX_AUDIO_S * sample_rate * 2
+
+    def feed(self, pcm):
+        events = []
+        if self.keep_audio and len(self.audio) < self._max_audio_bytes:
+            self.audio += pcm[:self._max_audio_bytes - len(self.audio)]
+        self._pending += pcm
+        n_frames = len(self._pending) // self.bytes_per_frame
+        if not n_frames:
+            return events
+        bpf = self.bytes_per_frame
+        with memoryview(self._pending) as view:
+            for i in range(n_frames):
+                self._on_frame(self._is_speech(view[i * bpf:(i + 1) * bpf], self.sample_rate), events)
+        del self._pending[:n_frames * bpf]
+        return events
+
+    def _on_frame(self, is_speech, events):
+        index = self.frames
+        self.frames += 1
+        if is_speech:
+            self.speech_frames += 1
+            if self._pause_start is not None:
+                self._close_pause(index, events)
+            return
+        if self._pause_start is None:
+            self._pause_start = index
+            self._pause_start_reported = False
+        # Паузу объявляем, как только она дотянула до минимальной длины
+        if not self._pause_start_reported and (self.frames - self._pause_start) * self.frame_duration_ms >= self.min_pause_duration_ms:
+            self._pause_start_reported = True
+            events.append({"type": "pause_start", "start_ms": self._pause_start * self.frame_duration_ms})
+
+    def _close_pause(self, end_frame, events):
+        duration = (end_frame - self._pause_start) * self.frame_duration_ms
+        if duration >= self.min_pause_duration_ms:
+            self.pauses.append(duration)
+            events.append({
+                "type": "pause",
+                "start_ms": self._pause_start * self.frame_duration_ms,
+                "end_ms": end_frame * self.frame_duration_ms,
+                "duration_ms": duration,
+            })
+        self._pause_start = None
+        self._pause_start_reported = False
+
+    def stats(self):
+        duration_ms = self.frames * self.frame_duration_ms
+        current_pause_ms = (self.frames - self._pause_start) * self.frame_duration_ms if self._pause_start is not None else 0
+        return {
+            "duration_ms": duration_ms,
+            "speech_ms": self.speech_frames * self.frame_duration_ms,
+            "speech_ratio": round(self.speech_frames / self.frames, 3) if self.frames else 0.0,
+            "pause_count": len(self.pauses),
+            "total_pause_duration_ms": sum(self.pauses),
+            "current_pause_ms": current_pause_ms,
+        }
+
+    def finish(self):
+        """Закрывает хвостовую паузу (как analyze_pauses) и возвращает итог в формате pause_analysis."""
+        events = []
+        if self._pause_start is not None:
+            self._close_pause(self.frames, events)
+        # Клиент мог прислать нечётное число байт: оставляем только целые 16-битные сэмплы
+        del self.audio[len(self.audio) - len(self.audio) % 2:]
+        return events, {
+            "pause_count": len(self.pauses),
+            "total_pause_duration_ms": sum(self.pauses),
+            "pauses_ms": list(self.pauses),
+        }
+
+
+class StreamSession:
+    def __init__(self, analyzer, lang):
+        self.id = uuid.uuid4().hex
+        self.analyzer = analyzer
+        self.lang = lang
+        self.lock = threading.Lock()
+        self.touched_at = time.monotonic()
+
+
+class StreamSessions:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items() if now - s.touched_at > STREAM_SESSION_TTL_S]:
+            del self._sessions[sid]
+
+    def create(self, sample_rate=16000, lang='ru', **vad_options):
+        session = StreamSession(StreamingPauseAnalyzer(sample_rate=sample_rate, **vad_options), lang)
+        with self._lock:
+            self._evict()
+            if len(self._sessions) >= STREAM_MAX_SESSIONS:
+                raise RuntimeError("Слишком много активных потоковых сессий")
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched_at = time.monotonic()
+            return session
+
+    def pop(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+
+stream_sessions = StreamSessions()
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import webrtcvad
+
+from audio_buffer import frame_rms
+
+VAD_RATES = (8000, 16000, 32000, 48000)
+# Кадры с RMS ниже порога считаются тишиной без вызова VAD (0 — фильтр выключен)
+VAD_SILENCE_RMS = float(os.environ.get('VAD_SILENCE_RMS', '0'))
+
+
+def vad_speech_mask(audio, aggressiveness=1, frame_duration_ms=30, silence_rms=None):
+    """
+    Возвращает булев массив "речь/не речь" по кадрам frame_duration_ms.
+    Кадры — срезы memoryview общего буфера (без копий). При silence_rms > 0
+    (опция, по умолчанию VAD_SILENCE_RMS=0) кадры тише порога помечаются
+    тишиной без вызова webrtcvad, из-за чего паузы выходят длиннее.
+    """
+    if silence_rms is None:
+        silence_rms = VAD_SILENCE_RMS
+    sample_rate = audio.sample_rate
+    samples_per_frame = int(sample_rate * frame_duration_ms / 1000)
+    bytes_per_frame = samples_per_frame * 2  # 2 байта на сэмпл (16-бит)
+    n_frames = len(audio.samples) // samples_per_frame  # последний неполный кадр пропускаем
+
+    speech = np.zeros(n_frames, dtype=bool)
+    if n_frames == 0:
+        return speech
+    if silence_rms > 0:
+        candidates = np.flatnonzero(frame_rms(audio.samples, samples_per_frame) >= silence_rms)
+    else:
+        candidates = range(n_frames)
+
+    is_speech = webrtcvad.Vad(aggressiveness).is_speech
+    raw = audio.raw
+    for i in candidates:
+        offset = i * bytes_per_frame
+        speech[i] = is_speech(raw[offset:offset + bytes_per_frame], sample_rate)
+    return speech
+
+
+def pause_runs(speech, frame_duration_ms=30, min_pause_duration_ms=300):
+    """Непрерывные участки тишины длиной от min_pause_duration_ms: список (start_ms, end_ms)."""
+    silent = np.concatenate(([0], (~speech).astype(np.int8), [0]))
+    edges = np.diff(silent)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    durations = (ends - starts) * frame_duration_ms
+    keep = durations >= min_pause_duration_ms
+    return list(zip((starts[keep] * frame_duration_ms).tolist(), (ends[keep] * frame_duration_ms).tolist()))
+
+
+def pause_summary(speech, frame_duration_ms=30, min_pause_duration_ms=300):
+    """Сводка пауз по маске речи: количество, суммарная длительность и список длительностей (мс)."""
+    pauses = [end - start for start, end in pause_runs(speech, frame_duration_ms, min_pause_duration_ms)]
+
+    return {
+        "pause_count": len(pauses),
+        "total_pause_duration_ms": sum(pauses),
+        "pauses_ms": pauses
+    }
@@ -22,3 +22,27 @@ EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multili
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 800))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 120))
 
+
+# Режим чанкинга: "chars" — по символам (CHUNK_SIZE/CHUNK_OVERLAP),
+# "tokens" — по токенам токенизатора модели эмбеддингов
+CHUNK_MODE = os.getenv("CHUNK_MODE", "chars").lower()
+# Бюджет токенов на чанк; 0 — взять max_seq_length модели эмбеддингов
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 0))
+# Перекрытие чанков в токенах
+CHUNK_TOKEN_OVERLAP = int(os.getenv("CHUNK_TOKEN_OVERLAP", 16))
+
+# Пакетный конвейер загрузки (/api/ingest/jobs)
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", os.cpu_count() or 2))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 64))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", 64))
+INGEST_WRITE_BATCH = int(os.getenv("INGEST_WRITE_BATCH", 256))
+INGEST_BATCH_WAIT_MS = int(os.getenv("INGEST_BATCH_WAIT_MS", 50))
+# Предел суммарного размера файлов в одном запросе (413 при превышении)
+INGEST_MAX_REQUEST_MB = int(os.getenv("INGEST_MAX_REQUEST_MB", 200))
+# Загрузки до парсинга лежат на диске, а не в памяти
+INGEST_STAGING_DIR = Path(os.getenv("INGEST_STAGING_DIR", UPLOADS_DIR / ".ingest"))
+INGEST_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+
+# Асинхронная загрузка документов (/api/documents?mode=async): очередь в sqlite внутри CHROMA_DIR
+INGEST_QUEUE_WORKERS = int(os.getenv("INGEST_QUEUE_WORKERS", 2))
+INGEST_QUEUE_BATCH = int(os.getenv("INGEST_QUEUE_BATCH", 16))
@@ -4,6 +4,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.routers.resumes import router as resumes_router
 from app.routers.documents import router as documents_router
 from app.routers import router as facts_router
+from app.routers.ingest import router as ingest_router
+from app.services.ingest import ingest_pipeline
+from app.services.ingest_queue import ingest_queue
 
 
 def create_app() -> FastAPI:
@@ -20,6 +23,10 @@ def create_app() -> FastAPI:
     app.include_router(resumes_router, prefix="/api/resumes", tags=["resumes"])
     app.include_router(documents_router, prefix="/api", tags=["documents"])
     app.include_router(facts_router, prefix="/api", tags=["facts"])
+    app.include_router(ingest_router, prefix="/api", tags=["ingest"])
+    app.add_event_handler("startup", ingest_queue.start)
+    app.add_event_handler("shutdown", ingest_queue.stop)
+    app.add_event_handler("shutdown", ingest_pipeline.stop)
     return app
 
 
@@ -1,13 +1,15 @@
+import asyncio
+import time
 from typing import Any, Dict, List, Optional
-from uuid import uuid4
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
-from app.services.extractors import extract_structured_data
-from app.utils.text import chunk_text
-from app.utils.chunking import chunk_structured_document, chunk_dialogue
-from app.services.vectorstore import add_documents, get_collection, delete_all, get_by_where
+from app.services.documents import prepare_document, find_cached_chunks
+from app.services.ingest_queue import ingest_queue
+from app.services.vectorstore import add_documents, get_collection, delete_all
+from app.services.skills import skill_index
 
 
 router = APIRouter()
@@ -29,75 +31,102 @@ class QueryFilter(BaseModel):
 class QueryIn(BaseModel):
     query_text: Optional[str] = None
     filters: List[QueryFilter] = []
+    # Точный фасет по навыкам: все перечисленные / хотя бы один
+    skills_all: List[str] = []
+    skills_any: List[str] = []
     top_k: int = 5
 
 
-def build_where(filters: List[QueryFilter]) -> Optional[Dict[str, Any]]:
-    if not filters:
-        return None
+def build_where(filters: List[QueryFilter], extra: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
     clauses: List[Dict[str, Any]] = []
     for f in filters:
         field = f.field
         op = f.operator
         value = f.value
         clauses.append({field: {op: value}})
+    clauses.extend(extra or [])
+    if not clauses:
+        return None
     if len(clauses) == 1:
         return clauses[0]
     return {"$and": clauses}
 
 
 @router.post("/documents", status_code=201)
-async def add_document(doc: DocumentIn):
-    text = doc.content
-    structured = extract_structured_data(text, doc.source_type)
-    # Chroma метаданные поддерживают только скаляры; разворачиваем во flat-вид
-    flat_structured = {f"structured_data.{k}": v for k, v in structured.items()}
-
-    # Выбираем стратегию чанкинга по типу документа
-    if doc.source_type in ("resume", "vacancy"):
-        chunks = chunk_structured_document(text, 800, 120)
-    elif doc.source_type == "dialogue":
-        chunks = chunk_dialogue(text, utterances_per_chunk=4, utterance_overlap=2)
-    else:
-        chunks = chunk_text(text, 800, 120)
+async def add_document(
+    doc: DocumentIn,
+    mode: str = Query("sync", pattern=r"^(sync|async)$"),
+    wait_ms: int = Query(0, ge=0, le=60000),
+):
+    if mode == "async":
+        return await _add_document_async(doc, wait_ms)
+
+    prepared = prepare_document(doc.source_id, doc.source_type, doc.document_name, doc.content)
+    structured = prepared.structured
+    chunks = prepared.chunks
     if not chunks:
         raise HTTPException(status_code=400, detail="Пустой документ")
 
     # Кеширование: если уже есть документы с таким source_id и source_type — возвращаем их, не добавляя повторно
-    # Chroma ожидает единый оператор в where: используем $and для нескольких полей
-    existing_where = {
-        "$and": [
-            {"source_id": {"$eq": doc.source_id}},
-            {"source_type": {"$eq": doc.source_type}},
-        ]
-    }
-    # ids возвращаются по умолчанию; параметр include не поддерживает значение 'ids'
-    existing = get_by_where(existing_where, limit=1)
-    if existing and existing.get("ids"):
-        ids = existing.get("ids", [])
-        chunks_count = len(ids[0]) if ids and isinstance(ids[0], list) else len(ids)
-        return {"source_id": doc.source_id, "chunks": chunks_count, "structured_data": structured, "cached": True}
-
-    ids = [f"{doc.source_id}_{i}_{uuid4().hex[:8]}" for i in range(len(chunks))]
-    metadatas = [{
-        "source_id": doc.source_id,
-        "source_type": doc.source_type,
-        "document_name": doc.document_name,
-        "chunk_index": i,
-        **flat_structured,
-    } for i in range(len(chunks))]
+    cached_chunks = find_cached_chunks(doc.source_id, doc.source_type)
+    if cached_chunks is not None:
+        return {"source_id": doc.source_id, "chunks": cached_chunks, "structured_data": structured, "cached": True}
 
+    metadatas = prepared.metadatas
     print(f'ADDED {len(chunks)} chunks for {doc.source_id} {doc.source_type} {doc.document_name}')
     print(f'METADATAS: {metadatas}')
 
-    add_documents(chunks, metadatas, ids)
+    add_documents(chunks, metadatas, prepared.ids)
+    if structured.get("skills"):
+        skill_index.add(doc.source_id, structured["skills"])
     return {"source_id": doc.source_id, "chunks": len(chunks), "structured_data": structured, "cached": False}
 
 
+async def _add_document_async(doc: DocumentIn, wait_ms: int):
+    """
+    Документ ставится в персистентную очередь, ответ 202 с job_id сразу.
+    wait_ms > 0 — подождать до N мс готовности (read-your-writes для вызывающего).
+    """
+    # sqlite — блокирующие вызовы: выполняем в пуле потоков, цикл событий не держим
+    job_id = await asyncio.to_thread(ingest_queue.enqueue, doc.model_dump())
+    job = await asyncio.to_thread(ingest_queue.get, job_id)
+    deadline = time.monotonic() + wait_ms / 1000
+    while job and job["status"] in ("queued", "running") and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+        job = await asyncio.to_thread(ingest_queue.get, job_id)
+    if job and job["status"] == "done":
+        return {**job["result"], "job_id": job_id}
+    if job and job["status"] == "failed":
+        raise HTTPException(status_code=400, detail=job["error"] or "Ошибка загрузки документа")
+    return JSONResponse({"job_id": job_id, "status": job["status"] if job else "queued"}, status_code=202)
+
+
+@router.get("/documents/jobs/{job_id}")
+async def get_document_job(job_id: str):
+    job = await asyncio.to_thread(ingest_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+@router.get("/documents/queue")
+async def get_document_queue_stats():
+    return await asyncio.to_thread(ingest_queue.stats)
+
+
 @router.post("/query")
 async def query_documents(q: QueryIn):
     collection = get_collection()
-    where = build_where(q.filters)
+    extra: List[Dict[str, Any]] = []
+    if q.skills_all or q.skills_any:
+        # Сначала сужаем кандидатов по posting lists навыков, векторный поиск — только среди них
+        source_ids = skill_index.match(q.skills_all, q.skills_any)
+        if not source_ids:
+            if not q.query_text:
+                return {"ids": [], "metadatas": [], "documents": []}
+            return {"ids": [[]], "distances": [[]], "metadatas": [[]], "documents": [[]]}
+        extra.append({"source_id": {"$in": sorted(source_ids)}})
+    where = build_where(q.filters, extra)
 
     # Поддержка: только фильтры (без query_text) — вернём top_k по фильтру
     if not q.query_text:
@@ -111,6 +140,7 @@ async def query_documents(q: QueryIn):
 @router.post("/reset")
 async def reset_all():
     delete_all()
+    skill_index.clear()
     return {"status": "ok", "message": "collection reset"}
 
 
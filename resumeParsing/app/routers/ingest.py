@@ -0,0 +1,66 @@
+import os
+import uuid
+from typing import List
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from app.config import INGEST_MAX_REQUEST_MB, INGEST_STAGING_DIR
+from app.services.ingest import ingest_pipeline
+
+
+router = APIRouter()
+
+_COPY_CHUNK = 1024 * 1024
+
+
+@router.post("/ingest/jobs", status_code=202)
+async def create_ingest_job(files: List[UploadFile] = File(...), names: List[str] = Form([])):
+    """Пакетная загрузка резюме: файлы уходят в конвейер, ответ — id задачи."""
+    if not files:
+        raise HTTPException(status_code=400, detail="Нет файлов")
+    limit = INGEST_MAX_REQUEST_MB * 1024 * 1024
+    total = 0
+    items = []
+    try:
+        # Файлы переносятся на диск кусками: в памяти не держим ни один файл целиком,
+        # в очереди конвейера попадают только пути
+        for i, file in enumerate(files):
+            path = str(INGEST_STAGING_DIR / uuid.uuid4().hex)
+            items.append({
+                "filename": file.filename or "resume",
+                "path": path,
+                "name": names[i] if i < len(names) else "",
+            })
+            with open(path, "wb") as out:
+                while True:
+                    chunk = await file.read(_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if total > limit:
+                        raise HTTPException(status_code=413, detail=f"Суммарный размер файлов больше {INGEST_MAX_REQUEST_MB} МБ")
+                    await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        for item in items:
+            try:
+                os.remove(item["path"])
+            except OSError:
+                pass
+        raise
+    job = await ingest_pipeline.submit(items)
+    return JSONResponse(job.to_dict(), status_code=202)
+
+
+@router.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingest_pipeline.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job.to_dict()
+
+
+@router.get("/ingest/metrics")
+async def get_ingest_metrics():
+    return ingest_pipeline.metrics_snapshot()
@@ -1,15 +1,14 @@
 import uuid
-from pathlib import Path
 from typing import List
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Form
 from fastapi.responses import JSONResponse
 
-from app.config import UPLOADS_DIR, CHUNK_SIZE, CHUNK_OVERLAP
 from app.services.parsers import extract_text
-from app.utils.text import chunk_text
 from app.services.vectorstore import add_documents, similarity_search, delete_all
-from app.utils.names import normalize_name, generate_candidate_id
+from app.services.ingest import prepare_resume
+from app.services.skills import skill_index
+from app.utils.names import normalize_name
 
 
 router = APIRouter()
@@ -24,39 +23,24 @@ async def upload_resume(file: UploadFile = File(...), name: str = Form("") ):
     if text is None or not text.strip():
         raise HTTPException(status_code=400, detail="Неподдерживаемый формат или пустой файл")
 
-    # логируем оригинал
+    # логируем оригинал, чанкинг и сохранение в Chroma
     uid = uuid.uuid4().hex
-    target_path = Path(UPLOADS_DIR) / f"{uid}_{Path(filename).name}"
-    with open(target_path, "wb") as f:
-        f.write(raw)
-
-    # чанкинг и сохранение в Chroma
-    chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-    ids = [f"{uid}_{i}" for i in range(len(chunks))]
-    name_norm = normalize_name(name)
-    candidate_id = generate_candidate_id(name_norm) if name_norm else ""
-    metadatas = [{
-        "source": str(target_path),
-        "filename": filename,
-        "uid": uid,
-        "chunk_index": i,
-        "name": name.strip() if name else "",
-        "name_norm": name_norm,
-        "candidate_id": candidate_id,
-    } for i in range(len(chunks))]
-
-    if not chunks:
+    prepared = prepare_resume(uid, filename, raw, text, name)
+    if not prepared.chunks:
         raise HTTPException(status_code=400, detail="Не удалось извлечь текст из файла")
 
-    add_documents(chunks, metadatas, ids)
+    add_documents(prepared.chunks, prepared.metadatas, prepared.ids)
+    if prepared.structured.get("skills"):
+        skill_index.add(uid, prepared.structured["skills"])
 
     return JSONResponse({
         "uid": uid,
         "filename": filename,
-        "chunks": len(chunks),
-        "name": name.strip() if name else "",
-        "name_norm": name_norm,
-        "candidate_id": candidate_id,
+        "chunks": len(prepared.chunks),
+        "name": prepared.name,
+        "name_norm": prepared.name_norm,
+        "candidate_id": prepared.candidate_id,
+        "structured_data": prepared.structured,
     })
 
 
@@ -82,5 +66,6 @@ async def find_by_name(name: str = Query(..., min_length=1), n: int = Query(5, g
 @router.post("/reset")
 async def reset_collection():
     delete_all()
+    skill_index.clear()
     return JSONResponse({"status": "ok", "message": "collection reset"})
 
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from app.config import CHUNK_MODE, CHUNK_TOKEN_OVERLAP
+from app.services.extractors import extract_structured_data, flatten_structured
+from app.services.vectorstore import get_by_where
+from app.utils.text import chunk_text
+from app.utils.chunking import chunk_structured_document, chunk_dialogue, chunk_by_tokens, chunk_structured_document_by_tokens
+from app.utils.tokens import token_budget
+
+
+@dataclass
+class PreparedDocument:
+    source_id: str
+    source_type: str
+    structured: Dict[str, Any]
+    chunks: List[str]
+    metadatas: List[Dict[str, Any]]
+    ids: List[str]
+
+
+def chunk_document(text: str, source_type: str) -> List[str]:
+    # Выбираем стратегию чанкинга по типу документа
+    # В режиме "tokens" чанки пакуются под max_seq_length модели эмбеддингов
+    if source_type in ("resume", "vacancy"):
+        if CHUNK_MODE == "tokens":
+            return chunk_structured_document_by_tokens(text, token_budget(), CHUNK_TOKEN_OVERLAP)
+        return chunk_structured_document(text, 800, 120)
+    if source_type == "dialogue":
+        return chunk_dialogue(text, utterances_per_chunk=4, utterance_overlap=2)
+    if CHUNK_MODE == "tokens":
+        return chunk_by_tokens(text, token_budget(), CHUNK_TOKEN_OVERLAP)
+    return chunk_text(text, 800, 120)
+
+
+def prepare_document(source_id: str, source_type: str, document_name: str, content: str) -> PreparedDocument:
+    structured = extract_structured_data(content, source_type)
+    # Chroma метаданные поддерживают только скаляры; разворачиваем во flat-вид
+    flat_structured = flatten_structured(structured)
+    chunks = chunk_document(content, source_type)
+    ids = [f"{source_id}_{i}_{uuid4().hex[:8]}" for i in range(len(chunks))]
+    metadatas = [{
+        "source_id": source_id,
+        "source_type": source_type,
+        "document_name": document_name,
+        "chunk_index": i,
+        **flat_structured,
+    } for i in range(len(chunks))]
+    return PreparedDocument(source_id, source_type, structured, chunks, metadatas, ids)
+
+
+def find_cached_chunks(source_id: str, source_type: str) -> Optional[int]:
+    """Если документ с таким source_id и source_type уже добавлен — число найденных id, иначе None."""
+    # Chroma ожидает единый оператор в where: используем $and для нескольких полей
+    existing_where = {
+        "$and": [
+            {"source_id": {"$eq": source_id}},
+            {"source_type": {"$eq": source_type}},
+        ]
+    }
+    # ids возвращаются по умолчанию; параметр include не поддерживает значение 'ids'
+    existing = get_by_where(existing_where, limit=1)
+    if existing and existing.get("ids"):
+        ids = existing.get("ids", [])
+        return len(ids[0]) if ids and isinstance(ids[0], list) else len(ids)
+    return None
@@ -1,28 +1,199 @@
 import re
-from typing import Dict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.services.skills import SKILL_ALIASES, SKILL_BY_ALIAS
 
 
 _EXPERIENCE_RE = re.compile(r"опыт\s+работы\s*[—-]?\s*(\d+)\s*(?:год|года|лет)?\s*(\d+)?\s*(?:месяц|месяца|месяцев)?", re.IGNORECASE)
 
 
+@dataclass
+class Extractor:
+    """
+    Один извлекатель поля: регулярка + обработчик совпадения.
+    triggers — слова (в нижнем регистре), с которых может начинаться совпадение:
+    регулярка проверяется только в позициях этих слов.
+    Обработчик получает весь совпавший текст, группы своей регулярки
+    и дописывает результат в общий словарь данных.
+    """
+    name: str
+    pattern: str
+    triggers: Iterable[str]
+    handle: Callable[[str, Tuple[Optional[str], ...], Dict], None]
+
+
+_WORD_RE = re.compile(r"\w+")
+
+# source_type -> список извлекателей
+_REGISTRY: Dict[str, List[Extractor]] = {}
+# source_type -> слово-триггер -> скомпилированные регулярки извлекателей
+_COMPILED: Dict[str, Dict[str, List[Tuple[re.Pattern, Extractor]]]] = {}
+
+
+def register_extractor(source_type: str, extractor: Extractor) -> None:
+    extractors = _REGISTRY.setdefault(source_type, [])
+    extractors[:] = [e for e in extractors if e.name != extractor.name]
+    extractors.append(extractor)
+    _COMPILED.pop(source_type, None)
+
+
+def _compile(source_type: str) -> Optional[Dict[str, List[Tuple[re.Pattern, Extractor]]]]:
+    cached = _COMPILED.get(source_type)
+    if cached is not None:
+        return cached
+    extractors = _REGISTRY.get(source_type) or []
+    if not extractors:
+        return None
+    # Индекс "слово -> извлекатели": текст сканируется один раз по словам,
+    # на каждое слово — один поиск в словаре, сколько бы извлекателей ни было.
+    index: Dict[str, List[Tuple[re.Pattern, Extractor]]] = {}
+    for extractor in extractors:
+        regex = re.compile(extractor.pattern, re.IGNORECASE)
+        for trigger in extractor.triggers:
+            index.setdefault(trigger.lower(), []).append((regex, extractor))
+    _COMPILED[source_type] = index
+    return index
+
+
 def parse_experience_from_resume(text: str) -> Dict[str, int]:
     match = _EXPERIENCE_RE.search(text)
     if not match:
         return {}
-    years = int(match.group(1)) if match.group(1) else 0
-    months = int(match.group(2)) if match.group(2) else 0
+    return _experience_months(match.groups())
+
+
+def _experience_months(groups: Tuple[Optional[str], ...]) -> Dict[str, int]:
+    years = int(groups[0]) if groups[0] else 0
+    months = int(groups[1]) if groups[1] else 0
     total_months = years * 12 + months
     if total_months <= 0:
         return {}
     return {"total_experience_months": total_months}
 
 
+def _handle_experience(value: str, groups: Tuple[Optional[str], ...], data: Dict) -> None:
+    # Как и раньше, берём первое упоминание опыта
+    if "total_experience_months" not in data:
+        data.update(_experience_months(groups))
+
+
+# Длинные варианты первыми, чтобы "spring boot" не съедался "spring"
+_SKILL_ALIAS_LIST = [alias for aliases in SKILL_ALIASES.values() for alias in aliases]
+_SKILL_PATTERN = r"(?:" + "|".join(
+    re.escape(a) for a in sorted(_SKILL_ALIAS_LIST, key=len, reverse=True)
+) + r")(?![\w#+])"
+_SKILL_TRIGGERS = {_WORD_RE.match(alias).group() for alias in _SKILL_ALIAS_LIST}
+
+
+def _handle_skill(value: str, groups: Tuple[Optional[str], ...], data: Dict) -> None:
+    skill = SKILL_BY_ALIAS.get(value.lower())
+    if not skill:
+        return
+    skills = data.setdefault("skills", [])
+    if skill not in skills:
+        skills.append(skill)
+
+
+_GRADES = {
+    "intern": "intern", "стажер": "intern", "стажёр": "intern",
+    "junior": "junior", "джуниор": "junior", "младший": "junior",
+    "middle": "middle", "мидл": "middle",
+    "senior": "senior", "сеньор": "senior", "синьор": "senior", "старший": "senior",
+    "lead": "lead", "тимлид": "lead", "teamlead": "lead", "ведущий": "lead",
+}
+_GRADE_PATTERN = r"(" + "|".join(sorted(_GRADES, key=len, reverse=True)) + r")(?!\w)"
+
+
+def _handle_grade(value: str, groups: Tuple[Optional[str], ...], data: Dict) -> None:
+    if "grade" not in data and groups[0]:
+        data["grade"] = _GRADES[groups[0].lower()]
+
+
+# Без "г.": в резюме это чаще год ("2019 г. — настоящее время"), чем город
+_LOCATION_PATTERN = r"(?:город|проживание|место\s+проживания|локация|location)\s*[:—-]?\s*([A-Za-zА-Яа-яЁё][\w-]+(?:[ -][A-Za-zА-Яа-яЁё][\w-]+)?)"
+_LOCATION_TRIGGERS = ("город", "проживание", "место", "локация", "location")
+
+
+def _handle_location(value: str, groups: Tuple[Optional[str], ...], data: Dict) -> None:
+    if "location" not in data and groups[0]:
+        data["location"] = groups[0].strip()
+
+
 def extract_structured_data(text: str, source_type: str) -> Dict:
     data: Dict = {}
-    if source_type == "resume":
-        data.update(parse_experience_from_resume(text))
-        # В будущем: возраст, навыки, грейд и т.д.
-    # Для других типов (dialogue, vacancy) — доп. парсеры здесь
+    index = _compile(source_type)
+    if index is None or not text:
+        return data
+    covered = 0
+    for word in _WORD_RE.finditer(text):
+        start = word.start()
+        if start < covered:
+            continue
+        candidates = index.get(word.group().lower())
+        if not candidates:
+            continue
+        for regex, extractor in candidates:
+            match = regex.match(text, start)
+            if match:
+                extractor.handle(match.group(), match.groups(), data)
+                covered = match.end()
+                break
     return data
 
 
+def flatten_structured(structured: Dict) -> Dict:
+    """Chroma метаданные поддерживают только скаляры: списки склеиваем через запятую."""
+    flat: Dict = {}
+    for key, value in structured.items():
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        flat[f"structured_data.{key}"] = value
+    return flat
+
+
+register_extractor("resume", Extractor("experience", _EXPERIENCE_RE.pattern, ("опыт",), _handle_experience))
+register_extractor("resume", Extractor("skills", _SKILL_PATTERN, _SKILL_TRIGGERS, _handle_skill))
+register_extractor("resume", Extractor("grade", _GRADE_PATTERN, _GRADES, _handle_grade))
+register_extractor("resume", Extractor("location", _LOCATION_PATTERN, _LOCATION_TRIGGERS, _handle_location))
+register_extractor("vacancy", Extractor("skills", _SKILL_PATTERN, _SKILL_TRIGGERS, _handle_skill))
+register_extractor("vacancy", Extractor("grade", _GRADE_PATTERN, _GRADES, _handle_grade))
+register_extractor("vacancy", Extractor("location", _LOCATION_PATTERN, _LOCATION_TRIGGERS, _handle_location))
+
+
+if __name__ == "__main__":
+    # Бенчмарк: python -m app.services.extractors
+    # Стоимость на КБ должна оставаться ~постоянной при добавлении извлекателей,
+    # тогда как последовательные проходы регулярками растут линейно.
+    import time
+
+    # Регрессия: год в датах опыта не должен приниматься за город
+    dated = extract_structured_data("Место работы ООО Ромашка, 2019 г. — настоящее время. Java, Kafka", "resume")
+    assert "location" not in dated, dated
+    assert extract_structured_data("Город: Москва", "resume").get("location") == "Москва"
+
+    sample = (
+        "Senior Python разработчик. Город: Москва. Опыт работы — 6 лет 2 месяца. "
+        "Навыки: Java, Kafka, PostgreSQL, Docker, Kubernetes, Spring Boot.\n"
+    ) * 400
+    kb = len(sample.encode("utf-8")) / 1024
+    base = list(_REGISTRY["resume"])
+    for extra in (0, 4, 16, 64):
+        source_type = f"bench_{extra}"
+        for extractor in base:
+            register_extractor(source_type, extractor)
+        for i in range(extra):
+            register_extractor(source_type, Extractor(f"dummy_{i}", rf"маркер{i}\s*:\s*(\w+)", (f"маркер{i}",), lambda v, g, d: None))
+        runs = 20
+        start = time.perf_counter()
+        for _ in range(runs):
+            extract_structured_data(sample, source_type)
+        single = (time.perf_counter() - start) / runs / kb * 1e6
+        patterns = [re.compile(e.pattern, re.IGNORECASE) for e in _REGISTRY[source_type]]
+        start = time.perf_counter()
+        for _ in range(runs):
+            for pattern in patterns:
+                for _m in pattern.finditer(sample):
+                    pass
+        sequential = (time.perf_counter() - start) / runs / kb * 1e6
+        print(f"extractors={len(patterns):3d}  single-scan {single:8.1f} us/KB  sequential {sequential:8.1f} us/KB")
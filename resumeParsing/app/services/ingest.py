@@ -0,0 +1,394 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import (
+    UPLOADS_DIR,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    CHUNK_MODE,
+    CHUNK_TOKEN_OVERLAP,
+    INGEST_PARSE_WORKERS,
+    INGEST_QUEUE_SIZE,
+    INGEST_EMBED_BATCH,
+    INGEST_WRITE_BATCH,
+    INGEST_BATCH_WAIT_MS,
+)
+from app.services.parsers import extract_text_from_path
+from app.services.extractors import extract_structured_data, flatten_structured
+from app.services.skills import skill_index
+from app.services.vectorstore import embed_documents, add_embedded_documents, delete_by_source
+from app.utils.text import chunk_text
+from app.utils.chunking import chunk_by_tokens
+from app.utils.tokens import token_budget
+from app.utils.names import normalize_name, generate_candidate_id
+
+
+@dataclass
+class PreparedResume:
+    uid: str
+    filename: str
+    name: str
+    name_norm: str
+    candidate_id: str
+    structured: Dict[str, Any]
+    chunks: List[str]
+    metadatas: List[Dict[str, Any]]
+    ids: List[str]
+
+
+def prepare_resume(uid: str, filename: str, raw: bytes, text: str, name: str = "",
+                   source_path: Optional[str] = None) -> PreparedResume:
+    """Сохраняет оригинал, режет текст на чанки и собирает метаданные для Chroma.
+    source_path — уже записанный на диск оригинал: переносится, а не копируется."""
+    # логируем оригинал
+    target_path = Path(UPLOADS_DIR) / f"{uid}_{Path(filename).name}"
+    if source_path:
+        os.replace(source_path, target_path)
+    else:
+        with open(target_path, "wb") as f:
+            f.write(raw)
+
+    if CHUNK_MODE == "tokens":
+        chunks = chunk_by_tokens(text, token_budget(), CHUNK_TOKEN_OVERLAP)
+    else:
+        chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+    name_clean = name.strip() if name else ""
+    name_norm = normalize_name(name)
+    candidate_id = generate_candidate_id(name_norm) if name_norm else ""
+    structured = extract_structured_data(text, "resume")
+    metadatas = [{
+        "source_id": uid,
+        "source": str(target_path),
+        "filename": filename,
+        "uid": uid,
+        "chunk_index": i,
+        "name": name_clean,
+        "name_norm": name_norm,
+        "candidate_id": candidate_id,
+        **flatten_structured(structured),
+    } for i in range(len(chunks))]
+    ids = [f"{uid}_{i}" for i in range(len(chunks))]
+    return PreparedResume(uid, filename, name_clean, name_norm, candidate_id, structured, chunks, metadatas, ids)
+
+
+# --- Конвейер пакетной загрузки ---
+# parse (пул процессов) -> chunk+extract -> embed (батчи) -> write (батчи в Chroma)
+# Между стадиями ограниченные очереди: медленная стадия тормозит предыдущие,
+# а не копит файлы в памяти.
+
+
+@dataclass
+class IngestFile:
+    job_id: str
+    uid: str
+    filename: str
+    name: str
+    path: str = ""
+    text: str = ""
+    prepared: Optional[PreparedResume] = None
+    pending_chunks: int = 0
+    # чанков уже в Chroma: при сбое файла их удаляем, чтобы не оставлять документ проиндексированным наполовину
+    written: int = 0
+
+
+@dataclass
+class ChunkItem:
+    file: IngestFile
+    id: str
+    text: str
+    metadata: Dict[str, Any]
+    embedding: Optional[List[float]] = None
+
+
+@dataclass
+class IngestJob:
+    id: str
+    files: Dict[str, Dict[str, Any]]
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        states = [f["status"] for f in self.files.values()]
+        if all(s in ("done", "failed") for s in states):
+            return "failed" if all(s == "failed" for s in states) else "done"
+        if all(s == "queued" for s in states):
+            return "queued"
+        return "running"
+
+    def to_dict(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for f in self.files.values():
+            counts[f["status"]] = counts.get(f["status"], 0) + 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.files),
+            "counts": counts,
+            "files": list(self.files.values()),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+@dataclass
+class StageMetrics:
+    processed: int = 0
+    failed: int = 0
+    busy_s: float = 0.0
+
+    def to_dict(self, queue: Optional[asyncio.Queue], uptime_s: float) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy_s": round(self.busy_s, 3),
+            # пропускная способность стадии (элементов в секунду работы) и фактическая
+            "items_per_busy_s": round(self.processed / self.busy_s, 2) if self.busy_s else None,
+            "items_per_s": round(self.processed / uptime_s, 2) if uptime_s else None,
+            "queue_depth": queue.qsize() if queue is not None else None,
+            "queue_max": queue.maxsize if queue is not None else None,
+        }
+
+
+_MAX_JOBS = 500
+
+
+class IngestPipeline:
+    def __init__(self):
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self.metrics: Dict[str, StageMetrics] = {s: StageMetrics() for s in ("parse", "chunk", "embed", "write")}
+        self._parse_q: Optional[asyncio.Queue] = None
+        self._chunk_q: Optional[asyncio.Queue] = None
+        self._embed_q: Optional[asyncio.Queue] = None
+        self._write_q: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._enqueuers: set = set()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._started_at = 0.0
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._parse_q = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self._chunk_q = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self._embed_q = asyncio.Queue(maxsize=INGEST_EMBED_BATCH * 4)
+        self._write_q = asyncio.Queue(maxsize=INGEST_WRITE_BATCH * 4)
+        # spawn: форк из многопоточного процесса (uvicorn, Chroma, torch) может оставить дочерний процесс в дедлоке
+        self._pool = ProcessPoolExecutor(max_workers=max(1, INGEST_PARSE_WORKERS),
+                                         mp_context=multiprocessing.get_context("spawn"))
+        self._started_at = time.time()
+        self._tasks = [asyncio.create_task(self._parse_worker()) for _ in range(max(1, INGEST_PARSE_WORKERS))]
+        self._tasks.append(asyncio.create_task(self._chunk_worker()))
+        self._tasks.append(asyncio.create_task(self._embed_worker()))
+        self._tasks.append(asyncio.create_task(self._write_worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def submit(self, files: List[Dict[str, Any]]) -> IngestJob:
+        """files: [{"filename", "path", "name"}], path — файл во временном каталоге, конвейер
+        забирает его себе. Возвращает задачу сразу, обработка идёт в фоне."""
+        self._ensure_started()
+        job = IngestJob(id=uuid.uuid4().hex, files={})
+        items: List[IngestFile] = []
+        for f in files:
+            uid = uuid.uuid4().hex
+            job.files[uid] = {"uid": uid, "filename": f["filename"], "status": "queued", "chunks": 0, "error": None}
+            items.append(IngestFile(job_id=job.id, uid=uid, filename=f["filename"], name=f.get("name") or "", path=f["path"]))
+        self.jobs[job.id] = job
+        while len(self.jobs) > _MAX_JOBS:
+            self.jobs.popitem(last=False)
+        task = asyncio.create_task(self._enqueue(items))
+        self._enqueuers.add(task)
+        task.add_done_callback(self._enqueuers.discard)
+        return job
+
+    async def _enqueue(self, items: List[IngestFile]):
+        for item in items:
+            await self._parse_q.put(item)
+
+    def get_job(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        uptime = time.time() - self._started_at if self._started_at else 0.0
+        queues = {"parse": self._parse_q, "chunk": self._chunk_q, "embed": self._embed_q, "write": self._write_q}
+        return {
+            "running": bool(self._tasks),
+            "uptime_s": round(uptime, 1),
+            "stages": {name: m.to_dict(queues[name], uptime) for name, m in self.metrics.items()},
+        }
+
+    def _set_file(self, item: IngestFile, status: str, error: Optional[str] = None):
+        job = self.jobs.get(item.job_id)
+        if job is None:
+            return
+        info = job.files[item.uid]
+        info["status"] = status
+        if error:
+            info["error"] = error
+        if item.prepared is not None:
+            info["chunks"] = len(item.prepared.chunks)
+            info["structured_data"] = item.prepared.structured
+        if status in ("done", "failed") and job.status in ("done", "failed"):
+            job.finished_at = time.time()
+
+    async def _fail(self, item: IngestFile, error: str):
+        already_failed = self._file_status(item) == "failed"
+        self._set_file(item, "failed", None if already_failed else error)
+        if item.path:
+            try:
+                os.remove(item.path)
+            except OSError:
+                pass
+            item.path = ""
+        await self._discard_written(item)
+
+    async def _discard_written(self, item: IngestFile):
+        """Удаляет из Chroma уже записанные чанки упавшего файла."""
+        if not item.written:
+            return
+        item.written = 0
+        try:
+            await asyncio.to_thread(delete_by_source, item.uid)
+        except Exception as e:
+            print(f"Ingest: не удалось удалить чанки {item.uid}: {e}")
+
+    async def _parse_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item: IngestFile = await self._parse_q.get()
+            self._set_file(item, "parsing")
+            started = time.perf_counter()
+            error = None
+            try:
+                # PDF/DOCX парсинг — CPU-bound: уносим в отдельный процесс
+                text = await loop.run_in_executor(self._pool, extract_text_from_path, item.filename, item.path)
+            except Exception as e:
+                text = None
+                error = f"parse error: {e}"
+            self.metrics["parse"].busy_s += time.perf_counter() - started
+            if text is None or not text.strip():
+                self.metrics["parse"].failed += 1
+                await self._fail(item, error or "Неподдерживаемый формат или пустой файл")
+                continue
+            self.metrics["parse"].processed += 1
+            item.text = text
+            await self._chunk_q.put(item)
+
+    async def _chunk_worker(self):
+        while True:
+            item: IngestFile = await self._chunk_q.get()
+            started = time.perf_counter()
+            try:
+                item.prepared = await asyncio.to_thread(prepare_resume, item.uid, item.filename, b"", item.text,
+                                                        item.name, item.path)
+            except Exception as e:
+                self.metrics["chunk"].failed += 1
+                await self._fail(item, f"chunk error: {e}")
+                continue
+            finally:
+                self.metrics["chunk"].busy_s += time.perf_counter() - started
+            # оригинал перенесён в UPLOADS_DIR, текст уже нарезан — не держим его в очередях
+            item.path = ""
+            item.text = ""
+            self.metrics["chunk"].processed += 1
+            prepared = item.prepared
+            if not prepared.chunks:
+                self._set_file(item, "failed", "Не удалось извлечь текст из файла")
+                continue
+            item.pending_chunks = len(prepared.chunks)
+            self._set_file(item, "embedding")
+            for chunk_id, chunk, meta in zip(prepared.ids, prepared.chunks, prepared.metadatas):
+                await self._embed_q.put(ChunkItem(item, chunk_id, chunk, meta))
+
+    async def _collect_batch(self, queue: asyncio.Queue, max_size: int) -> List[Any]:
+        """Ждёт первый элемент, затем добирает батч до max_size или до истечения INGEST_BATCH_WAIT_MS."""
+        batch = [await queue.get()]
+        deadline = time.monotonic() + INGEST_BATCH_WAIT_MS / 1000
+        while len(batch) < max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _embed_worker(self):
+        while True:
+            batch: List[ChunkItem] = await self._collect_batch(self._embed_q, INGEST_EMBED_BATCH)
+            started = time.perf_counter()
+            try:
+                embeddings = await asyncio.to_thread(embed_documents, [c.text for c in batch])
+            except Exception as e:
+                self.metrics["embed"].failed += len(batch)
+                for item in {id(c.file): c.file for c in batch}.values():
+                    await self._fail(item, f"embed error: {e}")
+                continue
+            finally:
+                self.metrics["embed"].busy_s += time.perf_counter() - started
+            self.metrics["embed"].processed += len(batch)
+            for i, c in enumerate(batch):
+                c.embedding = embeddings[i] if embeddings is not None else None
+                await self._write_q.put(c)
+
+    async def _write_worker(self):
+        while True:
+            batch: List[ChunkItem] = await self._collect_batch(self._write_q, INGEST_WRITE_BATCH)
+            # файлы, у которых что-то упало раньше, не дописываем
+            batch = [c for c in batch if self._file_status(c.file) != "failed"]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            embeddings = [c.embedding for c in batch]
+            try:
+                await asyncio.to_thread(
+                    add_embedded_documents,
+                    [c.text for c in batch],
+                    [c.metadata for c in batch],
+                    [c.id for c in batch],
+                    None if any(e is None for e in embeddings) else embeddings,
+                )
+            except Exception as e:
+                self.metrics["write"].failed += len(batch)
+                for item in {id(c.file): c.file for c in batch}.values():
+                    await self._fail(item, f"write error: {e}")
+                continue
+            finally:
+                self.metrics["write"].busy_s += time.perf_counter() - started
+            self.metrics["write"].processed += len(batch)
+            for c in batch:
+                c.file.written += 1
+            for c in batch:
+                if self._file_status(c.file) == "failed":
+                    # файл упал на другой стадии, пока этот батч писался
+                    await self._discard_written(c.file)
+                    continue
+                c.file.pending_chunks -= 1
+                if c.file.pending_chunks == 0:
+                    prepared = c.file.prepared
+                    if prepared.structured.get("skills"):
+                        skill_index.add(prepared.uid, prepared.structured["skills"])
+                    self._set_file(c.file, "done")
+
+    def _file_status(self, item: IngestFile) -> Optional[str]:
+        job = self.jobs.get(item.job_id)
+        return job.files[item.uid]["status"] if job else None
+
+
+ingest_pipeline = IngestPipeline()
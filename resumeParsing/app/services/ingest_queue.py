@@ -0,0 +1,210 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.config import CHROMA_DIR, INGEST_QUEUE_WORKERS, INGEST_QUEUE_BATCH
+from app.services.documents import prepare_document, find_cached_chunks
+from app.services.skills import skill_index
+from app.services.vectorstore import add_documents
+
+
+_DB_PATH = CHROMA_DIR / "ingest_queue.sqlite3"
+_MAX_ATTEMPTS = 3
+
+
+class IngestQueue:
+    """
+    Персистентная очередь асинхронной загрузки документов (/api/documents?mode=async).
+    Задачи лежат в sqlite рядом с Chroma, поэтому переживают перезапуск:
+    зависшие в "running" при старте возвращаются в "queued".
+    Воркеры забирают задачи пачкой и пишут все чанки одним add в Chroma.
+    """
+
+    def __init__(self, path=_DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_status ON ingest_jobs (status, created_at)")
+        # Задачи, прерванные перезапуском, обрабатываем заново
+        conn.execute("UPDATE ingest_jobs SET status = 'queued' WHERE status = 'running'")
+
+    def start(self):
+        if self._threads:
+            return
+        self._init_db()
+        self._stopping.clear()
+        for i in range(max(1, INGEST_QUEUE_WORKERS)):
+            t = threading.Thread(target=self._worker, name=f"ingest-queue-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO ingest_jobs (id, payload, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, status, result, error, attempts, created_at, updated_at FROM ingest_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM ingest_jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _claim(self, limit: int) -> List[sqlite3.Row]:
+        conn = self._conn()
+        with self._claim_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, payload, attempts FROM ingest_jobs WHERE status = 'queued' ORDER BY created_at LIMIT ?",
+                    (limit,),
+                ).fetchall()
+                if rows:
+                    conn.executemany(
+                        "UPDATE ingest_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        [(time.time(), row["id"]) for row in rows],
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self._conn().execute(
+            "UPDATE ingest_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            rows = self._claim(INGEST_QUEUE_BATCH)
+            if not rows:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            try:
+                self._process_batch(rows)
+            except Exception as e:
+                for row in rows:
+                    self._retry_or_fail(row, e)
+
+    def _process_batch(self, rows: List[sqlite3.Row]):
+        documents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        ids: List[str] = []
+        added = []
+        seen = set()
+        for row in rows:
+            payload = json.loads(row["payload"])
+            try:
+                prepared = prepare_document(payload["source_id"], payload["source_type"], payload["document_name"], payload["content"])
+                if not prepared.chunks:
+                    self._finish(row["id"], "failed", error="Пустой документ")
+                    continue
+                key = (prepared.source_id, prepared.source_type)
+                cached_chunks = find_cached_chunks(*key)
+                if cached_chunks is not None or key in seen:
+                    self._finish(row["id"], "done", {
+                        "source_id": prepared.source_id,
+                        "chunks": cached_chunks if cached_chunks is not None else len(prepared.chunks),
+                        "structured_data": prepared.structured,
+                        "cached": True,
+                    })
+                    continue
+            except Exception as e:
+                self._retry_or_fail(row, e)
+                continue
+            seen.add(key)
+            documents.extend(prepared.chunks)
+            metadatas.extend(prepared.metadatas)
+            ids.extend(prepared.ids)
+            added.append((row, prepared))
+
+        if not added:
+            return
+        try:
+            # Один батч в Chroma на всю пачку задач
+            add_documents(documents, metadatas, ids)
+        except Exception as e:
+            for row, _ in added:
+                self._retry_or_fail(row, e)
+            return
+        for row, prepared in added:
+            if prepared.structured.get("skills"):
+                skill_index.add(prepared.source_id, prepared.structured["skills"])
+            self._finish(row["id"], "done", {
+                "source_id": prepared.source_id,
+                "chunks": len(prepared.chunks),
+                "structured_data": prepared.structured,
+                "cached": False,
+            })
+
+    def _retry_or_fail(self, row: sqlite3.Row, error: Exception):
+        attempts = row["attempts"] + 1
+        if attempts < _MAX_ATTEMPTS:
+            self._finish(row["id"], "queued", error=str(error))
+        else:
+            self._finish(row["id"], "failed", error=str(error))
+
+
+ingest_queue = IngestQueue()
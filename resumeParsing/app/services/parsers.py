@@ -36,6 +36,12 @@ def extract_text_from_docx_bytes(data: bytes) -> str:
     return "\n".join(paragraphs)
 
 
+def extract_text_from_path(filename: str, path: str) -> Optional[str]:
+    """Для пула процессов: файл читается в дочернем процессе, байты не гоняются через pickle."""
+    with open(path, "rb") as f:
+        return extract_text(filename, f.read())
+
+
 def extract_text(filename: str, data: bytes) -> Optional[str]:
     name = filename.lower()
     if name.endswith(".txt"):
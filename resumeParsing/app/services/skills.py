@@ -0,0 +1,117 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+
+# Каноничный навык -> варианты написания (в нижнем регистре)
+SKILL_ALIASES: Dict[str, List[str]] = {
+    "Python": ["python", "питон"],
+    "Java": ["java", "джава"],
+    "Kotlin": ["kotlin", "котлин"],
+    "Go": ["golang", "go"],
+    "JavaScript": ["javascript", "js"],
+    "TypeScript": ["typescript"],
+    "C++": ["c++", "cpp"],
+    "C#": ["c#", "csharp"],
+    "PHP": ["php"],
+    "SQL": ["sql"],
+    "PostgreSQL": ["postgresql", "postgres", "постгрес", "постгрескл", "постгре"],
+    "MySQL": ["mysql"],
+    "Oracle": ["oracle", "оракл"],
+    "MongoDB": ["mongodb", "mongo"],
+    "Redis": ["redis"],
+    "ClickHouse": ["clickhouse", "кликхаус"],
+    "Kafka": ["kafka", "кафка"],
+    "RabbitMQ": ["rabbitmq", "rabbit"],
+    "Docker": ["docker", "докер"],
+    "Kubernetes": ["kubernetes", "k8s", "кубернетес"],
+    "Linux": ["linux", "линукс"],
+    "Git": ["git"],
+    "Spring": ["spring boot", "spring"],
+    "Django": ["django"],
+    "FastAPI": ["fastapi"],
+    "React": ["react", "reactjs"],
+    "Vue": ["vue", "vuejs", "vue.js"],
+    "1C": ["1с", "1c"],
+}
+
+SKILL_BY_ALIAS: Dict[str, str] = {
+    alias: canonical for canonical, aliases in SKILL_ALIASES.items() for alias in aliases
+}
+for _canonical in SKILL_ALIASES:
+    SKILL_BY_ALIAS.setdefault(_canonical.lower(), _canonical)
+
+
+def normalize_skill(name: str) -> Optional[str]:
+    """'postgres' / 'PostgreSQL' / 'постгрес' -> 'PostgreSQL'; неизвестный навык -> None."""
+    if not name:
+        return None
+    return SKILL_BY_ALIAS.get(name.strip().lower())
+
+
+class SkillIndex:
+    """
+    Точный фасет по навыкам: posting list "навык -> source_id".
+    Фильтры skills_all / skills_any считаются пересечением/объединением
+    множеств до векторного поиска. Индекс строится лениво из метаданных
+    Chroma (поле structured_data.skills) и дополняется при добавлении документов.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            # Импорт здесь, чтобы не тянуть Chroma при импорте extractors
+            from app.services.vectorstore import get_collection
+
+            res = get_collection().get(include=["metadatas"])
+            for meta in res.get("metadatas") or []:
+                if not meta:
+                    continue
+                source_id = meta.get("source_id")
+                skills = meta.get("structured_data.skills")
+                if source_id and skills:
+                    self._add(str(source_id), str(skills).split(","))
+            self._loaded = True
+
+    def _add(self, source_id: str, skills: Iterable[str]):
+        for skill in skills:
+            canonical = normalize_skill(skill)
+            if canonical:
+                self._postings.setdefault(canonical, set()).add(source_id)
+
+    def add(self, source_id: str, skills: Iterable[str]):
+        self._ensure_loaded()
+        with self._lock:
+            self._add(source_id, skills)
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._loaded = False
+
+    def match(self, skills_all: Iterable[str] = (), skills_any: Iterable[str] = ()) -> Set[str]:
+        self._ensure_loaded()
+        result: Optional[Set[str]] = None
+        # Пересекаем от меньшего posting list к большему
+        postings = sorted((self._postings.get(normalize_skill(s) or "", set()) for s in skills_all), key=len)
+        for posting in postings:
+            result = set(posting) if result is None else result & posting
+            if not result:
+                return set()
+        any_names = list(skills_any)
+        if any_names:
+            union: Set[str] = set()
+            for skill in any_names:
+                union |= self._postings.get(normalize_skill(skill) or "", set())
+            result = union if result is None else result & union
+        return result or set()
+
+
+skill_index = SkillIndex()
@@ -42,6 +42,27 @@ def add_documents(documents: List[str], metadatas: List[Dict[str, Any]], ids: Li
     collection.add(documents=documents, metadatas=metadatas, ids=ids)
 
 
+def embed_documents(documents: List[str]) -> Optional[List[List[float]]]:
+    """Считает эмбеддинги функцией коллекции (для батчевой записи через add_embedded_documents)."""
+    embedding_fn = getattr(get_collection(), "_embedding_function", None)
+    if embedding_fn is None:
+        return None
+    return [list(map(float, e)) for e in embedding_fn(documents)]
+
+
+def add_embedded_documents(documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str], embeddings: Optional[List[List[float]]]):
+    collection = get_collection()
+    if embeddings is None:
+        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+    else:
+        collection.add(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+
+
+def delete_by_source(source_id: str):
+    collection = get_collection()
+    collection.delete(where={"source_id": source_id})
+
+
 def get_by_where(where: Dict[str, Any], limit: Optional[int] = None, include: Optional[List[str]] = None):
     collection = get_collection()
     kwargs: Dict[str, Any] = {"where": where}
@@ -1,5 +1,18 @@
-from typing import List
+import re
+from typing import List, Tuple
 
+from app.utils.tokens import count_tokens, split_by_token_windows
+
+
+_DEFAULT_HEADERS = [
+    "\nОпыт работы",
+    "\nОбразование",
+    "\nНавыки",
+    "\nДополнительная информация",
+]
+
+# Граница предложения: после . ! ? … идёт пробельный символ
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+")
 
 def _split_by_headers(text: str, headers: List[str]) -> List[str]:
     if not text:
@@ -58,12 +71,7 @@ def chunk_structured_document(
     if not text:
         return []
 
-    headers = priority_headers or [
-        "\nОпыт работы",
-        "\nОбразование",
-        "\nНавыки",
-        "\nДополнительная информация",
-    ]
+    headers = priority_headers or _DEFAULT_HEADERS
 
     sections = _split_by_headers(text, headers)
     final_chunks: List[str] = []
@@ -103,6 +111,93 @@ def chunk_structured_document(
     return really_final
 
 
+def _split_units(text: str) -> List[Tuple[str, bool]]:
+    """Делит текст на предложения; флаг — начинается ли с юнита новый абзац."""
+    units: List[Tuple[str, bool]] = []
+    for para in _split_by_paragraphs(text):
+        first = True
+        for line in para.split("\n"):
+            for sentence in _SENTENCE_SPLIT_RE.split(line.strip()):
+                if sentence.strip():
+                    units.append((sentence.strip(), first))
+                    first = False
+    return units
+
+
+def _join_units(units: List[Tuple[str, bool]]) -> str:
+    parts: List[str] = []
+    for i, (unit, para_start) in enumerate(units):
+        if i:
+            parts.append("\n\n" if para_start else " ")
+        parts.append(unit)
+    return "".join(parts)
+
+
+def chunk_by_tokens(text: str, max_tokens: int, overlap_tokens: int) -> List[str]:
+    """
+    Упаковывает предложения в чанки до max_tokens токенов модели эмбеддингов.
+    Границы чанков идут по предложениям/абзацам; перекрытие — хвостовые
+    предложения предыдущего чанка суммарно не длиннее overlap_tokens.
+    Предложение длиннее бюджета режется окнами по токенам.
+    """
+    if not text or not text.strip():
+        return []
+    units = _split_units(text)
+    counts = count_tokens([u for u, _ in units])
+
+    chunks: List[str] = []
+    current: List[Tuple[str, bool]] = []
+    current_counts: List[int] = []
+
+    def flush():
+        if current:
+            chunks.append(_join_units(current))
+
+    for unit, n_tokens in zip(units, counts):
+        if n_tokens > max_tokens:
+            flush()
+            current, current_counts = [], []
+            chunks.extend(split_by_token_windows(unit[0], max_tokens, overlap_tokens))
+            continue
+        if current and sum(current_counts) + n_tokens > max_tokens:
+            flush()
+            # Хвост предыдущего чанка становится перекрытием
+            tail: List[Tuple[str, bool]] = []
+            tail_counts: List[int] = []
+            for prev, prev_n in zip(reversed(current), reversed(current_counts)):
+                if sum(tail_counts) + prev_n > overlap_tokens:
+                    break
+                tail.insert(0, prev)
+                tail_counts.insert(0, prev_n)
+            while tail and sum(tail_counts) + n_tokens > max_tokens:
+                tail.pop(0)
+                tail_counts.pop(0)
+            current, current_counts = tail, tail_counts
+        current.append(unit)
+        current_counts.append(n_tokens)
+    flush()
+    return chunks
+
+
+def chunk_structured_document_by_tokens(
+    text: str,
+    max_tokens: int,
+    overlap_tokens: int,
+    priority_headers: List[str] | None = None,
+) -> List[str]:
+    """
+    Токенный вариант chunk_structured_document: секции по заголовкам,
+    внутри секции — упаковка предложений в бюджет модели эмбеддингов.
+    """
+    if not text:
+        return []
+    sections = _split_by_headers(text, priority_headers or _DEFAULT_HEADERS)
+    final_chunks: List[str] = []
+    for sec in sections:
+        final_chunks.extend(chunk_by_tokens(sec, max_tokens, overlap_tokens))
+    return final_chunks
+
+
 def chunk_dialogue(
     text: str,
     utterances_per_chunk: int = 4,
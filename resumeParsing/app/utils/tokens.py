@@ -0,0 +1,67 @@
+import json
+from functools import lru_cache
+from typing import List
+
+from app.config import EMBED_MODEL, CHUNK_MAX_TOKENS
+
+
+# [CLS] и [SEP], которые модель добавляет к каждому чанку при эмбеддинге
+_SPECIAL_TOKENS = 2
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    # Быстрый (Rust) токенизатор той же модели, что считает эмбеддинги
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(EMBED_MODEL, use_fast=True)
+
+
+@lru_cache(maxsize=1)
+def get_max_seq_length() -> int:
+    if CHUNK_MAX_TOKENS > 0:
+        return CHUNK_MAX_TOKENS
+    # sentence-transformers хранит реальный лимит модели в sentence_bert_config.json
+    # (для MiniLM это 128, хотя токенизатор заявляет 512)
+    try:
+        from huggingface_hub import hf_hub_download
+
+        path = hf_hub_download(EMBED_MODEL, "sentence_bert_config.json")
+        with open(path, encoding="utf-8") as f:
+            value = int(json.load(f).get("max_seq_length") or 0)
+        if value > 0:
+            return value
+    except Exception:
+        pass
+    limit = getattr(get_tokenizer(), "model_max_length", 512) or 512
+    return min(int(limit), 512)
+
+
+def token_budget() -> int:
+    """Сколько токенов текста помещается в один чанк без обрезки моделью."""
+    return max(1, get_max_seq_length() - _SPECIAL_TOKENS)
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    if not texts:
+        return []
+    encoded = get_tokenizer()(texts, add_special_tokens=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def split_by_token_windows(text: str, max_tokens: int, overlap_tokens: int) -> List[str]:
+    """Режет текст окнами по токенам, сохраняя исходные символы через offset mapping."""
+    encoded = get_tokenizer()(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoded["offset_mapping"]
+    if not offsets:
+        return [text] if text.strip() else []
+    step = max(1, max_tokens - max(0, overlap_tokens))
+    pieces: List[str] = []
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + max_tokens]
+        piece = text[window[0][0]:window[-1][1]]
+        if piece.strip():
+            pieces.append(piece)
+        if start + max_tokens >= len(offsets):
+            break
+    return pieces
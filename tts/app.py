@@ -1,19 +1,67 @@
 import os
-import mimetypes
-import struct
-from typing import Optional
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, Optional
 
-from fastapi import FastAPI, HTTPException
+import anyio
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from google import genai
-from google.genai import types
-from google.genai import errors
-from speechkit import model_repository, configure_credentials, creds
 
+from audio import (FORMATS, SAMPLE_RATES, EncoderError, encode, encode_stream, ffmpeg_available,
+                   needs_encoder, negotiate_format)
+from cache import audio_cache, cached_stream, warm_up
+from jobs import TTS_BATCH_CONCURRENCY, TTS_BATCH_MAX_TEXTS, batch_jobs
+from pipeline import pipelined_stream, split_sentences
+from providers import PROVIDERS, ProviderError, TTSProvider, Voice, get_provider, start_providers
+from routing import DEFAULT_VOICES, TTS_FIRST_BYTE_TIMEOUT_MS, TTS_HEDGE_MS, router
+from scheduler import scheduler
 
-app = FastAPI(title="VTB TTS Service", version="1.0.0")
+# Потоки, в которых запросы ждут аудио от планировщика (очередь, апстрим, чтение чанков).
+# Отдельно от общего пула FastAPI: запросы в очереди не занимают потоки остальных эндпоинтов
+TTS_WAIT_THREADS = int(os.getenv("TTS_WAIT_THREADS", "256"))
+
+_wait_limiter: Optional[anyio.CapacityLimiter] = None
+_DONE = object()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Клиенты апстримов создаются один раз при старте и переиспользуются между запросами
+    start_providers()
+    yield
+
+
+def wait_limiter() -> anyio.CapacityLimiter:
+    # Создаётся в event loop при первом обращении
+    global _wait_limiter
+    if _wait_limiter is None:
+        _wait_limiter = anyio.CapacityLimiter(TTS_WAIT_THREADS)
+    return _wait_limiter
+
+
+async def wait_synthesis(func, *args):
+    """Блокирующее ожидание синтеза (итерация чанков, выбор провайдера) в потоках TTS_WAIT_THREADS."""
+    return await anyio.to_thread.run_sync(func, *args, limiter=wait_limiter())
+
+
+async def iterate_synthesis(iterator: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """Синхронный генератор ответа как асинхронный: каждый next — в потоках ожидания синтеза."""
+    try:
+        while True:
+            data = await wait_synthesis(next, iterator, _DONE)
+            if data is _DONE:
+                return
+            yield data
+    finally:
+        # Клиент ушёл — закрываем генератор (он закроет кодировщик и отпишется от планировщика)
+        with anyio.CancelScope(shield=True):
+            await wait_synthesis(iterator.close)
+
+
+app = FastAPI(title="VTB TTS Service", version="1.0.0", lifespan=lifespan)
 
 # CORS (dev): разрешаем запросы с фронтенда
 app.add_middleware(
@@ -25,196 +73,333 @@ app.add_middleware(
 )
 
 
-class SynthesizeRequest(BaseModel):
+class AudioOutput(BaseModel):
+    # Формат ответа: wav | mp3 | ogg (Opus) | webm (Opus); по умолчанию — по заголовку Accept, иначе WAV
+    format: str | None = None
+    # Частота дискретизации ответа; по умолчанию — как у провайдера
+    sample_rate: int | None = None
+
+
+class SynthesizeRequest(AudioOutput):
     text: str
     voice_name: str = "Zephyr"
     temperature: float = 1.0
+    # Отдавать аудио по мере генерации вместо буфера целиком
+    stream: bool = False
+    # Синтез по предложениям с опережением; ответ всегда потоковый
+    pipeline: bool = False
 
 
 @app.get("/health")
-def health() -> dict[str, str]:
+async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/synthesize")
-def synthesize(payload: SynthesizeRequest) -> Response:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="GEMINI_API_KEY is not set")
-
-    client = genai.Client(api_key=api_key)
-
-    contents = [
-        types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=payload.text)],
-        )
-    ]
-
-    generate_content_config = types.GenerateContentConfig(
-        temperature=payload.temperature,
-        response_modalities=["audio"],
-        speech_config=types.SpeechConfig(
-            voice_config=types.VoiceConfig(
-                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=payload.voice_name)
-            )
-        ),
-    )
+@app.get("/providers")
+async def providers() -> dict:
+    """Состояние пулов клиентов: готовность, ошибки, время ожидания/создания клиента и синтеза."""
+    return {name: provider.health() for name, provider in PROVIDERS.items()}
 
-    collected_bytes = bytearray()
-    detected_mime: Optional[str] = None
 
+@app.get("/scheduler")
+async def scheduler_metrics() -> dict:
+    """Очереди к апстримам: глубина, допущено/отклонено/склеено, ожидание в очереди и время апстрима."""
+    return scheduler.metrics()
+
+
+def http_error(e: ProviderError) -> HTTPException:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+
+def output_format(payload: "AudioOutput", accept: Optional[str]) -> str:
     try:
-        for chunk in client.models.generate_content_stream(
-            model="gemini-2.5-flash-preview-tts",
-            contents=contents,
-            config=generate_content_config,
-        ):
-            print('=== CHUNK ===', chunk)
-            if (
-                not chunk.candidates
-                or not chunk.candidates[0].content
-                or not chunk.candidates[0].content.parts
-            ):
-                continue
-
-            part = chunk.candidates[0].content.parts[0]
-            if getattr(part, "inline_data", None) and part.inline_data.data:
-                if detected_mime is None:
-                    detected_mime = part.inline_data.mime_type
-                collected_bytes.extend(part.inline_data.data)
-    except errors.ClientError as e:
-        status = getattr(e, "status_code", None)
-        message = str(e)
-        if status == 429 or "RESOURCE_EXHAUSTED" in message or "quota" in message.lower():
-            # Quota/rate limit exceeded — return 429 with Retry-After
-            raise HTTPException(status_code=429, detail="Gemini quota exceeded. Try later.", headers={"Retry-After": "16"})
-        elif status == 401:
-            raise HTTPException(status_code=502, detail="GEMINI_API_KEY invalid or unauthorized")
-        else:
-            raise HTTPException(status_code=502, detail=f"Gemini client error: {message}")
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Upstream error: {e}")
-
-    if not collected_bytes:
+        fmt = negotiate_format(payload.format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    if payload.sample_rate is not None and payload.sample_rate not in SAMPLE_RATES:
+        raise HTTPException(status_code=422, detail=f"Unsupported sample_rate. Supported: {list(SAMPLE_RATES)}")
+    return fmt
+
+
+def check_encoder(fmt: str, sample_rate: int, output_rate: Optional[int]):
+    if needs_encoder(fmt, sample_rate, output_rate) and not ffmpeg_available():
+        raise HTTPException(status_code=501, detail="ffmpeg is not installed: only WAV at the provider sample rate is available")
+
+
+async def synthesize_with(provider: TTSProvider, text: str, voice: Voice, stream: bool, pipeline: bool,
+                          fmt: str = "wav", output_rate: Optional[int] = None) -> Response:
+    """
+    Общий путь эндпоинтов: pipeline — синтез по предложениям с опережением,
+    stream — потоковый ответ; иначе собираем аудио целиком и отдаём с точным размером.
+    Аудио берётся из кэша, если такой текст этим голосом уже синтезировался.
+    Ожидание аудио идёт в потоках TTS_WAIT_THREADS, event loop и общий пул не занимает.
+    """
+    check_encoder(fmt, provider.sample_rate, output_rate)
+    if pipeline:
+        chunks = pipelined_stream(provider, text, voice)
+    else:
+        chunks = cached_stream(provider, text, voice)
+    if stream or pipeline:
+        return await stream_synthesis(chunks, provider.sample_rate, fmt=fmt, output_rate=output_rate)
+
+    try:
+        pcm = await wait_synthesis(b"".join, chunks)
+    except ProviderError as e:
+        raise http_error(e)
+    return await buffered_response(pcm, provider.sample_rate, fmt, output_rate)
+
+
+async def buffered_response(pcm: bytes, sample_rate: int, fmt: str, output_rate: Optional[int],
+                            headers: Optional[dict] = None) -> Response:
+    if not pcm:
         raise HTTPException(status_code=502, detail="No audio data returned by model")
+    try:
+        body = await run_in_threadpool(encode, pcm, sample_rate, fmt, output_rate)
+    except EncoderError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return Response(content=body, media_type=FORMATS[fmt], headers=headers)
 
-    # Normalize to WAV if needed
-    audio_bytes = bytes(collected_bytes)
-    if not detected_mime:
-        detected_mime = "audio/wav"
 
-    if mimetypes.guess_extension(detected_mime) != ".wav":
-        audio_bytes = convert_to_wav(audio_bytes, detected_mime)
-        detected_mime = "audio/wav"
+@app.post("/synthesize")
+async def synthesize(payload: SynthesizeRequest, accept: Optional[str] = Header(default=None)) -> Response:
+    fmt = output_format(payload, accept)
+    voice = Voice(voice=payload.voice_name, temperature=payload.temperature)
+    return await synthesize_with(get_provider("gemini"), payload.text, voice, payload.stream, payload.pipeline,
+                                 fmt, payload.sample_rate)
+
+
+async def stream_synthesis(chunks: Iterator[bytes], sample_rate: int, headers: Optional[dict] = None,
+                           fmt: str = "wav", output_rate: Optional[int] = None) -> StreamingResponse:
+    """
+    Потоковый ответ: ждём первый чанк (ошибки апстрима до него ещё можно вернуть статусом),
+    дальше кодируем PCM по мере прихода (WAV — заголовок с размером 0xFFFFFFFF и PCM как есть,
+    сжатые форматы — через ffmpeg). Время до первого чанка и полное время — в Server-Timing и в логе.
+    """
+    started = time.perf_counter()
+    try:
+        first = await wait_synthesis(next, chunks, None)
+    except ProviderError as e:
+        raise http_error(e)
+    if first is None:
+        raise HTTPException(status_code=502, detail="No audio data returned by model")
+    first_chunk_ms = (time.perf_counter() - started) * 1000
+    pcm_size = len(first)
 
-    return Response(content=audio_bytes, media_type=detected_mime)
+    def source() -> Iterator[bytes]:
+        nonlocal pcm_size
+        yield first
+        try:
+            for data in chunks:
+                pcm_size += len(data)
+                yield data
+        finally:
+            chunks.close()
+
+    # Синхронный генератор: ждёт чанки планировщика, поэтому крутится в потоках ожидания синтеза
+    def body() -> Iterator[bytes]:
+        size = 0
+        encoded = encode_stream(source(), sample_rate, fmt, output_rate)
+        try:
+            for data in encoded:
+                size += len(data)
+                yield data
+        except Exception as e:
+            # Заголовки уже отправлены — обрываем поток, клиент получит укороченное аудио
+            print(f"TTS stream aborted after {size} bytes: {e}")
+        finally:
+            encoded.close()
+        total_ms = (time.perf_counter() - started) * 1000
+        print(f"TTS stream: first chunk {first_chunk_ms:.0f} ms, total {total_ms:.0f} ms, "
+              f"{pcm_size} PCM bytes -> {size} bytes {fmt}")
+
+    return StreamingResponse(
+        iterate_synthesis(body()),
+        media_type=FORMATS[fmt],
+        headers={"Server-Timing": f"upstream-first-chunk;dur={first_chunk_ms:.1f}", **(headers or {})},
+    )
 
 
-class YaSynthesizeRequest(BaseModel):
+class YaSynthesizeRequest(AudioOutput):
     text: str
     voice: str | None = 'jane'
     role: str | None = ''
+    stream: bool = False
+    pipeline: bool = False
 
 
 @app.post("/synthesize-ya")
-def synthesize_ya(payload: YaSynthesizeRequest) -> Response:
-    api_key = os.getenv("YANDEX_API_KEY")
-    if not api_key:
-        # Fallback to IAM token for backward compatibility
-        iam_token = os.getenv("YANDEX_IAM_TOKEN") or os.getenv("IAM_TOKEN")
-        if not iam_token:
-            raise HTTPException(status_code=500, detail="YANDEX_API_KEY or YANDEX_IAM_TOKEN is not set")
-        
-        try:
-            # Configure SpeechKit SDK with IAM token
-            configure_credentials(
-                yandex_credentials=creds.YandexCredentials(
-                    iam_token=iam_token
-                )
-            )
-        except Exception as e:
-            raise HTTPException(status_code=502, detail=f"SpeechKit IAM token configuration error: {e}")
-    else:
-        try:
-            # Configure SpeechKit SDK with API key
-            configure_credentials(
-                yandex_credentials=creds.YandexCredentials(
-                    api_key=api_key
-                )
-            )
-        except Exception as e:
-            raise HTTPException(status_code=502, detail=f"SpeechKit API key configuration error: {e}")
+async def synthesize_ya(payload: YaSynthesizeRequest, accept: Optional[str] = Header(default=None)) -> Response:
+    fmt = output_format(payload, accept)
+    voice = Voice(voice=payload.voice or "", role=payload.role or "")
+    return await synthesize_with(get_provider("speechkit"), payload.text, voice, payload.stream, payload.pipeline,
+                                 fmt, payload.sample_rate)
+
+
+class WarmupRequest(BaseModel):
+    phrases: list[str]
+    provider: str = "gemini"
+    voice: str = "Zephyr"
+    role: str = ""
+    temperature: float = 1.0
+    # Прогреть и отдельные предложения — их берёт синтез с "pipeline": true
+    pipeline: bool = False
+
 
+@app.post("/cache/warmup")
+async def cache_warmup(payload: WarmupRequest) -> dict:
     try:
-        model = model_repository.synthesis_model()
-        if payload.voice:
-            model.voice = payload.voice
-        if payload.role:
-            model.role = payload.role
-
-        result = model.synthesize(payload.text, raw_format=False)
-        # Export to bytes in WAV
-        wav_bytes = result.export_bytes('wav') if hasattr(result, 'export_bytes') else None
-        if wav_bytes is None:
-            # Fallback: export to temp file then read
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=True) as tmp:
-                result.export(tmp.name, 'wav')
-                tmp.seek(0)
-                wav_bytes = tmp.read()
-
-        return Response(content=wav_bytes, media_type='audio/wav')
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"SpeechKit error: {e}")
-
-def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
-    parameters = parse_audio_mime_type(mime_type)
-    bits_per_sample = parameters["bits_per_sample"]
-    sample_rate = parameters["rate"]
-    num_channels = 1
-    data_size = len(audio_data)
-    bytes_per_sample = bits_per_sample // 8
-    block_align = num_channels * bytes_per_sample
-    byte_rate = sample_rate * block_align
-    chunk_size = 36 + data_size
-
-    header = struct.pack(
-        "<4sI4s4sIHHIIHH4sI",
-        b"RIFF",
-        chunk_size,
-        b"WAVE",
-        b"fmt ",
-        16,
-        1,
-        num_channels,
-        sample_rate,
-        byte_rate,
-        block_align,
-        bits_per_sample,
-        b"data",
-        data_size,
-    )
-    return header + audio_data
-
-
-def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
-    bits_per_sample = 16
-    rate = 24000
-    parts = mime_type.split(";")
-    for param in parts:
-        param = param.strip()
-        if param.lower().startswith("rate="):
-            try:
-                rate_str = param.split("=", 1)[1]
-                rate = int(rate_str)
-            except (ValueError, IndexError):
-                pass
-        elif param.startswith("audio/L"):
-            try:
-                bits_per_sample = int(param.split("L", 1)[1])
-            except (ValueError, IndexError):
-                pass
-    return {"bits_per_sample": bits_per_sample, "rate": rate}
+        provider = get_provider(payload.provider)
+    except ProviderError as e:
+        raise http_error(e)
+    texts = list(payload.phrases)
+    if payload.pipeline:
+        texts += [segment for phrase in payload.phrases for segment in split_sentences(phrase)]
+    voice = Voice(voice=payload.voice, role=payload.role, temperature=payload.temperature)
+    return await wait_synthesis(warm_up, provider, texts, voice)
+
 
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    return audio_cache.stats()
 
+
+class SynthesizeV2Request(AudioOutput):
+    text: str
+    # Провайдеры в порядке перебора; по умолчанию TTS_ROUTE_ORDER с учётом политики маршрутизации
+    providers: list[str] | None = None
+    # Голос на провайдера, например {"gemini": "Zephyr", "speechkit": "jane"}
+    voices: dict[str, str] = {}
+    role: str = ""
+    temperature: float = 1.0
+    stream: bool = False
+    hedge_ms: float = TTS_HEDGE_MS
+    timeout_ms: float = TTS_FIRST_BYTE_TIMEOUT_MS
+
+
+@app.post("/v2/synthesize")
+async def synthesize_v2(payload: SynthesizeV2Request, accept: Optional[str] = Header(default=None)) -> Response:
+    """
+    Синтез с выбором провайдера: переход к следующему при ошибке или без первого чанка
+    за timeout_ms, хеджирование вторым провайдером после hedge_ms. Кто ответил и какие
+    были попытки — в заголовках X-TTS-Provider и X-TTS-Attempts.
+    """
+    fmt = output_format(payload, accept)
+    try:
+        providers = [get_provider(name) for name in payload.providers] if payload.providers else None
+        voices = {
+            name: Voice(voice=voice, role=payload.role, temperature=payload.temperature)
+            for name, voice in payload.voices.items()
+        }
+        for name in [p.name for p in providers or []] + router.order:
+            voices.setdefault(name, Voice(voice=DEFAULT_VOICES.get(name, ""), role=payload.role,
+                                          temperature=payload.temperature))
+        result = await wait_synthesis(router.stream, payload.text, voices, providers,
+                                      payload.hedge_ms, payload.timeout_ms)
+    except ProviderError as e:
+        raise http_error(e)
+
+    headers = {
+        "X-TTS-Provider": result.provider.name,
+        "X-TTS-Attempts": ",".join(result.attempts),
+        "X-Cache": "HIT" if result.cached else "MISS",
+    }
+    sample_rate = result.provider.sample_rate
+    try:
+        check_encoder(fmt, sample_rate, payload.sample_rate)
+    except HTTPException:
+        result.chunks.close()
+        raise
+    if payload.stream:
+        return await stream_synthesis(result.chunks, sample_rate, headers, fmt, payload.sample_rate)
+    try:
+        pcm = await wait_synthesis(b"".join, result.chunks)
+    except ProviderError as e:
+        raise http_error(e)
+    return await buffered_response(pcm, sample_rate, fmt, payload.sample_rate, headers)
+
+
+@app.get("/v2/routing")
+async def routing_metrics() -> dict:
+    """Гистограммы времени до первого чанка, доля ошибок и текущий порядок провайдеров."""
+    return router.metrics()
+
+
+class BatchSynthesizeRequest(AudioOutput):
+    texts: list[str]
+    provider: str = "gemini"
+    voice: str = "Zephyr"
+    role: str = ""
+    temperature: float = 1.0
+    # Кроме кэша собрать zip-архив с аудио (format/sample_rate) и manifest.json
+    bundle: bool = False
+    concurrency: int = TTS_BATCH_CONCURRENCY
+
+
+@app.post("/synthesize/batch", status_code=202)
+def synthesize_batch(payload: BatchSynthesizeRequest) -> dict:
+    """
+    Фоновое задание: синтезировать все тексты в кэш (живое интервью потом только проигрывает
+    готовое аудио). Статус — GET /synthesize/batch/{job_id}, архив — .../bundle.
+    """
+    texts = [text for text in payload.texts if text.strip()]
+    if not texts:
+        raise HTTPException(status_code=400, detail="No texts to synthesize")
+    if len(texts) > TTS_BATCH_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"Too many texts (max {TTS_BATCH_MAX_TEXTS})")
+    fmt = output_format(payload, None)
+    try:
+        provider = get_provider(payload.provider)
+    except ProviderError as e:
+        raise http_error(e)
+    if payload.bundle:
+        check_encoder(fmt, provider.sample_rate, payload.sample_rate)
+    voice = Voice(voice=payload.voice, role=payload.role, temperature=payload.temperature)
+    job = batch_jobs.submit(provider, texts, voice, payload.bundle, fmt, payload.sample_rate, payload.concurrency)
+    return {**job.to_dict(items=False), "status_url": f"/synthesize/batch/{job.id}"}
+
+
+@app.get("/synthesize/batch")
+def batch_list() -> list[dict]:
+    return batch_jobs.list()
+
+
+@app.get("/synthesize/batch/{job_id}")
+def batch_status(job_id: str) -> dict:
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+class BundleResponse(FileResponse):
+    """Архив задания: пока ответ отправляется, вытеснение задания его не удаляет."""
+
+    def __init__(self, job, path: str):
+        super().__init__(path, media_type="application/zip", filename=f"tts-{job.id}.zip")
+        self.job = job
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            batch_jobs.release_bundle(self.job)
+
+
+@app.get("/synthesize/batch/{job_id}/bundle")
+def batch_bundle(job_id: str) -> FileResponse:
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    path = batch_jobs.acquire_bundle(job)
+    if path is None:
+        raise HTTPException(status_code=409, detail=f"Bundle is not available (job status: {job.status})")
+    return BundleResponse(job, path)
+
+
+@app.delete("/synthesize/batch/{job_id}")
+def batch_cancel(job_id: str) -> dict:
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict(items=False)
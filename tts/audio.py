@@ -0,0 +1,221 @@
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from typing import Iterator, Optional
+
+# Размер в заголовке потокового WAV: длина заранее неизвестна, браузеры и ffmpeg читают до конца потока
+STREAMING_SIZE = 0xFFFFFFFF
+
+# Сжатые форматы кодирует ffmpeg (нужен в образе); WAV без смены частоты отдаётся без него
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+TTS_MP3_BITRATE = os.getenv("TTS_MP3_BITRATE", "32k")
+TTS_OPUS_BITRATE = os.getenv("TTS_OPUS_BITRATE", "24k")
+
+FORMATS = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",   # Opus в Ogg
+    "webm": "audio/webm",  # Opus в WebM
+}
+# Что клиент может прислать в Accept
+_ACCEPT_TYPES = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav", "audio/vnd.wave": "wav",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+    "audio/ogg": "ogg", "audio/opus": "ogg",
+    "audio/webm": "webm",
+    "audio/*": "wav", "*/*": "wav",
+}
+SAMPLE_RATES = (8000, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+_OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+class EncoderError(Exception):
+    pass
+
+
+def wav_header(sample_rate: int, bits_per_sample: int = 16, num_channels: int = 1, data_size: int | None = None) -> bytes:
+    """Заголовок PCM WAV; data_size=None — потоковый вариант с размерами 0xFFFFFFFF."""
+    bytes_per_sample = bits_per_sample // 8
+    block_align = num_channels * bytes_per_sample
+    byte_rate = sample_rate * block_align
+    if data_size is None:
+        chunk_size = data_size = STREAMING_SIZE
+    else:
+        chunk_size = 36 + data_size
+
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        chunk_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        num_channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        bits_per_sample,
+        b"data",
+        data_size,
+    )
+
+
+def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
+    parameters = parse_audio_mime_type(mime_type)
+    return wav_header(parameters["rate"], parameters["bits_per_sample"], data_size=len(audio_data)) + audio_data
+
+
+def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
+    bits_per_sample = 16
+    rate = 24000
+    parts = mime_type.split(";")
+    for param in parts:
+        param = param.strip()
+        if param.lower().startswith("rate="):
+            try:
+                rate_str = param.split("=", 1)[1]
+                rate = int(rate_str)
+            except (ValueError, IndexError):
+                pass
+        elif param.startswith("audio/L"):
+            try:
+                bits_per_sample = int(param.split("L", 1)[1])
+            except (ValueError, IndexError):
+                pass
+    return {"bits_per_sample": bits_per_sample, "rate": rate}
+
+
+def negotiate_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """
+    Явный format из запроса важнее Accept; без того и другого — WAV. ValueError — только для
+    неподдерживаемого явного format. Accept без поддерживаемых типов (например, application/json
+    от HTTP-клиента по умолчанию) — тоже WAV, как раньше, а не 406.
+    """
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format: {requested}. Supported: {', '.join(FORMATS)}")
+        return requested
+    if not accept:
+        return "wav"
+    ranked = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0 and media_type.lower() in _ACCEPT_TYPES:
+            # При равном q конкретный тип важнее шаблона, затем — порядок в заголовке
+            ranked.append((-q, "*" in media_type, position, _ACCEPT_TYPES[media_type.lower()]))
+    if not ranked:
+        return "wav"
+    return min(ranked)[3]
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def needs_encoder(fmt: str, sample_rate: int, output_rate: Optional[int]) -> bool:
+    return fmt != "wav" or (output_rate or sample_rate) != sample_rate
+
+
+def encode_stream(chunks: Iterator[bytes], sample_rate: int, fmt: str, output_rate: Optional[int] = None) -> Iterator[bytes]:
+    """
+    16-bit mono PCM-чанки -> аудио в формате fmt по мере поступления. Кодирование идёт
+    через ffmpeg на пайпах: поток-писатель подаёт PCM в stdin, здесь читаем закодированное
+    из stdout, так что первые байты уходят клиенту до конца синтеза.
+    """
+    output_rate = output_rate or sample_rate
+    if not needs_encoder(fmt, sample_rate, output_rate):
+        yield wav_header(sample_rate)
+        yield from chunks
+        return
+
+    process = subprocess.Popen(_ffmpeg_args(sample_rate, fmt, output_rate), stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    errors: list[Exception] = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg завершился (ошибка или клиент ушёл) — причина будет в коде возврата
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Генератор закрываем в том же потоке, который его крутит
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    writer = threading.Thread(target=feed, name="tts-encoder-feed", daemon=True)
+    writer.start()
+    completed = False
+    try:
+        if fmt == "wav":
+            yield wav_header(output_rate)
+        while True:
+            data = os.read(process.stdout.fileno(), 65536)
+            if not data:
+                break
+            yield data
+        completed = True
+    finally:
+        if not completed and process.poll() is None:
+            process.kill()
+        stderr = process.stderr.read()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    writer.join()
+    if errors:
+        raise errors[0]
+    if process.returncode != 0:
+        raise EncoderError(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+
+
+def encode(pcm: bytes, sample_rate: int, fmt: str, output_rate: Optional[int] = None) -> bytes:
+    """Буферизованный вариант: всё аудио целиком, у WAV — точный размер в заголовке."""
+    output_rate = output_rate or sample_rate
+    if fmt == "wav":
+        if output_rate != sample_rate:
+            pcm = _run_ffmpeg(pcm, sample_rate, fmt, output_rate)
+        return wav_header(output_rate, data_size=len(pcm)) + pcm
+    return _run_ffmpeg(pcm, sample_rate, fmt, output_rate)
+
+
+def _run_ffmpeg(pcm: bytes, sample_rate: int, fmt: str, output_rate: int) -> bytes:
+    result = subprocess.run(_ffmpeg_args(sample_rate, fmt, output_rate), input=pcm, capture_output=True)
+    if result.returncode != 0:
+        raise EncoderError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def _ffmpeg_args(sample_rate: int, fmt: str, output_rate: int) -> list[str]:
+    # Без пробинга входа: иначе ffmpeg копит секунды PCM, прежде чем начать кодировать
+    args = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-probesize", "32", "-analyzeduration", "0",
+            "-fflags", "nobuffer", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0"]
+    if fmt in ("ogg", "webm"):
+        # Opus кодирует только 8/12/16/24/48 кГц — берём ближайшую не ниже запрошенной
+        output_rate = next((rate for rate in _OPUS_RATES if rate >= output_rate), _OPUS_RATES[-1])
+        args += ["-ar", str(output_rate), "-c:a", "libopus", "-b:a", TTS_OPUS_BITRATE,
+                 "-application", "voip", "-frame_duration", "20"]
+        # Мелкие страницы/кластеры: иначе мультиплексор копит секунду аудио, прежде чем что-то отдать
+        args += ["-f", "ogg", "-page_duration", "100000"] if fmt == "ogg" else ["-f", "webm", "-cluster_time_limit", "100"]
+    elif fmt == "mp3":
+        args += ["-ar", str(output_rate), "-c:a", "libmp3lame", "-b:a", TTS_MP3_BITRATE, "-f", "mp3"]
+    else:
+        args += ["-ar", str(output_rate), "-f", "s16le"]
+    return args + ["-flush_packets", "1", "pipe:1"]
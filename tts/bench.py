@@ -0,0 +1,160 @@
+"""
+Замеры tts-сервиса (сервис должен быть запущен):
+
+    python bench.py ttfb --url http://localhost:8081 --runs 3
+    python bench.py pipeline --concurrency 3        # локально, на FakeProvider
+    python bench.py burst --requests 40 --unique 10 # планировщик: склейка и rate limit, FakeProvider
+    python bench.py routing --hedge-ms 600          # /v2: failover и хеджирование, FakeProvider
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+
+DEFAULT_TEXT = (
+    "Здравствуйте! Спасибо, что нашли время для собеседования. "
+    "Расскажите, пожалуйста, о вашем последнем проекте и о том, какую роль вы в нём играли."
+)
+
+
+def _request(url, payload):
+    """(время до первого байта тела, полное время, размер ответа)."""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as resp:
+        first = resp.read(1)
+        ttfb = time.perf_counter() - started
+        size = len(first) + len(resp.read())
+    return ttfb * 1000, (time.perf_counter() - started) * 1000, size
+
+
+def bench_ttfb(args):
+    url = args.url.rstrip("/") + args.path
+    for stream in (False, True):
+        for i in range(args.runs):
+            payload = {"text": args.text, "stream": stream}
+            ttfb, total, size = _request(url, payload)
+            print(f"stream={stream!s:5}  run {i}  ttfb {ttfb:7.0f} ms  total {total:7.0f} ms  {size / 1024:7.1f} KB")
+
+
+def _consume(chunks):
+    started = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    return first * 1000, (time.perf_counter() - started) * 1000, size
+
+
+def bench_pipeline(args):
+    """Весь текст одним запросом vs по предложениям с опережением (FakeProvider, без сети)."""
+    os.environ["TTS_CACHE_DIR"] = ""  # замер без дискового кэша прошлых запусков
+    from pipeline import pipelined_stream, split_sentences
+    from providers import FakeProvider, Voice
+
+    provider = FakeProvider(first_chunk_ms=args.first_chunk_ms, realtime_factor=args.realtime_factor)
+    voice = Voice(voice="fake")
+    text = " ".join([args.text] * args.repeat)
+    print(f"{len(text)} chars, {len(split_sentences(text))} segments")
+    for name, chunks in (
+        ("whole text", provider.stream(text, voice)),
+        (f"pipeline x{args.concurrency}", pipelined_stream(provider, text, voice, args.concurrency)),
+    ):
+        first, total, size = _consume(chunks)
+        audio_s = size / 2 / provider.sample_rate
+        print(f"{name:14}  first audio {first:7.0f} ms  total {total:7.0f} ms  audio {audio_s:5.1f} s")
+
+
+def bench_burst(args):
+    """Всплеск запросов (с повторами) через планировщик: сколько ушло в апстрим, ожидание в очереди."""
+    os.environ["TTS_CACHE_DIR"] = ""
+    from cache import cached_stream
+    from providers import FakeProvider, Voice
+    from scheduler import scheduler
+
+    provider = FakeProvider("burst", setup_ms=0, rate_per_min=args.rate_per_min, rate_burst=args.burst,
+                            max_concurrency=args.concurrency)
+    voice = Voice(voice="fake")
+    texts = [f"{DEFAULT_TEXT[:60]} {i % args.unique}" for i in range(args.requests)]
+    with ThreadPoolExecutor(max_workers=args.requests) as pool:
+        results = list(pool.map(lambda text: _consume(cached_stream(provider, text, voice)), texts))
+    firsts = sorted(first for first, _, _ in results)
+    lane = scheduler.metrics()["lanes"][provider.quota_key]
+    print(f"{args.requests} requests, {args.unique} unique: upstream {lane['admitted']}, coalesced {lane['coalesced']}")
+    print(f"first audio p50 {firsts[len(firsts) // 2]:.0f} ms  max {firsts[-1]:.0f} ms  "
+          f"queue wait p95 {lane['queue_wait_ms']['live']['p95']:.0f} ms")
+
+
+def bench_routing(args):
+    """Основной провайдер с «хвостом» задержек и ошибками: только failover vs failover + хеджирование."""
+    os.environ["TTS_CACHE_DIR"] = ""
+    import random
+    from providers import FakeProvider
+    from routing import Router
+
+    class Jittery(FakeProvider):
+        def _synthesize(self, client, text, voice):
+            # Каждый tail_rate-й запрос «залипает» — типичный хвост сетевого апстрима
+            self.first_chunk_ms = args.tail_ms if random.random() < args.tail_rate else args.primary_ms
+            return super()._synthesize(client, text, voice)
+
+    primary = Jittery("primary", setup_ms=0, fail_rate=args.fail_rate)
+    backup = FakeProvider("backup", first_chunk_ms=args.backup_ms, setup_ms=0)
+    for hedge_ms in (0, args.hedge_ms):
+        router = Router(order=[], policy="ordered")
+        firsts = []
+        for i in range(args.runs):
+            result = router.stream(f"hedge={hedge_ms} {i}", {}, [primary, backup], hedge_ms=hedge_ms,
+                                   timeout_ms=args.timeout_ms)
+            firsts.append(result.first_chunk_ms)
+            for _ in result.chunks:
+                pass
+        firsts.sort()
+        hedges = router.metrics()["providers"].get("backup", {}).get("hedges", 0)
+        print(f"hedge {hedge_ms:5.0f} ms  first audio p50 {firsts[len(firsts) // 2]:6.0f}  "
+              f"p95 {firsts[int(0.95 * (len(firsts) - 1))]:6.0f}  max {firsts[-1]:6.0f} ms  hedged {hedges}/{args.runs}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    ttfb = sub.add_parser("ttfb", help="время до первого байта: буфер целиком vs потоковый ответ")
+    ttfb.add_argument("--url", default="http://localhost:8081")
+    ttfb.add_argument("--path", default="/synthesize")
+    ttfb.add_argument("--text", default=DEFAULT_TEXT)
+    ttfb.add_argument("--runs", type=int, default=3)
+    ttfb.set_defaults(func=bench_ttfb)
+    pipeline = sub.add_parser("pipeline", help="синтез целиком vs по предложениям (FakeProvider)")
+    pipeline.add_argument("--text", default=DEFAULT_TEXT)
+    pipeline.add_argument("--repeat", type=int, default=2)
+    pipeline.add_argument("--concurrency", type=int, default=3)
+    pipeline.add_argument("--first-chunk-ms", type=float, default=400)
+    pipeline.add_argument("--realtime-factor", type=float, default=0.5)
+    pipeline.set_defaults(func=bench_pipeline)
+    burst = sub.add_parser("burst", help="всплеск запросов через планировщик (FakeProvider)")
+    burst.add_argument("--requests", type=int, default=40)
+    burst.add_argument("--unique", type=int, default=10)
+    burst.add_argument("--rate-per-min", type=float, default=300)
+    burst.add_argument("--burst", type=int, default=3)
+    burst.add_argument("--concurrency", type=int, default=4)
+    burst.set_defaults(func=bench_burst)
+    routing = sub.add_parser("routing", help="failover и хеджирование между провайдерами (FakeProvider)")
+    routing.add_argument("--runs", type=int, default=40)
+    routing.add_argument("--primary-ms", type=float, default=300)
+    routing.add_argument("--tail-ms", type=float, default=3000)
+    routing.add_argument("--tail-rate", type=float, default=0.15)
+    routing.add_argument("--fail-rate", type=float, default=0.05)
+    routing.add_argument("--backup-ms", type=float, default=500)
+    routing.add_argument("--hedge-ms", type=float, default=600)
+    routing.add_argument("--timeout-ms", type=float, default=5000)
+    routing.set_defaults(func=bench_routing)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
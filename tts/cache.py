@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+from audio import wav_header
+from providers import ProviderError, TTSProvider, Voice
+from scheduler import PRIORITY_LIVE, PRIORITY_PREWARM, scheduler
+
+# Уровень в памяти поверх дискового хранилища; оба ограничены по размеру
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "64"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")  # пусто — без диска
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "1024"))
+# Прогрев идёт через те же квоты, что и живые запросы, поэтому параллельность небольшая
+TTS_WARMUP_CONCURRENCY = int(os.getenv("TTS_WARMUP_CONCURRENCY", "2"))
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _SPACES_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(provider: TTSProvider, text: str, voice: Voice) -> str:
+    parts = [provider.name, provider.model, provider.sample_rate, voice.voice, voice.role, voice.temperature,
+             normalize_text(text)]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+
+class AudioCache:
+    """
+    Синтезированный PCM по ключу (провайдер, модель, голос, роль, температура, текст).
+    LRU в памяти (по байтам) поверх каталога WAV-файлов; на диске вытесняются
+    давно не использованные файлы (по mtime, он обновляется при попадании).
+    """
+
+    def __init__(self, memory_mb=TTS_CACHE_MEMORY_MB, directory=TTS_CACHE_DIR, disk_mb=TTS_CACHE_DISK_MB):
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.disk_limit = disk_mb * 1024 * 1024
+        self.directory = directory
+        self._memory: OrderedDict[str, tuple[bytes, int]] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0,
+                       "evictions_memory": 0, "evictions_disk": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key: str) -> Optional[tuple[bytes, int]]:
+        """(pcm, sample_rate) или None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats["hits_memory"] += 1
+                return entry
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits_disk"] += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, pcm: bytes, sample_rate: int):
+        with self._lock:
+            self._remember(key, (pcm, sample_rate))
+            self._stats["stores"] += 1
+        self._write_disk(key, pcm, sample_rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_bytes / 1024 / 1024, 2),
+                "disk_mb": round(self._disk_bytes / 1024 / 1024, 2),
+            })
+        lookups = stats["hits_memory"] + stats["hits_disk"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits_memory"] + stats["hits_disk"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    # --- Внутреннее ---
+
+    def _remember(self, key, entry):
+        if len(entry[0]) > self.memory_limit:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._memory[key] = entry
+        self._memory_bytes += len(entry[0])
+        while self._memory_bytes > self.memory_limit:
+            _, (pcm, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(pcm)
+            self._stats["evictions_memory"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.wav")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".wav"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with wave.open(path, "rb") as wav:
+                entry = wav.readframes(wav.getnframes()), wav.getframerate()
+            os.utime(path)
+        except (OSError, EOFError, wave.Error):
+            return None
+        return entry
+
+    def _write_disk(self, key, pcm, sample_rate):
+        if not self.directory:
+            return
+        path = self._path(key)
+        data = wav_header(sample_rate, data_size=len(pcm)) + pcm
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"TTS cache write failed: {e}")
+            return
+        with self._lock:
+            # Перезапись ключа: старый файл заменён, его размер больше не занят
+            self._disk_bytes += len(data) - replaced
+            over = self._disk_bytes > self.disk_limit
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Удаляем самые давно использованные файлы, пока не уложимся в 90% лимита
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        target = self.disk_limit * 0.9
+        evicted = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._stats["evictions_disk"] += evicted
+
+
+audio_cache = AudioCache()
+
+
+def cached_stream(provider: TTSProvider, text: str, voice: Voice, cache: AudioCache = audio_cache,
+                  priority: int = PRIORITY_LIVE) -> Iterator[bytes]:
+    """
+    Синтез через кэш: попадание — одним чанком без обращения к апстриму, промах — через
+    планировщик (одинаковые запросы в полёте склеиваются), чанки пересылаются по мере
+    прихода, а аудио сохраняется, когда синтез дошёл до конца.
+    """
+    hit = lookup(provider, text, voice, cache)
+    if hit is not None:
+        yield hit
+        return
+    yield from upstream_stream(provider, text, voice, cache, priority)
+
+
+def lookup(provider: TTSProvider, text: str, voice: Voice, cache: AudioCache = audio_cache) -> Optional[bytes]:
+    hit = cache.get(cache_key(provider, text, voice))
+    return hit[0] if hit is not None else None
+
+
+def upstream_stream(provider: TTSProvider, text: str, voice: Voice, cache: AudioCache = audio_cache,
+                    priority: int = PRIORITY_LIVE) -> Iterator[bytes]:
+    """Промах кэша: синтез через планировщик с сохранением результата в кэш."""
+    key = cache_key(provider, text, voice)
+    return scheduler.stream(provider, text, voice, key, priority, _store(cache, key, provider.sample_rate))
+
+
+def _store(cache: AudioCache, key: str, sample_rate: int):
+    return lambda pcm: cache.put(key, pcm, sample_rate)
+
+
+def warm_up(provider: TTSProvider, texts: list[str], voice: Voice, cache: AudioCache = audio_cache,
+            concurrency: int = TTS_WARMUP_CONCURRENCY) -> dict:
+    """Синтезирует в кэш фразы, которых там ещё нет. Возвращает сводку по фразам."""
+    started = time.perf_counter()
+    unique = list(dict.fromkeys(t for t in texts if normalize_text(t)))
+    pending = [t for t in unique if cache.get(cache_key(provider, t, voice)) is None]
+
+    def synthesize(text):
+        try:
+            for _ in upstream_stream(provider, text, voice, cache, PRIORITY_PREWARM):
+                pass
+        except ProviderError as e:
+            return {"text": text, "status_code": e.status_code, "error": e.detail}
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="tts-warmup") as pool:
+        failed = [r for r in pool.map(synthesize, pending) if r is not None]
+    return {
+        "provider": provider.name,
+        "total": len(unique),
+        "already_cached": len(unique) - len(pending),
+        "synthesized": len(pending) - len(failed),
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from audio import EncoderError, encode
+from cache import lookup, upstream_stream
+from providers import ProviderError, TTSProvider, Voice
+from scheduler import PRIORITY_PREWARM
+
+# Пакетный синтез (предзапись вопросов вакансии): фоновые задания со статусом
+TTS_BATCH_CONCURRENCY = int(os.getenv("TTS_BATCH_CONCURRENCY", "4"))
+TTS_BATCH_MAX_TEXTS = int(os.getenv("TTS_BATCH_MAX_TEXTS", "500"))
+TTS_BATCH_DIR = os.getenv("TTS_BATCH_DIR", "tts_jobs")
+# Сколько завершённых заданий (и их архивов) хранить
+TTS_BATCH_KEEP_JOBS = int(os.getenv("TTS_BATCH_KEEP_JOBS", "100"))
+# Повторы текста после 429/503 апстрима или очереди: сколько раз и сколько максимум ждать перед повтором
+TTS_BATCH_RETRIES = int(os.getenv("TTS_BATCH_RETRIES", "3"))
+TTS_BATCH_RETRY_MAX_WAIT_S = float(os.getenv("TTS_BATCH_RETRY_MAX_WAIT_S", "60"))
+
+_RETRY_STATUSES = (429, 503)
+
+_EXTENSIONS = {"wav": "wav", "mp3": "mp3", "ogg": "ogg", "webm": "webm"}
+
+
+class BatchJob:
+    def __init__(self, provider: TTSProvider, texts: list[str], voice: Voice, bundle: bool, fmt: str,
+                 output_rate: Optional[int], concurrency: int):
+        self.id = uuid.uuid4().hex
+        self.provider = provider
+        self.voice = voice
+        self.bundle = bundle
+        self.format = fmt
+        self.output_rate = output_rate
+        self.concurrency = max(1, concurrency)
+        self.status = "queued"  # queued | running | done | failed | cancelled
+        self.cancelled = False
+        self.stop = threading.Event()  # будит тексты, ждущие повтора, при отмене
+        self.downloads = 0  # идущие скачивания архива: пока они есть, архив не удаляется
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bundle_path: Optional[str] = None
+        self.items = [{"index": i, "text": text, "status": "queued"} for i, text in enumerate(texts)]
+        self._lock = threading.Lock()
+
+    def to_dict(self, items: bool = True) -> dict:
+        with self._lock:
+            counts: dict[str, int] = {}
+            for item in self.items:
+                counts[item["status"]] = counts.get(item["status"], 0) + 1
+            result = {
+                "job_id": self.id,
+                "status": self.status,
+                "provider": self.provider.name,
+                "voice": self.voice.voice,
+                "total": len(self.items),
+                "counts": counts,
+                "bundle": bool(self.bundle_path),
+                "created_at": self.created_at,
+                "elapsed_ms": round(((self.finished_at or time.time()) - (self.started_at or time.time())) * 1000, 1),
+            }
+            if items:
+                result["items"] = [dict(item) for item in self.items]
+            return result
+
+    def _update(self, index: int, **fields):
+        with self._lock:
+            self.items[index].update(fields)
+
+
+class BatchJobs:
+    """
+    Задания пакетного синтеза. Каждое задание синтезирует свои тексты с ограниченной
+    параллельностью через планировщик с фоновым приоритетом (живые реплики не ждут,
+    лимиты провайдера соблюдаются). Результат всегда попадает в кэш; с bundle — ещё
+    и zip-архив с аудио и manifest.json.
+    """
+
+    def __init__(self, directory: str = TTS_BATCH_DIR, keep: int = TTS_BATCH_KEEP_JOBS):
+        self.directory = directory
+        self.keep = keep
+        self._jobs: OrderedDict[str, BatchJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, provider: TTSProvider, texts: list[str], voice: Voice, bundle: bool = False, fmt: str = "wav",
+               output_rate: Optional[int] = None, concurrency: int = TTS_BATCH_CONCURRENCY) -> BatchJob:
+        job = BatchJob(provider, texts, voice, bundle, fmt, output_rate, min(concurrency, TTS_BATCH_CONCURRENCY))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        threading.Thread(target=self._run, args=(job,), name=f"tts-batch-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self.get(job_id)
+        if job is not None:
+            # Уже отправленные в апстрим тексты досинтезируются в кэш, новые не начинаются
+            job.cancelled = True
+            job.stop.set()
+        return job
+
+    def acquire_bundle(self, job: BatchJob) -> Optional[str]:
+        """Путь к архиву на время скачивания; release_bundle — когда ответ отправлен или оборван."""
+        with self._lock:
+            if not job.bundle_path or job.id not in self._jobs:
+                return None
+            job.downloads += 1
+            return job.bundle_path
+
+    def release_bundle(self, job: BatchJob):
+        with self._lock:
+            job.downloads -= 1
+            # Задание вытеснили во время скачивания — архив удаляет последнее скачивание
+            evicted = job.downloads == 0 and job.id not in self._jobs
+        if evicted:
+            _remove(job.bundle_path)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict(items=False) for job in jobs]
+
+    # --- Внутреннее ---
+
+    def _run(self, job: BatchJob):
+        job.status = "running"
+        job.started_at = time.time()
+        workdir = os.path.join(self.directory, job.id) if job.bundle else None
+        try:
+            if workdir:
+                os.makedirs(workdir, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=job.concurrency, thread_name_prefix="tts-batch") as pool:
+                list(pool.map(lambda index: self._synthesize(job, index, workdir), range(len(job.items))))
+            if workdir and not job.cancelled:
+                job.bundle_path = self._write_bundle(job, workdir)
+            failed = any(item["status"] == "failed" for item in job.items)
+            job.status = "cancelled" if job.cancelled else "failed" if failed else "done"
+        except Exception as e:
+            print(f"TTS batch job {job.id} failed: {e}")
+            job.status = "failed"
+        finally:
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+            job.finished_at = time.time()
+
+    def _synthesize(self, job: BatchJob, index: int, workdir: Optional[str]):
+        if job.cancelled:
+            job._update(index, status="cancelled")
+            return
+        text = job.items[index]["text"]
+        job._update(index, status="running")
+        started = time.perf_counter()
+        try:
+            pcm = lookup(job.provider, text, job.voice)
+            cached = pcm is not None
+            if pcm is None:
+                pcm = self._upstream(job, index, text)
+                if pcm is None:
+                    job._update(index, status="cancelled")
+                    return
+            if not pcm:
+                raise ProviderError(502, "No audio data returned by model")
+            fields = {
+                "status": "done",
+                "cached": cached,
+                "audio_ms": round(len(pcm) / 2 / job.provider.sample_rate * 1000),
+            }
+            if workdir:
+                name = f"{index + 1:03d}.{_EXTENSIONS[job.format]}"
+                with open(os.path.join(workdir, name), "wb") as f:
+                    f.write(encode(pcm, job.provider.sample_rate, job.format, job.output_rate))
+                fields["file"] = name
+        except ProviderError as e:
+            fields = {"status": "failed", "status_code": e.status_code, "error": e.detail}
+        except (EncoderError, OSError) as e:
+            fields = {"status": "failed", "error": str(e)}
+        fields["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        job._update(index, **fields)
+
+    def _upstream(self, job: BatchJob, index: int, text: str) -> Optional[bytes]:
+        """
+        Синтез через планировщик. 429/503 (лимит апстрима или полная очередь) — повтор через
+        Retry-After, не больше TTS_BATCH_RETRIES раз. None — задание отменили, пока текст ждал повтора.
+        """
+        for attempt in range(TTS_BATCH_RETRIES + 1):
+            try:
+                return b"".join(upstream_stream(job.provider, text, job.voice, priority=PRIORITY_PREWARM))
+            except ProviderError as e:
+                if e.status_code not in _RETRY_STATUSES or attempt == TTS_BATCH_RETRIES:
+                    raise
+                delay = min(e.retry_after or 2 ** attempt, TTS_BATCH_RETRY_MAX_WAIT_S)
+                job._update(index, retries=attempt + 1)
+                if job.stop.wait(delay):
+                    return None
+
+    def _write_bundle(self, job: BatchJob, workdir: str) -> str:
+        path = os.path.join(self.directory, f"{job.id}.zip")
+        manifest = {
+            "job_id": job.id,
+            "provider": job.provider.name,
+            "voice": job.voice.voice,
+            "role": job.voice.role,
+            "format": job.format,
+            "items": [{key: item.get(key) for key in ("index", "text", "file", "audio_ms", "status")} for item in job.items],
+        }
+        tmp = f"{path}.tmp"
+        # Аудио уже сжато (или это PCM, который почти не жмётся) — храним без сжатия
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as bundle:
+            bundle.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+            for item in job.items:
+                if item.get("file"):
+                    bundle.write(os.path.join(workdir, item["file"]), item["file"])
+        os.replace(tmp, path)
+        return path
+
+    def _evict(self):
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
+            # Архив, который сейчас скачивают, удалит release_bundle
+            if job.bundle_path and not job.downloads:
+                _remove(job.bundle_path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+batch_jobs = BatchJobs()
@@ -0,0 +1,83 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from cache import cached_stream
+from scheduler import PRIORITY_PREFETCH
+from providers import TTSProvider, Voice
+
+# Сколько предложений синтезируется одновременно (включая то, что сейчас играет)
+TTS_PIPELINE_CONCURRENCY = int(os.getenv("TTS_PIPELINE_CONCURRENCY", "3"))
+# Короткие предложения склеиваются до этой длины, слишком длинные режутся по запятым
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "40"))
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "300"))
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+_CLAUSE_END_RE = re.compile(r"(?<=[,;:—])\s+")
+
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tts-pipeline")
+
+
+def split_sentences(text: str, min_chars: int = TTS_SEGMENT_MIN_CHARS, max_chars: int = TTS_SEGMENT_MAX_CHARS) -> list[str]:
+    """Текст -> отрезки для синтеза: по предложениям, короткие склеиваются, длинные режутся по запятым."""
+    pieces: list[str] = []
+    for sentence in _SENTENCE_END_RE.split(text.strip()):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        current = ""
+        for clause in _CLAUSE_END_RE.split(sentence):
+            if current and len(current) + len(clause) + 1 > max_chars:
+                pieces.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}".strip()
+        if current:
+            pieces.append(current)
+
+    segments: list[str] = []
+    for piece in (p.strip() for p in pieces):
+        if not piece:
+            continue
+        # Первый отрезок клеим только если он совсем короткий: он определяет время до начала звука
+        limit = min_chars if len(segments) > 1 else min_chars // 2
+        if segments and len(segments[-1]) < limit and len(segments[-1]) + len(piece) < max_chars:
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+    return segments
+
+
+def pipelined_stream(provider: TTSProvider, text: str, voice: Voice,
+                     concurrency: int = TTS_PIPELINE_CONCURRENCY) -> Iterator[bytes]:
+    """
+    PCM всего текста по предложениям, строго по порядку. Первое предложение пересылается
+    по мере генерации, следующие (до concurrency - 1 вперёд) синтезируются параллельно
+    в фоне и отдаются целиком, когда до них доходит очередь. Каждое предложение
+    кэшируется отдельно: повторяющиеся фразы не уходят в апстрим.
+    """
+    segments = split_sentences(text)
+    if not segments:
+        return
+    ahead = max(0, concurrency - 1)
+    futures = {}
+
+    def prefetch(upto: int):
+        for i in range(1, min(upto, len(segments))):
+            if i not in futures:
+                futures[i] = _pool.submit(_synthesize_all, provider, segments[i], voice)
+
+    try:
+        prefetch(1 + ahead)
+        yield from cached_stream(provider, segments[0], voice)
+        for i in range(1, len(segments)):
+            prefetch(i + 1 + ahead)
+            yield futures.pop(i).result()
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def _synthesize_all(provider: TTSProvider, text: str, voice: Voice) -> bytes:
+    return b"".join(cached_stream(provider, text, voice, priority=PRIORITY_PREFETCH))
@@ -0,0 +1,418 @@
+import hashlib
+import math
+import os
+import queue
+import random
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+# Все провайдеры отдают 16-bit mono PCM; частота — у каждого своя (provider.sample_rate)
+GEMINI_TTS_MODEL = os.getenv("GEMINI_TTS_MODEL", "gemini-2.5-flash-preview-tts")
+GEMINI_SAMPLE_RATE = 24000
+SPEECHKIT_SAMPLE_RATE = int(os.getenv("SPEECHKIT_SAMPLE_RATE", "24000"))
+# 1 — вместо настоящих провайдеров локальные заглушки (нагрузочные тесты без квоты)
+TTS_FAKE_PROVIDERS = os.getenv("TTS_FAKE_PROVIDERS", "0") == "1"
+# Пул клиентов на провайдера: он же лимит одновременных запросов к апстриму
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+SPEECHKIT_MAX_CONCURRENCY = int(os.getenv("SPEECHKIT_MAX_CONCURRENCY", "8"))
+TTS_PROVIDER_CONCURRENCY = int(os.getenv("TTS_PROVIDER_CONCURRENCY", "8"))
+# Сколько клиентов создать при старте сервиса; остальные — по мере нагрузки
+TTS_PREWARM_CLIENTS = int(os.getenv("TTS_PREWARM_CLIENTS", "1"))
+# Сколько ждать свободного клиента, прежде чем ответить 503
+TTS_ACQUIRE_TIMEOUT_S = float(os.getenv("TTS_ACQUIRE_TIMEOUT_S", "30"))
+# Token bucket планировщика на провайдера и ключ: запросов в минуту и запас; 0 — без ограничения
+GEMINI_RATE_PER_MIN = float(os.getenv("GEMINI_RATE_PER_MIN", "60"))
+GEMINI_RATE_BURST = int(os.getenv("GEMINI_RATE_BURST", "10"))
+SPEECHKIT_RATE_PER_MIN = float(os.getenv("SPEECHKIT_RATE_PER_MIN", "600"))
+SPEECHKIT_RATE_BURST = int(os.getenv("SPEECHKIT_RATE_BURST", "40"))
+
+_LATENCY_WINDOW = 1000
+
+
+@dataclass(frozen=True)
+class Voice:
+    """Настройки голоса: voice — имя голоса провайдера, role — амплуа (SpeechKit)."""
+    voice: str
+    role: str = ""
+    temperature: float = 1.0
+
+
+class ProviderError(Exception):
+    """Ошибка апстрима с HTTP-статусом, который вернёт сервис."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TTSProvider:
+    """
+    Провайдер владеет пулом долгоживущих клиентов апстрима (SDK-клиент, модель синтеза):
+    клиенты создаются заранее при старте (start) или по мере надобности, но не больше
+    max_concurrency — это же и ограничение параллельных запросов к провайдеру.
+    Подклассы реализуют _create_client и _synthesize.
+    """
+    name = "base"
+    model = ""
+    sample_rate = 24000
+    rate_per_min = 0.0
+    rate_burst = 1
+
+    @property
+    def quota_key(self) -> str:
+        """Ключ квоты апстрима: у провайдеров с API-ключом квота считается на ключ."""
+        return self.name
+
+    def __init__(self, max_concurrency: int = TTS_PROVIDER_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._clients: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._pool_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._counters = {"requests": 0, "errors": 0, "clients_created": 0, "client_errors": 0, "in_flight": 0}
+        self._timings = {name: deque(maxlen=_LATENCY_WINDOW) for name in ("wait_ms", "setup_ms", "first_chunk_ms", "synth_ms")}
+        self._last_error: Optional[str] = None
+
+    def start(self, clients: int = TTS_PREWARM_CLIENTS):
+        """Создаёт клиентов заранее, чтобы первый запрос не платил за инициализацию SDK и TLS."""
+        for _ in range(min(clients, self.max_concurrency)):
+            try:
+                client = self._new_client()
+            except ProviderError as e:
+                print(f"TTS provider {self.name}: startup failed: {e.detail}")
+                return
+            self._clients.put(client)
+
+    def stream(self, text: str, voice: Voice) -> Iterator[bytes]:
+        """PCM-чанки по мере синтеза. Ошибки — ProviderError."""
+        client = self._acquire()
+        started = time.perf_counter()
+        first_chunk_ms = None
+        self._count("in_flight", 1)
+        try:
+            for chunk in self._synthesize(client, text, voice):
+                if first_chunk_ms is None:
+                    first_chunk_ms = _elapsed_ms(started)
+                    self._observe("first_chunk_ms", first_chunk_ms)
+                yield chunk
+            self._observe("synth_ms", _elapsed_ms(started))
+        except ProviderError as e:
+            self._failed(e.detail)
+            raise
+        finally:
+            self._count("in_flight", -1)
+            self._clients.put(client)
+
+    def health(self) -> dict:
+        with self._metrics_lock:
+            timings = {name: _summary(values) for name, values in self._timings.items()}
+            return {
+                "name": self.name,
+                "model": self.model,
+                "sample_rate": self.sample_rate,
+                "ready": self._created > 0,
+                "clients": self._created,
+                "idle_clients": self._clients.qsize(),
+                "max_concurrency": self.max_concurrency,
+                **self._counters,
+                "last_error": self._last_error,
+                "timings_ms": timings,
+            }
+
+    # --- Для подклассов ---
+
+    def _create_client(self):
+        return None
+
+    def _synthesize(self, client, text: str, voice: Voice) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    # --- Внутреннее ---
+
+    def _acquire(self):
+        started = time.perf_counter()
+        self._count("requests", 1)
+        try:
+            client = self._clients.get_nowait()
+        except queue.Empty:
+            client = None
+            with self._pool_lock:
+                create = self._created < self.max_concurrency
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    client = self._new_client(reserved=True)
+                except ProviderError as e:
+                    self._failed(e.detail)
+                    raise
+            else:
+                try:
+                    client = self._clients.get(timeout=TTS_ACQUIRE_TIMEOUT_S)
+                except queue.Empty:
+                    self._failed("all clients busy")
+                    raise ProviderError(503, f"{self.name}: all upstream clients are busy", retry_after=1)
+        self._observe("wait_ms", _elapsed_ms(started))
+        return client
+
+    def _new_client(self, reserved: bool = False):
+        if not reserved:
+            with self._pool_lock:
+                self._created += 1
+        started = time.perf_counter()
+        try:
+            client = self._create_client()
+        except Exception as e:
+            with self._pool_lock:
+                self._created -= 1
+            self._count("client_errors", 1)
+            if isinstance(e, ProviderError):
+                raise
+            raise ProviderError(502, f"{self.name}: client setup error: {e}") from e
+        self._observe("setup_ms", _elapsed_ms(started))
+        self._count("clients_created", 1)
+        return client
+
+    def _count(self, name: str, delta: int):
+        with self._metrics_lock:
+            self._counters[name] += delta
+
+    def _observe(self, name: str, value: float):
+        with self._metrics_lock:
+            self._timings[name].append(value)
+
+    def _failed(self, detail: str):
+        with self._metrics_lock:
+            self._counters["errors"] += 1
+            self._last_error = detail
+
+
+class GeminiProvider(TTSProvider):
+    name = "gemini"
+    model = GEMINI_TTS_MODEL
+    sample_rate = GEMINI_SAMPLE_RATE
+    rate_per_min = GEMINI_RATE_PER_MIN
+    rate_burst = GEMINI_RATE_BURST
+
+    def __init__(self):
+        super().__init__(GEMINI_MAX_CONCURRENCY)
+
+    @property
+    def quota_key(self) -> str:
+        api_key = os.getenv("GEMINI_API_KEY") or ""
+        return f"{self.name}:{hashlib.sha256(api_key.encode()).hexdigest()[:8]}"
+
+    def _create_client(self):
+        from google import genai
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ProviderError(500, "GEMINI_API_KEY is not set")
+        return genai.Client(api_key=api_key)
+
+    def _synthesize(self, client, text: str, voice: Voice) -> Iterator[bytes]:
+        from google.genai import types
+
+        contents = [
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=text)],
+            )
+        ]
+
+        generate_content_config = types.GenerateContentConfig(
+            temperature=voice.temperature,
+            response_modalities=["audio"],
+            speech_config=types.SpeechConfig(
+                voice_config=types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice.voice)
+                )
+            ),
+        )
+
+        try:
+            for chunk in client.models.generate_content_stream(
+                model=self.model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                if (
+                    not chunk.candidates
+                    or not chunk.candidates[0].content
+                    or not chunk.candidates[0].content.parts
+                ):
+                    continue
+
+                part = chunk.candidates[0].content.parts[0]
+                if getattr(part, "inline_data", None) and part.inline_data.data:
+                    yield part.inline_data.data
+        except ProviderError:
+            raise
+        except Exception as e:
+            raise gemini_error(e) from e
+
+
+def gemini_error(e: Exception) -> ProviderError:
+    from google.genai import errors
+
+    if isinstance(e, errors.ClientError):
+        status = getattr(e, "status_code", None)
+        message = str(e)
+        if status == 429 or "RESOURCE_EXHAUSTED" in message or "quota" in message.lower():
+            # Quota/rate limit exceeded — return 429 with Retry-After
+            return ProviderError(429, "Gemini quota exceeded. Try later.", retry_after=16)
+        elif status == 401:
+            return ProviderError(502, "GEMINI_API_KEY invalid or unauthorized")
+        else:
+            return ProviderError(502, f"Gemini client error: {message}")
+    return ProviderError(502, f"Upstream error: {e}")
+
+
+class SpeechKitProvider(TTSProvider):
+    name = "speechkit"
+    model = "speechkit"
+    sample_rate = SPEECHKIT_SAMPLE_RATE
+    rate_per_min = SPEECHKIT_RATE_PER_MIN
+    rate_burst = SPEECHKIT_RATE_BURST
+
+    def __init__(self):
+        super().__init__(SPEECHKIT_MAX_CONCURRENCY)
+        self._configured = False
+        self._configure_lock = threading.Lock()
+
+    def _configure_credentials(self):
+        # Учётные данные SDK глобальные — настраиваем один раз на процесс
+        from speechkit import configure_credentials, creds
+
+        with self._configure_lock:
+            if self._configured:
+                return
+            api_key = os.getenv("YANDEX_API_KEY")
+            try:
+                if api_key:
+                    configure_credentials(yandex_credentials=creds.YandexCredentials(api_key=api_key))
+                else:
+                    # Fallback to IAM token for backward compatibility
+                    iam_token = os.getenv("YANDEX_IAM_TOKEN") or os.getenv("IAM_TOKEN")
+                    if not iam_token:
+                        raise ProviderError(500, "YANDEX_API_KEY or YANDEX_IAM_TOKEN is not set")
+                    configure_credentials(yandex_credentials=creds.YandexCredentials(iam_token=iam_token))
+            except ProviderError:
+                raise
+            except Exception as e:
+                raise ProviderError(502, f"SpeechKit credentials configuration error: {e}") from e
+            self._configured = True
+
+    def _create_client(self):
+        from speechkit import model_repository
+
+        self._configure_credentials()
+        # Модель синтеза хранит голос/роль как состояние, поэтому у каждого запроса своя из пула;
+        # значения по умолчанию запоминаем, чтобы настройки прошлого запроса не протекали
+        model = model_repository.synthesis_model()
+        return model, model.voice, model.role
+
+    def _synthesize(self, client, text: str, voice: Voice) -> Iterator[bytes]:
+        model, default_voice, default_role = client
+        try:
+            model.voice = voice.voice or default_voice
+            model.role = voice.role or default_role
+            # raw_format=False -> pydub.AudioSegment; приводим к общему PCM-формату
+            result = model.synthesize(text, raw_format=False)
+            result = result.set_frame_rate(self.sample_rate).set_channels(1).set_sample_width(2)
+        except Exception as e:
+            raise ProviderError(502, f"SpeechKit error: {e}") from e
+        yield result.raw_data
+
+
+class FakeProvider(TTSProvider):
+    """
+    Локальная заглушка: тон вместо речи, задержка первого чанка и скорость генерации
+    как у сетевого провайдера. Длительность аудио — ms_per_char на символ текста.
+    """
+
+    def __init__(self, name="fake", first_chunk_ms=300.0, realtime_factor=0.3, ms_per_char=60, chunk_ms=200,
+                 sample_rate=24000, fail_rate=0.0, setup_ms=150.0, max_concurrency=TTS_PROVIDER_CONCURRENCY,
+                 rate_per_min=0.0, rate_burst=1):
+        super().__init__(max_concurrency)
+        self.name = name
+        self.model = f"fake-{name}"
+        self.first_chunk_ms = first_chunk_ms
+        self.realtime_factor = realtime_factor
+        self.ms_per_char = ms_per_char
+        self.chunk_ms = chunk_ms
+        self.sample_rate = sample_rate
+        self.fail_rate = fail_rate
+        self.setup_ms = setup_ms
+        self.rate_per_min = rate_per_min
+        self.rate_burst = rate_burst
+
+    def _create_client(self):
+        # Как у настоящего SDK: создание клиента — handshake и инициализация
+        time.sleep(self.setup_ms / 1000)
+        return object()
+
+    def _synthesize(self, client, text: str, voice: Voice) -> Iterator[bytes]:
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ProviderError(502, f"{self.name}: fake upstream failure")
+        time.sleep(self.first_chunk_ms / 1000)
+        total_ms = max(self.chunk_ms, len(text) * self.ms_per_char)
+        samples_per_chunk = self.sample_rate * self.chunk_ms // 1000
+        for offset in range(0, total_ms, self.chunk_ms):
+            start = offset * self.sample_rate // 1000
+            yield _tone(start, samples_per_chunk, self.sample_rate)
+            time.sleep(self.chunk_ms * self.realtime_factor / 1000)
+
+
+def _tone(start: int, count: int, sample_rate: int, freq: float = 220.0) -> bytes:
+    return struct.pack(
+        f"<{count}h",
+        *(int(6000 * math.sin(2 * math.pi * freq * (start + i) / sample_rate)) for i in range(count)),
+    )
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def _summary(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0, "p50": 0.0, "p95": 0.0}
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[len(ordered) // 2], 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1),
+    }
+
+
+def _build_providers() -> dict[str, TTSProvider]:
+    if TTS_FAKE_PROVIDERS:
+        return {
+            "gemini": FakeProvider("gemini"),
+            "speechkit": FakeProvider("speechkit", first_chunk_ms=500, realtime_factor=0.0),
+            "fake": FakeProvider(),
+        }
+    return {"gemini": GeminiProvider(), "speechkit": SpeechKitProvider(), "fake": FakeProvider()}
+
+
+PROVIDERS: dict[str, TTSProvider] = _build_providers()
+
+
+def get_provider(name: str) -> TTSProvider:
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ProviderError(400, f"Unknown TTS provider: {name}")
+
+
+def start_providers():
+    """Старт сервиса: заранее поднимаем клиентов всех провайдеров (в фоне, не задерживая старт)."""
+    for provider in PROVIDERS.values():
+        threading.Thread(target=provider.start, name=f"tts-start-{provider.name}", daemon=True).start()
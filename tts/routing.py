@@ -0,0 +1,299 @@
+import bisect
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from cache import lookup, upstream_stream
+from providers import ProviderError, TTSProvider, Voice, get_provider
+
+# Порядок провайдеров по умолчанию и политика: ordered — как указано, latency — по гистограммам
+TTS_ROUTE_ORDER = [name.strip() for name in os.getenv("TTS_ROUTE_ORDER", "gemini,speechkit").split(",") if name.strip()]
+TTS_ROUTE_POLICY = os.getenv("TTS_ROUTE_POLICY", "latency")
+# Хеджирование: если первого чанка нет за столько мс — параллельно запрашиваем следующего провайдера; 0 — выключено
+TTS_HEDGE_MS = float(os.getenv("TTS_HEDGE_MS", "0"))
+# Первого чанка нет за столько мс — попытка считается неудачной, переходим к следующему провайдеру
+TTS_FIRST_BYTE_TIMEOUT_MS = float(os.getenv("TTS_FIRST_BYTE_TIMEOUT_MS", "8000"))
+# Пока у провайдера меньше замеров, считаем его время до первого чанка равным TTS_ROUTE_PRIOR_MS
+TTS_ROUTE_MIN_SAMPLES = int(os.getenv("TTS_ROUTE_MIN_SAMPLES", "5"))
+TTS_ROUTE_PRIOR_MS = float(os.getenv("TTS_ROUTE_PRIOR_MS", "1000"))
+
+# Голоса по умолчанию: имена голосов у провайдеров разные
+DEFAULT_VOICES = {"gemini": "Zephyr", "speechkit": "jane"}
+
+_BUCKETS_MS = [50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 8000, 13000, 20000]
+_OUTCOME_WINDOW = 50
+
+
+class LatencyHistogram:
+    """Гистограмма времени до первого чанка с фиксированными корзинами (мс)."""
+
+    def __init__(self, buckets=_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.total += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля: линейная интерполяция внутри корзины."""
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1] * 2
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return float(self.buckets[-1])
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{b}" for b in self.buckets] + ["inf"]
+        return {label: count for label, count in zip(labels, self.counts) if count}
+
+
+class _ProviderStats:
+    def __init__(self):
+        self.first_chunk = LatencyHistogram()
+        self.outcomes: deque = deque(maxlen=_OUTCOME_WINDOW)  # True — успех, False — ошибка/таймаут
+        self.counters = {"attempts": 0, "wins": 0, "errors": 0, "timeouts": 0, "hedges": 0, "cache_hits": 0}
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def expected_ms(self) -> float:
+        p50 = self.first_chunk.quantile(0.5) if self.first_chunk.total >= TTS_ROUTE_MIN_SAMPLES else None
+        # Ошибки дороги: после них ждём следующего провайдера, поэтому штрафуем пропорционально доле ошибок
+        return (p50 if p50 is not None else TTS_ROUTE_PRIOR_MS) * (1 + 2 * self.error_rate())
+
+
+class _Attempt:
+    def __init__(self, provider: TTSProvider, voice: Voice, hedge: bool):
+        self.provider = provider
+        self.voice = voice
+        self.hedge = hedge
+        self.started = time.perf_counter()
+        self.chunks: queue.Queue = queue.Queue()
+        self.cancelled = False
+        self.outcome = "pending"  # pending | ok | error | timeout | cancelled
+
+
+_END = object()
+
+
+@dataclass
+class RouteResult:
+    provider: TTSProvider
+    chunks: Iterator[bytes]
+    first_chunk_ms: float
+    attempts: list[str] = field(default_factory=list)  # "gemini:timeout", "speechkit:ok", ...
+    cached: bool = False
+
+
+class Router:
+    """
+    Выбор провайдера для /v2/synthesize: кандидаты по порядку (или по ожидаемому времени
+    до первого чанка из гистограмм), при ошибке или таймауте первого чанка — следующий,
+    при хеджировании второй запрос уходит, не дожидаясь провала первого. Побеждает тот,
+    кто первым прислал аудио; проигравшие досинтезируют в кэш через планировщик.
+    """
+
+    def __init__(self, order=TTS_ROUTE_ORDER, policy=TTS_ROUTE_POLICY):
+        self.order = list(order)
+        self.policy = policy
+        self._stats: dict[str, _ProviderStats] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="tts-route")
+
+    def candidates(self, providers: Optional[list[TTSProvider]] = None) -> list[TTSProvider]:
+        """Явно переданный список — как есть; иначе TTS_ROUTE_ORDER, переупорядоченный политикой."""
+        if providers is not None:
+            return providers
+        providers = [get_provider(name) for name in self.order]
+        if self.policy != "latency":
+            return providers
+        with self._lock:
+            expected = {p.name: self._stat(p.name).expected_ms() for p in providers}
+        # sorted устойчив: при равных оценках сохраняется заданный порядок
+        return sorted(providers, key=lambda p: expected[p.name])
+
+    def stream(self, text: str, voices: dict[str, Voice], providers: Optional[list[TTSProvider]] = None,
+               hedge_ms: float = TTS_HEDGE_MS, timeout_ms: float = TTS_FIRST_BYTE_TIMEOUT_MS) -> RouteResult:
+        """Блокирует до первого чанка победителя. Если не удалось никому — ProviderError последней попытки."""
+        started = time.perf_counter()
+        candidates = self.candidates(providers)
+        if not candidates:
+            raise ProviderError(400, "No TTS providers to route to")
+        voice_for = {p.name: voices.get(p.name) or Voice(voice=DEFAULT_VOICES.get(p.name, "")) for p in candidates}
+
+        for provider in candidates:
+            pcm = lookup(provider, text, voice_for[provider.name])
+            if pcm is not None:
+                self._count(provider.name, "cache_hits")
+                return RouteResult(provider, (chunk for chunk in [pcm]), _elapsed_ms(started), [f"{provider.name}:cache"], cached=True)
+
+        events: queue.Queue = queue.Queue()
+        attempts: list[_Attempt] = []
+        pending = list(candidates)
+        last_error: Optional[ProviderError] = None
+
+        def launch(hedge: bool):
+            provider = pending.pop(0)
+            attempt = _Attempt(provider, voice_for[provider.name], hedge)
+            attempts.append(attempt)
+            self._count(provider.name, "attempts")
+            if hedge:
+                self._count(provider.name, "hedges")
+            self._pool.submit(self._run, attempt, text, events)
+
+        launch(hedge=False)
+        while True:
+            active = [a for a in attempts if a.outcome == "pending"]
+            if not active:
+                if not pending:
+                    for attempt in attempts:
+                        attempt.cancelled = True
+                    raise last_error or ProviderError(504, "All TTS providers timed out")
+                launch(hedge=False)
+                continue
+
+            now = time.perf_counter()
+            deadlines = [a.started + timeout_ms / 1000 for a in active]
+            if hedge_ms > 0 and pending:
+                deadlines.append(max(a.started for a in active) + hedge_ms / 1000)
+            try:
+                attempt, kind, error = events.get(timeout=max(0.0, min(deadlines) - now))
+            except queue.Empty:
+                now = time.perf_counter()
+                for a in active:
+                    if now - a.started >= timeout_ms / 1000:
+                        a.outcome = "timeout"
+                        a.cancelled = True
+                        self._outcome(a.provider.name, False, "timeouts")
+                        last_error = ProviderError(504, f"{a.provider.name}: no audio within {timeout_ms:.0f} ms")
+                still_active = any(a.outcome == "pending" for a in attempts)
+                if hedge_ms > 0 and pending and still_active and \
+                        now - max(a.started for a in attempts if a.outcome == "pending") >= hedge_ms / 1000:
+                    launch(hedge=True)
+                continue
+
+            if attempt.outcome != "pending":
+                continue  # событие от уже снятой попытки
+            if kind == "error":
+                attempt.outcome = "error"
+                last_error = error if isinstance(error, ProviderError) else ProviderError(502, f"Upstream error: {error}")
+                continue
+
+            # Первый чанк: победитель найден, остальные снимаются
+            attempt.outcome = "ok"
+            self._count(attempt.provider.name, "wins")
+            for other in attempts:
+                if other is not attempt and other.outcome == "pending":
+                    other.outcome = "cancelled"
+                    other.cancelled = True
+            return RouteResult(
+                attempt.provider,
+                self._follow(attempt),
+                _elapsed_ms(started),
+                [f"{a.provider.name}:{a.outcome}" + (":hedge" if a.hedge else "") for a in attempts],
+            )
+
+    def metrics(self) -> dict:
+        order = [p.name for p in self.candidates()]
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "order": order,
+                "providers": {
+                    name: {
+                        **s.counters,
+                        "error_rate": round(s.error_rate(), 3),
+                        "expected_first_chunk_ms": round(s.expected_ms(), 1),
+                        "first_chunk_ms": {
+                            "count": s.first_chunk.total,
+                            "p50": _round(s.first_chunk.quantile(0.5)),
+                            "p95": _round(s.first_chunk.quantile(0.95)),
+                            "histogram": s.first_chunk.to_dict(),
+                        },
+                    }
+                    for name, s in self._stats.items()
+                },
+            }
+
+    # --- Внутреннее ---
+
+    def _stat(self, name: str) -> _ProviderStats:
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats[name] = _ProviderStats()
+        return stat
+
+    def _count(self, name: str, counter: str):
+        with self._lock:
+            self._stat(name).counters[counter] += 1
+
+    def _outcome(self, name: str, ok: Optional[bool], counter: Optional[str] = None,
+                 first_chunk_ms: Optional[float] = None):
+        with self._lock:
+            stat = self._stat(name)
+            if ok is not None:
+                stat.outcomes.append(ok)
+            if counter:
+                stat.counters[counter] += 1
+            if first_chunk_ms is not None:
+                stat.first_chunk.observe(first_chunk_ms)
+
+    def _run(self, attempt: _Attempt, text: str, events: queue.Queue):
+        """Поток попытки: пересылает чанки в очередь попытки, о первом чанке и ошибке сообщает роутеру."""
+        first = True
+        try:
+            for chunk in upstream_stream(attempt.provider, text, attempt.voice):
+                if first:
+                    first = False
+                    # Время до первого чанка пишем и для проигравших, и для опоздавших — это честный
+                    # замер провайдера; успехом опоздание после таймаута не считается
+                    ok = None if attempt.outcome == "timeout" else True
+                    self._outcome(attempt.provider.name, ok, first_chunk_ms=_elapsed_ms(attempt.started))
+                    events.put((attempt, "first", None))
+                if attempt.cancelled:
+                    return
+                attempt.chunks.put(chunk)
+        except Exception as e:
+            if first:
+                if attempt.outcome == "pending":
+                    self._outcome(attempt.provider.name, False, "errors")
+                events.put((attempt, "error", e))
+            attempt.chunks.put(e)
+            return
+        attempt.chunks.put(_END)
+
+    def _follow(self, attempt: _Attempt) -> Iterator[bytes]:
+        try:
+            while True:
+                item = attempt.chunks.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            attempt.cancelled = True
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+router = Router()
@@ -0,0 +1,291 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+from providers import ProviderError, TTSProvider, Voice, _summary
+
+# Приоритеты очереди к апстриму: меньше — раньше
+PRIORITY_LIVE = 0       # реплика интервьюера, которую ждёт кандидат
+PRIORITY_PREFETCH = 1   # следующие предложения ответа (pipeline)
+PRIORITY_PREWARM = 2    # прогрев кэша и пакетные задания
+
+# Сколько запрос может простоять в очереди и сколько их может ждать одновременно, затем 429
+TTS_QUEUE_TIMEOUT_S = float(os.getenv("TTS_QUEUE_TIMEOUT_S", "30"))
+TTS_QUEUE_MAX = int(os.getenv("TTS_QUEUE_MAX", "256"))
+
+_LATENCY_WINDOW = 1000
+
+
+class TokenBucket:
+    """rate_per_min запросов в минуту с запасом burst; rate_per_min <= 0 — без ограничения."""
+
+    def __init__(self, rate_per_min: float, burst: int):
+        self.rate = rate_per_min / 60
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self) -> float:
+        """0 — токен взят, иначе сколько секунд подождать до следующего."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        # Апстрим сам ответил 429 — не шлём ничего, пока не пройдёт Retry-After
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class _Flight:
+    """Один запрос к апстриму; все одинаковые запросы читают его чанки с начала."""
+
+    def __init__(self, key: str, priority: int):
+        self.key = key
+        self.priority = priority
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.cond = threading.Condition()
+        self.entry: Optional[list] = None  # запись в очереди полосы, пока ждёт допуска
+
+    def publish(self, chunk: bytes):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[Exception] = None):
+        with self.cond:
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def follow(self) -> Iterator[bytes]:
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                new = self.chunks[index:]
+                index = len(self.chunks)
+                done, error = self.done, self.error
+            yield from new
+            if done and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class _Lane:
+    """
+    Очередь к одному апстриму (провайдер + ключ): допуск по приоритету, если есть
+    токен в ведре и свободный клиент в пуле провайдера. Допуском занимается поток-диспетчер
+    полосы; поток под запрос берётся только после допуска, из собственного пула полосы
+    размером с лимит параллельности — ожидающие запросы не занимают потоки, а полосы
+    не мешают друг другу.
+    """
+
+    def __init__(self, name: str, bucket: TokenBucket, limit: int):
+        self.name = name
+        self.bucket = bucket
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self.heap: list[list] = []
+        self.cond = threading.Condition()
+        self.counters = {"admitted": 0, "rejected": 0, "coalesced": 0, "upstream_errors": 0, "rate_limited": 0}
+        self.queue_wait: dict[int, deque] = {}
+        self.upstream_ms: deque = deque(maxlen=_LATENCY_WINDOW)
+        self._workers = ThreadPoolExecutor(max_workers=self.limit, thread_name_prefix=f"tts-{name}")
+        threading.Thread(target=self._dispatch, name=f"tts-lane-{name}", daemon=True).start()
+
+    def submit(self, flight: _Flight, seq: int, run: Callable[[Optional[ProviderError]], None]):
+        """
+        Ставит запрос в очередь. run() вызывается в потоке полосы после допуска,
+        run(error) — если запрос простоял дольше TTS_QUEUE_TIMEOUT_S.
+        """
+        with self.cond:
+            if len(self.heap) >= TTS_QUEUE_MAX:
+                self.counters["rejected"] += 1
+                raise ProviderError(429, f"{self.name}: synthesis queue is full", retry_after=1)
+            # [приоритет, порядок, запрос, дедлайн, время постановки, run]
+            entry = [flight.priority, seq, flight, time.monotonic() + TTS_QUEUE_TIMEOUT_S, time.perf_counter(), run]
+            flight.entry = entry
+            heapq.heappush(self.heap, entry)
+            self.cond.notify_all()
+
+    def _dispatch(self):
+        while True:
+            admitted, expired, retry_after = self._next()
+            for entry in expired:
+                entry[5](ProviderError(429, f"{self.name}: rate limit queue timeout", retry_after=retry_after))
+            if admitted is not None:
+                self._workers.submit(admitted[5], None)
+
+    def _next(self) -> tuple[Optional[list], list, int]:
+        """Ждёт, пока голову очереди можно допустить или у кого-то истечёт ожидание."""
+        with self.cond:
+            while True:
+                wait = None
+                if self.heap and self.in_flight < self.limit:
+                    wait = self.bucket.take()
+                    if wait == 0:
+                        entry = heapq.heappop(self.heap)
+                        entry[2].entry = None
+                        self.in_flight += 1
+                        self.counters["admitted"] += 1
+                        waited = (time.perf_counter() - entry[4]) * 1000
+                        self.queue_wait.setdefault(entry[2].priority, deque(maxlen=_LATENCY_WINDOW)).append(waited)
+                        return entry, [], 0
+                    self.counters["rate_limited"] += 1
+                now = time.monotonic()
+                expired = [entry for entry in self.heap if entry[3] <= now]
+                if expired:
+                    for entry in expired:
+                        self.heap.remove(entry)
+                        entry[2].entry = None
+                    heapq.heapify(self.heap)
+                    self.counters["rejected"] += len(expired)
+                    return None, expired, math.ceil(wait) if wait else 1
+                timeout = min(entry[3] for entry in self.heap) - now if self.heap else None
+                if wait:
+                    timeout = min(timeout, wait) if timeout is not None else wait
+                self.cond.wait(timeout)
+
+    def release(self, upstream_ms: Optional[float], error: Optional[ProviderError] = None):
+        with self.cond:
+            self.in_flight -= 1
+            if upstream_ms is not None:
+                self.upstream_ms.append(upstream_ms)
+            if error is not None:
+                self.counters["upstream_errors"] += 1
+                if error.status_code == 429:
+                    self.bucket.block(error.retry_after or 1)
+            self.cond.notify_all()
+
+    def boost(self, flight: _Flight, priority: int):
+        """Живой запрос присоединился к фоновому — поднимаем ожидающий запрос в очереди."""
+        with self.cond:
+            if priority >= flight.priority:
+                return
+            flight.priority = priority
+            if flight.entry is not None:
+                flight.entry[0] = priority
+                heapq.heapify(self.heap)
+                self.cond.notify_all()
+
+    def metrics(self) -> dict:
+        with self.cond:
+            return {
+                "queue_depth": len(self.heap),
+                "in_flight": self.in_flight,
+                "limit": self.limit,
+                "rate_per_min": round(self.bucket.rate * 60, 2),
+                "burst": self.bucket.burst,
+                **self.counters,
+                "queue_wait_ms": {_PRIORITY_NAMES.get(p, str(p)): _summary(v) for p, v in sorted(self.queue_wait.items())},
+                "upstream_ms": _summary(self.upstream_ms),
+            }
+
+
+_PRIORITY_NAMES = {PRIORITY_LIVE: "live", PRIORITY_PREFETCH: "prefetch", PRIORITY_PREWARM: "prewarm"}
+
+
+class Scheduler:
+    """
+    Все обращения к апстримам идут через планировщик: одинаковые запросы в полёте
+    склеиваются в один, остальные ждут в очереди своей полосы (token bucket на провайдер
+    и ключ, лимит параллельности = пул клиентов провайдера). Сам запрос к апстриму
+    выполняется в потоке полосы, поэтому ушедший клиент не обрывает синтез для остальных.
+    """
+
+    def __init__(self):
+        self._lanes: dict[str, _Lane] = {}
+        self._flights: dict[str, tuple[_Flight, _Lane]] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+
+    def stream(self, provider: TTSProvider, text: str, voice: Voice, key: str, priority: int = PRIORITY_LIVE,
+               on_complete: Optional[Callable[[bytes], None]] = None) -> Iterator[bytes]:
+        """
+        PCM-чанки синтеза. key — ключ склейки (ключ кэша), on_complete(pcm) вызывается
+        один раз, когда апстрим успешно отдал всё аудио.
+        """
+        with self._lock:
+            existing = self._flights.get(key)
+            if existing is not None:
+                flight, lane = existing
+                with lane.cond:
+                    lane.counters["coalesced"] += 1
+            else:
+                lane = self._lane(provider)
+                flight = _Flight(key, priority)
+                self._flights[key] = (flight, lane)
+        if existing is not None:
+            lane.boost(flight, priority)
+        else:
+            try:
+                lane.submit(flight, next(self._seq),
+                            lambda error: self._run(flight, lane, provider, text, voice, on_complete, error))
+            except ProviderError as e:
+                self._finish(flight, e)
+        return flight.follow()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lanes = list(self._lanes.values())
+            in_flight = len(self._flights)
+        return {"flights": in_flight, "lanes": {lane.name: lane.metrics() for lane in lanes}}
+
+    # --- Внутреннее ---
+
+    def _lane(self, provider: TTSProvider) -> _Lane:
+        name = provider.quota_key
+        lane = self._lanes.get(name)
+        if lane is None:
+            bucket = TokenBucket(provider.rate_per_min, provider.rate_burst)
+            lane = self._lanes[name] = _Lane(name, bucket, provider.max_concurrency)
+        return lane
+
+    def _run(self, flight: _Flight, lane: _Lane, provider: TTSProvider, text: str, voice: Voice, on_complete,
+             rejected: Optional[ProviderError] = None):
+        if rejected is not None:
+            self._finish(flight, rejected)
+            return
+        error = None
+        started = time.perf_counter()
+        try:
+            for chunk in provider.stream(text, voice):
+                flight.publish(chunk)
+        except Exception as e:
+            error = e
+        lane.release(None if error else (time.perf_counter() - started) * 1000,
+                     error if isinstance(error, ProviderError) else None)
+        if error is None and on_complete is not None and flight.chunks:
+            try:
+                on_complete(b"".join(flight.chunks))
+            except Exception as e:
+                print(f"TTS scheduler: on_complete failed: {e}")
+        self._finish(flight, error)
+
+    def _finish(self, flight: _Flight, error: Optional[Exception]):
+        with self._lock:
+            self._flights.pop(flight.key, None)
+        flight.finish(error)
+
+
+scheduler = Scheduler()